@@ -0,0 +1,215 @@
+"""
+Purpose:  This module contains the Parquet archive tier for the downloaders.
+Rows moved out of an archived<table> are streamed in chunks into Parquet files
+partitioned by country and month of postdate, and every file written is listed
+in a manifest so that step2 can read only the columns and months it needs.
+The manifest is shared by all tables and countries of a site, so it is only
+updated under a lock and replaced in one step.
+
+Layout of an archive directory:
+    <archivedir>/<table>/country=<country>/month=<YYYY-MM>/part-<YYYYMMDD>.parquet
+    <archivedir>/manifest.json
+"""
+
+import datetime
+import json
+import os
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import ArchiveConfig
+from processlock import FileLock
+
+
+def get_arrow_schema(conn, tablename):
+    """Map the declared sqlite column types of a table onto an arrow schema.
+    INTEGER columns become int64, REAL columns float64 and everything else string.
+    """
+
+    fields = []
+    for row in conn.execute("PRAGMA table_info(%s);" % (tablename)).fetchall():
+        name, coltype = row[1], (row[2] or '').upper()
+        if 'INT' in coltype:
+            fields.append(pa.field(name, pa.int64()))
+        elif 'REAL' in coltype or 'FLOA' in coltype or 'DOUB' in coltype:
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return(pa.schema(fields))
+
+
+def _to_text(value):
+    # text columns hold a mix of str, utf-8 encoded bytes and NULL
+    if value is None or (isinstance(value, float) and value != value):
+        return(None)
+    if isinstance(value, bytes):
+        return(value.decode('utf-8', errors='replace'))
+    return(str(value))
+
+
+def to_arrow(df, schema):
+    """Convert a chunk read from sqlite into an arrow table with the given schema.
+    Values that cannot be converted to a numeric column type are stored as null.
+    """
+
+    arrays = []
+    for field in schema:
+        values = df[field.name] if field.name in df.columns else pd.Series([None]*len(df))
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            values = pd.to_numeric(values, errors='coerce')
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+        else:
+            arrays.append(pa.array([_to_text(v) for v in values], type=field.type))
+    return(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def partition_months(postdates):
+    """Return the YYYY-MM partition of each postdate, 'unknown' if it cannot be parsed."""
+
+    dates = pd.to_datetime(pd.Series(postdates).astype(str), errors='coerce')
+    return([d.strftime('%Y-%m') if not pd.isnull(d) else 'unknown' for d in dates])
+
+
+class ArchiveStore(object):
+    """Writes archived rows of a database into partitioned Parquet files and keeps
+    a manifest of the files written.
+    """
+
+    def __init__(self, archivedir, compression=ArchiveConfig.COMPRESSION):
+        self.archivedir = archivedir
+        self.compression = compression
+        self.manifestpath = os.path.join(archivedir, 'manifest.json')
+        self.lockpath = os.path.join(archivedir, 'manifest.lock')
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifestpath):
+            return([])
+        with open(self.manifestpath, 'r') as f:
+            return(json.load(f))
+
+    def _save_manifest(self, entries):
+        # write to a temporary file first so a failed run never leaves a broken manifest
+        fd, temppath = tempfile.mkstemp(prefix='manifest', suffix='.tmp', dir=self.archivedir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=1)
+            os.replace(temppath, self.manifestpath)
+        except Exception:
+            os.remove(temppath)
+            raise
+
+    def add_entries(self, entries):
+        """Append entries to the manifest.  The manifest is read and replaced under
+        the lock so entries added by another process at the same time are kept.
+        """
+
+        if not os.path.exists(self.archivedir):
+            os.makedirs(self.archivedir)
+        with FileLock(self.lockpath):
+            self._save_manifest(self.load_manifest() + entries)
+
+    def _partition_path(self, table, country, month, datestr):
+        partdir = os.path.join(self.archivedir, table, 'country=%s' % (country), 'month=%s' % (month))
+        if not os.path.exists(partdir):
+            os.makedirs(partdir)
+        path = os.path.join(partdir, 'part-%s.parquet' % (datestr))
+        n = 1
+        while os.path.exists(path):
+            path = os.path.join(partdir, 'part-%s-%d.parquet' % (datestr, n))
+            n += 1
+        return(path)
+
+    def remove_files(self, entries):
+        """Delete the files of manifest entries that were written but not added to the manifest."""
+
+        for entry in entries:
+            path = os.path.join(self.archivedir, entry['file'])
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_files(self, conn, srctable, table, datecur, country=None, chunksize=ArchiveConfig.CHUNKSIZE):
+        """Stream the rows of srctable, only those of country if it is given, into
+        Parquet files for table, one file per (country, month) partition.  Rows are
+        read chunksize at a time so the archive never has to fit in memory.  Returns
+        the manifest entries of the files written, which are not added to the manifest,
+        so a caller can drop the files if the rows they hold are not cleared.  Files of
+        a run that fails part way are deleted.
+        """
+
+        schema = get_arrow_schema(conn, srctable)
+        datestr = datecur.strftime('%Y%m%d')
+        writers = {}
+        counts = {}
+        if country is None:
+            query, params = """SELECT * FROM %s;""" % (srctable), None
+        else:
+            query, params = """SELECT * FROM %s WHERE country = ?;""" % (srctable), [country]
+        try:
+            for chunk in pd.read_sql(query, conn, params=params, chunksize=chunksize):
+                if len(chunk) == 0:
+                    continue
+                chunk['_country'] = chunk['country'].map(_to_text).fillna('unknown') if 'country' in chunk.columns else 'unknown'
+                chunk['_month'] = partition_months(chunk['postdate']) if 'postdate' in chunk.columns else 'unknown'
+                for key, part in chunk.groupby(['_country', '_month']):
+                    if key not in writers:
+                        path = self._partition_path(table, key[0], key[1], datestr)
+                        writers[key] = (path, pq.ParquetWriter(path, schema, compression=self.compression))
+                        counts[key] = 0
+                    writers[key][1].write_table(to_arrow(part, schema))
+                    counts[key] += len(part)
+        except Exception:
+            for path, writer in writers.values():
+                writer.close()
+                os.remove(path)
+            raise
+        for path, writer in writers.values():
+            writer.close()
+
+        entries = []
+        created = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for (partcountry, month), (path, writer) in sorted(writers.items()):
+            entries.append({
+                'table': table,
+                'country': partcountry,
+                'month': month,
+                'file': os.path.relpath(path, self.archivedir).replace(os.sep, '/'),
+                'rows': counts[(partcountry, month)],
+                'bytes': os.path.getsize(path),
+                'columns': schema.names,
+                'created': created,
+            })
+        print("Wrote %d rows of %s into %d parquet files" % (sum(counts.values()), srctable, len(writers)))
+        return(entries)
+
+    def write_table(self, conn, srctable, table, datecur, country=None, chunksize=ArchiveConfig.CHUNKSIZE):
+        """Write the rows of srctable into Parquet files like write_files and add them to
+        the manifest.  Returns the number of rows written.
+        """
+
+        entries = self.write_files(conn, srctable, table, datecur, country=country, chunksize=chunksize)
+        if len(entries) > 0:
+            self.add_entries(entries)
+        return(sum([entry['rows'] for entry in entries]))
+
+
+def read_archive(archivedir, table, columns=None, countries=None, months=None):
+    """Read archived rows of table into a DataFrame.  Only the files listed in the
+    manifest for the requested countries and months are opened and only the
+    requested columns are read.
+    """
+
+    store = ArchiveStore(archivedir)
+    frames = []
+    for entry in store.load_manifest():
+        if entry['table'] != table:
+            continue
+        if countries is not None and entry['country'] not in countries:
+            continue
+        if months is not None and entry['month'] not in months:
+            continue
+        path = os.path.join(archivedir, entry['file'])
+        frames.append(pq.read_table(path, columns=columns).to_pandas())
+    if len(frames) == 0:
+        return(pd.DataFrame(columns=columns))
+    return(pd.concat(frames, ignore_index=True))
@@ -7,6 +7,10 @@ Author:  Natalie Chun
 Created: 22 November 2018
 """
 
+import os
+import collections
+import concurrent.futures
+import traceback
 import urllib
 import urllib.request
 from bs4 import BeautifulSoup
@@ -18,46 +22,440 @@ import time
 import random
 import csv
 import sqlite3
+from config import FetchConfig, DatabaseConfig, FrontierConfig, RawStoreConfig
+from fetchengine import get_engine
+from dbconnect import connect_db, close_db
+from create_databases import create_indexes
+from migrations import migrate, get_columns
+from archivestore import ArchiveStore
+from frontier import Frontier
+from seenids import SeenIds
+from rawstore import RawStore, read_body, TIMEFORMAT
+from pipeline import Pipeline, get_parse_pool
+from htmlparse import make_soup, region_hash
+
+
+class RowSink(object):
+    """Buffer rows for each table and write them out together with executemany.
+    Keeps track of the rows written per table so that write rates can be reported.
+    """
+
+    def __init__(self, write, batchsize=DatabaseConfig.BATCHSIZE):
+        self.write = write
+        self.batchsize = batchsize
+        self.buffers = {}
+        self.numrows = 0
+        self.stats = {}
+
+    def add(self, table, query, row):
+        """Buffer a row and flush all buffers once there are batchsize rows."""
+
+        key = (table, query)
+        if key not in self.buffers:
+            self.buffers[key] = []
+        self.buffers[key].append(row)
+        if table not in self.stats:
+            self.stats[table] = {'rows': 0, 'flushes': 0, 'start': time.time(), 'end': time.time()}
+        self.numrows += 1
+        if self.numrows >= self.batchsize:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in a single batch."""
+
+        if self.numrows == 0:
+            return
+        batch = [(query, rows) for (table, query), rows in self.buffers.items() if len(rows) > 0]
+        self.write(batch)
+        for (table, query), rows in self.buffers.items():
+            self.stats[table]['rows'] += len(rows)
+            self.stats[table]['flushes'] += 1
+            self.stats[table]['end'] = time.time()
+        self.buffers = {}
+        self.numrows = 0
+
+    def report(self):
+        """Print rows written and rows/sec for each table."""
+
+        for table, stats in self.stats.items():
+            seconds = max(stats['end'] - stats['start'], 1e-6)
+            print("Table %s: %d rows in %d flushes (%.1f rows/sec)" % (table, stats['rows'], stats['flushes'], stats['rows']/seconds))
+
+
+def _reparse_chunk(cls, params, storedir, entries, seeds=()):
+    """Parse stored pages in a worker process.  Returns the (table, query, row) to write.
+    Pages are replayed as visits in fetch order, so a page with the same content as the
+    previous visit of its ad is only recorded as unchanged, as it was when it was fetched.
+    seeds are the last fetches of the ads before the first of entries, only used for their hash.
+    """
+
+    parser = cls.parser(params)
+    previous = {}
+    for url, fetchtime, uid, postdate, segment, offset, length in seeds:
+        previous[uid] = parser._visit_hash(read_body(storedir, segment, offset, length))[1]
+    rows = []
+    for url, fetchtime, uid, postdate, segment, offset, length in entries:
+        try:
+            body = read_body(storedir, segment, offset, length)
+            fetchtime = datetime.datetime.strptime(fetchtime, TIMEFORMAT)
+            visit = parser._parse_visit(url, body, fetchtime, uid, postdate, previous.get(uid))
+            previous.update([(uid, row[2]) for table, query, row in visit if table == 'pagehashes'])
+            rows.extend(visit)
+        except Exception:
+            print("Error parsing %s fetched at %s" % (url, fetchtime))
+            traceback.print_exc()
+    return(rows)
+
+
+def export_archive(extdir, dbname, tables, countries, datecur):
+    """Write the rows of archived<table> of each country into the Parquet archive of
+    a site and clear them, so that only unique data is stored.  Run once per database
+    after the jobs writing to it have finished.  Each table and country is exported
+    and cleared in one transaction so no row is cleared without being written.  The
+    files are only added to the manifest once the rows are cleared, and are deleted if
+    clearing them fails, so a later export never writes the same rows twice.
+    """
+
+    conn = connect_db(os.path.join(extdir, dbname))
+    store = ArchiveStore(os.path.join(extdir, 'archive'))
+    try:
+        for table in tables:
+            for country in countries:
+                conn.execute("BEGIN IMMEDIATE;")
+                entries = []
+                try:
+                    entries = store.write_files(conn, 'archived%s' % (table), table, datecur, country=country)
+                    conn.execute("""DELETE FROM archived%s WHERE country = ?;""" % (table), [country])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    store.remove_files(entries)
+                    raise
+                if len(entries) > 0:
+                    store.add_entries(entries)
+                print("Number of archived page entries for %s in %s: %d" % (country, table, sum([entry['rows'] for entry in entries])))
+    finally:
+        close_db(conn)
 
 
 class BaseDownloader(object):
     """Base code for downloading data from various websites.  Specific application
     is for the download of job advertisement data, but can be applied more generally.
     """
+
+    # client of the database writer (dbwriter.WriterClient), if None writes go directly to self.conn
+    writer = None
+    _sink = None
+    _frontier = None
+    _rawstore = None
+    _seen = None
+    _parsepool = None
+    # parameters the downloader was created with, used to create parsers for re-parsing
+    params = None
+    # days after posting that ads in the frontier are revisited
+    maxrevisitdays = FrontierConfig.MAXAGE
+    # (table, fields) of page snapshots whose changes set how often an ad is revisited
+    revisithistory = None
+    # database file name, used to look up schema migrations
+    dbname = None
+    # (table, column) of the ad ids already collected, used to stop paging listings early
+    seenids = ('jobadpageurls', 'uid')
+    # strainer selecting the regions of an ad page that are hashed to find unchanged revisits, None to parse every visit
+    hashregions = None
+    pagehashquery = """INSERT OR REPLACE INTO pagehashes (country, uid, hash, hashtime) VALUES (?,?,?,?);"""
+    unchangedquery = """INSERT OR IGNORE INTO unchangedvisits (country, uid, downloaddate, downloadtime) VALUES (?,?,?,?);"""
+    hashquery = """SELECT uid, hash FROM pagehashes WHERE country = ? AND uid IN (%s);"""
+    # tables whose archived<table> rows are written to the Parquet archive by export_archive
+    archivetables = ()
     
     def __init__(self, db):
         super(BaseDownloader, self).__init__(db)
-        self.conn = sqlite3.connect(db)
-        self.cursor = conn.cursor()
+        self.conn = connect_db(db)
+        self.cursor = self.conn.cursor()
         self.datecur = datetime.datetime.now()
                 
     def _display_db_tables(self):
         query = """SELECT name FROM sqlite_master WHERE type='table';"""
         tablenames = self.cursor.execute(query).fetchall()
         for name in tablenames:
-            query = """SELECT * FROM %s""" % (name)
+            query = """SELECT COUNT(*) FROM %s""" % (name)
             temp = self.cursor.execute(query).fetchall()
-            print("Entries in table %s: %d" % (name[0], len(temp)))
+            print("Entries in table %s: %d" % (name[0], temp[0][0]))
+            # bookkeeping tables such as archivelog are not kept per country
+            if 'country' not in get_columns(self.conn, name[0]):
+                continue
             query = """SELECT DISTINCT * FROM %s WHERE country = '%s' LIMIT 5;""" % (name[0], self.country)
             temp = self.cursor.execute(query).fetchall()
             print(temp)
                 
+    @property
+    def engine(self):
+        """Fetch engine shared by all downloaders in this process."""
+        return(get_engine())
+
     def _request_until_succeed(self, url):
-        """URL request helper, set to only request a url 5 times before giving up."""
+        """URL request helper, set to only request a url FetchConfig.TRIES times before giving up.
+        Requests are paced and retried with backoff by the fetch engine.
+        """
         
-        req = urllib.request.Request(url)
-        count = 1
-        while count <= 5:
-            time.sleep(random.randint(3,6))
-            try: 
-                response = urllib.request.urlopen(req)
-                if response.getcode() == 200:
-                    return(response)
-            except Exception:
-                print("Error for URL %s : %s" % (url, datetime.datetime.now()))
-            count+=1
-        return(None)
+        return(self.engine.fetch(url))
+
+    def _fetch_pages(self, urls, chunksize=FetchConfig.CHUNKSIZE, keys=None):
+        """Fetch pages concurrently in chunks, yielding (url, response) in the order of urls.
+        Response is None if the url could not be retrieved.  Retrieved pages are kept in the
+        raw store under the (uid, postdate) in keys so they can be parsed again offline.
+        """
+
+        urls = list(urls)
+        for i in range(0, len(urls), chunksize):
+            chunk = urls[i:i+chunksize]
+            responses = self.engine.fetch_many(chunk)
+            if self.rawstore is not None:
+                fetchtime = datetime.datetime.now(self.tz)
+                chunkkeys = keys[i:i+chunksize] if keys is not None else [(None, None)] * len(chunk)
+                # the chunk is committed before it is handed on, so the shared index is never left locked
+                self.rawstore.put_many([(url, response, fetchtime, self.country, uid, postdate)
+                                        for url, response, (uid, postdate) in zip(chunk, responses, chunkkeys) if response is not None])
+            for url, response in zip(chunk, responses):
+                yield url, response
+
+    def _pipeline_pages(self, items, retry=True):
+        """Fetch and parse ad pages for a list of (url, uid, postdate) in the staged pipeline.
+        Yields ((url, uid, postdate), response, rows) where rows are the (table, query, row)
+        parsed by _parse_page, or None if the page could not be fetched.  Pages are kept in
+        the raw store here, the writer side of the pipeline.  Pages deferred by the fetch
+        engine are tried once more after the others instead of holding them up, if they
+        fail again self.engine.is_deferred(url) is True when they are yielded.
+        """
+
+        hashes = self._page_hashes([uid for url, uid, postdate in items]) if self.hashregions is not None else None
+        pipeline = Pipeline(self.engine, type(self), self.params, tz=self.tz, hashes=hashes, executor=self.parsepool)
+        deferred = []
+        for item, response, fetchtime, rows in pipeline.run(items):
+            url, uid, postdate = item
+            if rows is None and retry and self.engine.is_deferred(url):
+                deferred.append(item)
+                continue
+            if response is not None and self.rawstore is not None:
+                self.rawstore.put(url, response, fetchtime, self.country, uid, postdate)
+            yield item, response, rows
+        pipeline.report()
+        if len(deferred) == 0:
+            return
+        if self.engine.expired():
+            for item in deferred:
+                yield item, None, None
+            return
+        print("Retrying %d deferred pages" % (len(deferred)))
+        self.engine.take_deferred([url for url, uid, postdate in deferred])
+        for item, response, rows in self._pipeline_pages(deferred, retry=False):
+            yield item, response, rows
+
+    def _page_hashes(self, uids):
+        """Return {uid: hash} of the content of the last changed visit of the ads."""
+
+        self._sync()
+        hashes = {}
+        uids = [str(uid) for uid in uids]
+        for i in range(0, len(uids), 500):
+            chunk = uids[i:i+500]
+            query = self.hashquery % (','.join(['?']*len(chunk)))
+            for uid, digest in self.conn.execute(query, [self.country] + chunk).fetchall():
+                hashes[str(uid)] = digest
+        return(hashes)
+
+    def _defer_pages(self, uids, now):
+        """Make ads whose pages could not be fetched in this run due again after FetchConfig.RETRYDELAY hours."""
+
+        if len(uids) > 0:
+            print("Deferring %d pages that could not be fetched to the next run" % (len(uids)))
+            self.frontier.defer(uids, now + datetime.timedelta(hours=FetchConfig.RETRYDELAY))
+
+    @property
+    def rawstore(self):
+        """Store of raw fetched pages in the raw directory next to the database, None if disabled."""
+        if self._rawstore is None and RawStoreConfig.ENABLED:
+            self._rawstore = RawStore(os.path.join(self.extdir, 'raw'))
+        return(self._rawstore)
+
+    @property
+    def parsepool(self):
+        """Parse processes shared by the pipelines of this job, started on first use and shut down by close."""
+        if self._parsepool is None:
+            self._parsepool = get_parse_pool()
+        return(self._parsepool)
+
+    @classmethod
+    def parser(cls, params):
+        """Return a downloader without a database that can only parse pages."""
+
+        downloader = cls.__new__(cls)
+        downloader._set_params(params)
+        return(downloader)
+
+    def _set_params(self, params):
+        raise NotImplementedError
+
+    def _parse_page(self, url, response, fetchtime, uid, postdate):
+        """Parse a stored ad page, returning a list of (table, query, row) to write."""
+        raise NotImplementedError
+
+    def _parse_visit(self, url, response, fetchtime, uid, postdate, previous=None):
+        """Parse an ad page fetched on a visit.  The regions of the page selected by
+        self.hashregions are hashed first.  If the hash is previous, the hash of the last
+        visit, the page has not changed and only the visit is recorded in unchangedvisits.
+        Otherwise the page is parsed by _parse_page and its new hash is kept.
+        """
+
+        if self.hashregions is None:
+            return(self._parse_page(url, response, fetchtime, uid, postdate))
+        soup, digest = self._visit_hash(response)
+        fetchtime = fetchtime if fetchtime is not None else datetime.datetime.now(self.tz)
+        visit = [self.country, uid, fetchtime.strftime('%Y-%m-%d'), fetchtime.strftime('%H:%M')]
+        if digest == previous:
+            return([('unchangedvisits', self.unchangedquery, visit)])
+        rows = self._parse_page(url, soup, fetchtime, uid, postdate)
+        return(rows + [('pagehashes', self.pagehashquery, [self.country, uid, digest, '%s %s' % (visit[2], visit[3])])])
+
+    def _visit_hash(self, response):
+        """Return the page parsed with self.hashregions and the hash of its content."""
+
+        soup = make_soup(response, self.hashregions)
+        return(soup, region_hash(soup))
+
+    def reparse(self, workers=None, since=None, chunksize=RawStoreConfig.CHUNKSIZE):
+        """Rebuild the ad page rows of self.country from the raw store without any network
+        access.  Pages are parsed on a pool of worker processes (one per core by default)
+        and rows replace the ones written when the pages were first fetched.  The fetches
+        of an ad are parsed in order by the same worker, through _parse_visit as on a crawl.
+        """
+
+        starttime = time.time()
+        entries = self.rawstore.entries(country=self.country, since=since)
+        seeds = dict([(entry[2], entry) for entry in self.rawstore.last_before(self.country, since)]) if since is not None else {}
+        print("Re-parsing %d stored pages for %s" % (len(entries), self.country))
+        ads = collections.OrderedDict()
+        for entry in entries:
+            ads.setdefault(entry[2] if entry[2] is not None else entry[0], []).append(entry)
+        chunks = [[]]
+        for ad in ads.values():
+            if len(chunks[-1]) >= chunksize:
+                chunks.append([])
+            chunks[-1].extend(ad)
+        numrows = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_reparse_chunk, type(self), self.params, self.rawstore.storedir, chunk,
+                                       [seeds[uid] for uid in set([entry[2] for entry in chunk]) if uid in seeds])
+                       for chunk in chunks if len(chunk) > 0]
+            for future in futures:
+                for table, query, row in future.result():
+                    # only the parsed rows are rebuilt, other statements were applied when fetched
+                    if not query.strip().startswith('INSERT'):
+                        continue
+                    self._insert(table, query.replace('INSERT OR IGNORE', 'INSERT OR REPLACE'), row)
+                    numrows += 1
+        self._sync()
+        print("Re-parsed %d pages into %d rows in %.0f seconds" % (len(entries), numrows, time.time()-starttime))
         
+    def _execute(self, query, rows=((),)):
+        """Execute a write statement once for each row of parameters.  Writes go
+        through the database writer if one is set, otherwise they are committed directly.
+        """
+
+        self._flush_rows()
+        self._write_batch([(query, rows)])
+
+    def _transaction(self, statements):
+        """Execute a list of (query, rows) in one transaction, all or nothing.  Like other
+        writes it goes through the database writer if one is set.
+        """
+
+        self._flush_rows()
+        if self.writer is not None:
+            self.writer.transaction(statements)
+            return
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            for query, rows in statements:
+                self.conn.executemany(query, rows)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _write_batch(self, batch):
+        """Write a list of (query, rows) to the database writer or in one transaction on self.conn."""
+
+        if self.writer is not None:
+            for query, rows in batch:
+                self.writer.execute(query, rows)
+        else:
+            with self.conn:
+                for query, rows in batch:
+                    self.conn.executemany(query, rows)
+
+    @property
+    def sink(self):
+        """Row sink buffering inserts until a page is done or the batch is full."""
+        if self._sink is None:
+            self._sink = RowSink(self._write_batch)
+        return(self._sink)
+
+    @property
+    def frontier(self):
+        """Crawl frontier scheduling the visits of ad pages for self.country."""
+        if self._frontier is None:
+            self._frontier = Frontier(self.conn, self._execute, self._sync, self.country,
+                                      maxage=self.maxrevisitdays, history=self.revisithistory,
+                                      unchanged='unchangedvisits' if self.hashregions is not None else None)
+        return(self._frontier)
+
+    @property
+    def seen(self):
+        """Ids of the ads of self.country already collected, loaded on first use."""
+        if self._seen is None:
+            self._sync()
+            self._seen = SeenIds.load(self.conn, self.seenids[0], self.seenids[1], self.country)
+        return(self._seen)
+
+    def _insert(self, table, query, row):
+        """Buffer a row to be inserted into table, see _flush_rows."""
+
+        self.sink.add(table, query, row)
+
+    def _flush_rows(self):
+        """Write out all buffered rows in one transaction."""
+
+        if self._sink is not None:
+            self._sink.flush()
+
+    def _sync(self):
+        """Write out buffered rows and wait until all writes sent to the database
+        writer are committed so they can be read back.
+        """
+
+        self._flush_rows()
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """Write out any remaining rows, report write rates and close the database."""
+
+        if self.conn is None:
+            return
+        self._sync()
+        if self._sink is not None:
+            self._sink.report()
+        if self._rawstore is not None:
+            self._rawstore.report()
+            self._rawstore.close()
+            self._rawstore = None
+        if self._parsepool is not None:
+            self._parsepool.shutdown(wait=True)
+            self._parsepool = None
+        close_db(self.conn)
+        self.conn = None
+
     def _export_csv_data(self):
         """Export all data in sql into csv files."""
         
@@ -76,6 +474,7 @@ class BaseDownloader(object):
         exists insert from 29 days ago, otherwise only insert data posted after last date downloaded.
         """
         
+        self._sync()
         query = """SELECT MAX(%s) FROM %s WHERE country = '%s';""" % (datecol, table, self.country)
         lastdate = self.cursor.execute(query).fetchall()[0][0]
         print("Last Date Downloaded: {}".format(lastdate))
@@ -87,41 +486,65 @@ class BaseDownloader(object):
             lastdate = datetime.date(int(temp[0]),int(temp[1]),int(temp[2]))
         return(lastdate)
         
+    def _archive_watermark(self, table):
+        """Return (rundate, cutoffdate) of the last archive run for table and self.country,
+        (None, None) if there was none.
+        """
+
+        query = """SELECT rundate, cutoffdate FROM archivelog WHERE tablename = ? AND country = ? ORDER BY rundate DESC LIMIT 1;"""
+        row = self.conn.execute(query, [table, self.country]).fetchone()
+        return(row if row is not None else (None, None))
+
     def _archive_database(self, table, urltable, maxdays=90):
         """Create an archive database where information is selected from main database and placed into 
         stored archive.  This helps limit the amount of data stored on the cloud system.
+        Archiving is incremental: only ads of self.country downloaded since the last run (the
+        watermark in archivelog) or whose postdate has aged past the cutoff since the last run are
+        checked, and all rows of those ads are moved in one transaction sent to the database writer.
         """
 
-        query = '''INSERT OR IGNORE INTO archived%s SELECT * FROM %s WHERE uid in (SELECT DISTINCT uid FROM %s WHERE stat == 'CLOSED' OR DATE(postdate) < DATE('{}','-{} days'));''' % (table, table, table) 
-        temp1 = self.cursor.execute(query.format(self.datecur,maxdays))
-
-        query = '''DELETE FROM %s WHERE uid in (SELECT DISTINCT uid FROM archived%s);''' % (urltable, table)
-        self.cursor.execute(query)
-        temp2 = self.cursor.execute(query)
-
-        query = '''DELETE FROM %s WHERE uid in (SELECT DISTINCT uid FROM archived%s);''' % (table, table)
-        self.cursor.execute(query)
-        temp3 = self.cursor.execute(query)
-        self.conn.commit() 
-
-        #want to extract data from both page data and archived page data to place in csv file
-        #occassionally clean up the archived page data file so that there is no data in it any longer
-        #lets set this to be done on the first day of each month so we just store this data (which is unique)
-        if self.datecur.day == 1:
-            datenow = self.datecur.strftime("%m%d%Y")
-            query = '''SELECT * FROM archived%s;''' % (table)
-            df = pd.read_sql(query, self.conn)
-            df.to_csv(os.path.join(self.extdir, 'archivedpagedata_%s.csv' % (datenow)), mode='w', index=False)
-            print("Number of archived page entries: {}".format(len(df)))
-
-            #clear information from the archivedpagedata if output into csv
-            query = '''DELETE FROM archived%s WHERE uid in (SELECT uid FROM archived%s);''' % (table, table)
-            self.cursor.execute(query)
-            self.conn.commit()
-            self.cursor.close()
+        self._sync()
+        starttime = time.time()
+        rundate = self.datecur.strftime('%Y-%m-%d')
+        cutoffdate = (datetime.datetime.strptime(rundate, '%Y-%m-%d') - datetime.timedelta(days=maxdays)).strftime('%Y-%m-%d')
+        lastrundate, lastcutoffdate = self._archive_watermark(table)
+        if lastrundate is None:
+            where = """stat = 'CLOSED' OR DATE(postdate) < DATE(?)"""
+            params = [cutoffdate]
+        else:
+            where = """(DATE(downloaddate) >= DATE(?) AND (stat = 'CLOSED' OR DATE(postdate) < DATE(?)))
+                OR (DATE(postdate) >= DATE(?) AND DATE(postdate) < DATE(?))"""
+            params = [lastrundate, cutoffdate, lastcutoffdate, cutoffdate]
+
+        # the ads to move are kept in a temp table of the connection that runs the transaction
+        archived = """country = ? AND uid IN (SELECT uid FROM archiveuids)"""
+        self._transaction([
+            ("""CREATE TEMP TABLE IF NOT EXISTS archiveuids (uid INTEGER PRIMARY KEY);""", [()]),
+            ("""DELETE FROM archiveuids;""", [()]),
+            ("""INSERT OR IGNORE INTO archiveuids SELECT DISTINCT uid FROM %s WHERE country = ? AND (%s);""" % (table, where),
+                [[self.country] + params]),
+            ("""INSERT OR REPLACE INTO archivelog (tablename, country, rundate, cutoffdate, numuids, numrows)
+                SELECT ?, ?, ?, ?, (SELECT COUNT(*) FROM archiveuids), COUNT(*) FROM %s WHERE %s;""" % (table, archived),
+                [[table, self.country, rundate, cutoffdate, self.country]]),
+            ("""INSERT OR IGNORE INTO archived%s SELECT * FROM %s WHERE %s;""" % (table, table, archived), [[self.country]]),
+            ("""DELETE FROM %s WHERE %s;""" % (urltable, archived), [[self.country]]),
+            ("""DELETE FROM %s WHERE %s;""" % (table, archived), [[self.country]]),
+        ])
+        seconds = time.time() - starttime
+        self._execute("""UPDATE archivelog SET seconds = ? WHERE tablename = ? AND country = ? AND rundate = ?;""",
+                      [[seconds, table, self.country, rundate]])
+        self._sync()
+        numuids, numrows = self.conn.execute("""SELECT numuids, numrows FROM archivelog WHERE tablename = ? AND country = ? AND rundate = ?;""",
+                                             [table, self.country, rundate]).fetchone()
+        print("Archived %d rows for %d ads from %s in %.1f seconds (watermark %s, cutoff %s)" % (
+            numrows, numuids, table, seconds, lastrundate, cutoffdate))
+        #archived rows are moved on into the parquet archive by export_archive, once per database
      
-    def _create_table_schema(self, tables):
-        """Generate table schema for database.  If it doesn't currently exist"""
+    def _create_table_schema(self, tables, indexes=None):
+        """Generate table schema for database.  If it doesn't currently exist.
+        Pending schema migrations are applied and secondary indexes are created or verified
+        after the tables.
+        """
 
         for t, query in tables.items():
             self.cursor.execute(query)
@@ -130,6 +553,9 @@ class BaseDownloader(object):
                     FROM %s WHERE 0""" % (t, t)
             self.cursor.execute(aquery)
             self.conn.commit()
+        migrate(self.conn, self.dbname)
+        if indexes is not None:
+            create_indexes(self.conn, indexes)
         
         # Print out tables in database
         query = """SELECT name FROM sqlite_master WHERE type='table';"""
@@ -1,3 +1,5 @@
+import os
+
 
 class FileConfig(object):
     #datapath = "/home/ec2-user/WorldBank/MENAJobData"
@@ -5,4 +7,148 @@ class FileConfig(object):
     RAWDIR = datapath + '/data/raw'
     EXTDIR = datapath + '/data/external'
     INTDIR = datapath + '/data/intermin'
-    OUTDIR = datapath + '/data/processed'
\ No newline at end of file
+    OUTDIR = datapath + '/data/processed'
+
+class FetchConfig(object):
+    # requests per second and burst size allowed for each host
+    RATE = 0.5
+    BURST = 2
+    # requests in flight across all hosts and for a single host
+    CONCURRENCY = 16
+    PERHOST = 4
+    TRIES = 5
+    # number of pages fetched together by the downloaders
+    CHUNKSIZE = 50
+    # seconds allowed to open a connection and to wait for data on an open connection
+    CONNECTTIMEOUT = 10
+    READTIMEOUT = 30
+    # a failed request is tried again after a random wait of up to BACKOFF * 2**try seconds, at most MAXBACKOFF
+    BACKOFF = 1.0
+    MAXBACKOFF = 60
+    # consecutive failures after which a host is paused, and seconds it is paused for
+    # (doubled each time a trial request fails, up to MAXCOOLDOWN)
+    BREAKERFAILURES = 5
+    COOLDOWN = 60
+    MAXCOOLDOWN = 900
+    # seconds a download job may spend fetching, None for no limit
+    DEADLINE = 6 * 3600
+    # hours before ads whose pages could not be fetched are due again
+    RETRYDELAY = 6
+
+class DatabaseConfig(object):
+    # rows buffered by a downloader before they are written in one transaction
+    BATCHSIZE = 500
+    # connection settings used by dbconnect.connect_db
+    TIMEOUT = 30
+    JOURNAL_MODE = 'WAL'
+    SYNCHRONOUS = 'NORMAL'
+    # negative cache size is in KiB, i.e. 64MB of page cache
+    CACHE_SIZE = -65536
+    MMAP_SIZE = 268435456
+    TEMP_STORE = 'MEMORY'
+
+class ArchiveConfig(object):
+    # parquet compression codec and rows read from sqlite per chunk when archiving
+    COMPRESSION = 'snappy'
+    CHUNKSIZE = 10000
+
+class RawStoreConfig(object):
+    # keep the raw bodies of fetched ad pages so they can be parsed again offline
+    ENABLED = True
+    # bytes per segment file and zlib compression level
+    SEGMENTSIZE = 268435456
+    LEVEL = 6
+    # stored pages handed to a parse worker at once when re-parsing
+    CHUNKSIZE = 200
+
+class FrontierConfig(object):
+    # days between revisits of an ad (jittered per ad by +/- half) and days after posting to stop
+    INTERVAL = 7
+    MAXAGE = 93
+    # ads pulled from the frontier at once
+    BATCHSIZE = 500
+    # bounds in days of revisit intervals learned from change rates, and the factor
+    # by which the interval of an ad grows when no change was seen
+    MININTERVAL = 1
+    MAXINTERVAL = 28
+    BACKOFF = 2
+
+class ListingConfig(object):
+    # listings stop being paged once this fraction of the ads on a page are already known,
+    # None to page until the post dates are older than the last download
+    SEENFRACTION = 0.8
+    # listings paged together by paginator.Paginator, and hours after which an
+    # unfinished crawl starts again from the first pages instead of resuming
+    WIDTH = 8
+    CURSORAGE = 24
+
+class TranslationConfig(object):
+    # backend used by translation.TranslationService (google or local) and language translated into
+    BACKEND = 'google'
+    DEST = 'en'
+    # split texts into sentences and lines that are looked up in the cache one by one
+    SEGMENT = True
+    # texts (or segments) and characters sent in one request, and requests in flight at once
+    BATCHSIZE = 20
+    MAXCHARS = 4500
+    CONCURRENCY = 2
+    # requests per second and burst size allowed to the backend
+    RATE = 0.5
+    BURST = 2
+    # texts handed to the service at once by the downloaders, so progress is saved as they go
+    CHUNKSIZE = 200
+
+class ResumeConfig(object):
+    # store for the resumes of TanQeebCVDownloader (mongo or sqlite) and where Mongo runs
+    STORE = 'mongo'
+    MONGOHOST = 'localhost'
+    MONGOPORT = 27017
+    # resumes written to the store in one bulk upsert
+    BATCHSIZE = 50
+    # days after which a stored resume is downloaded again, None to only download new resumes
+    REFRESHDAYS = 30
+
+class PipelineConfig(object):
+    # parse processes per download job, pages in the queues between stages,
+    # pages parsed per task and pages fetched together
+    PARSERS = 2
+    QUEUESIZE = 200
+    BATCHSIZE = 20
+    CHUNKSIZE = 50
+
+class ParserConfig(object):
+    # tree builder used for pages (html.parser, lxml or html5lib), switch after
+    # htmlparse.benchmark shows the same rows for the new backend
+    BACKEND = 'html.parser'
+    # only build the subtrees that extractors read
+    STRAIN = True
+
+class BenchmarkConfig(object):
+    # recorded pages and saved results of parsebench, relative to this file
+    FIXTUREDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'fixtures')
+    RESULTDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'results')
+    # times each page is parsed and relative change reported as a regression
+    REPEAT = 5
+    THRESHOLD = 0.1
+
+class MockBoardConfig(object):
+    # mean seconds before each response and fraction of requests answered with 503
+    LATENCY = 0.05
+    ERRORRATE = 0.02
+    # fraction of ads that are closed or expired when visited
+    CLOSEDRATE = 0.1
+    # bytes of page chrome around the content of every page
+    PADDING = 20000
+    # listing pages per source and ads per listing page
+    PAGES = 3
+    ADSPERPAGE = 20
+    # size of the synthetic sites
+    OLXREGIONS = 2
+    OLXSUBREGIONS = 3
+    OLXSECTORS = 3
+    TANQEEBCATEGORIES = 3
+    TANQEEBSUBCATS = 4
+    # days between the newest and oldest ad listed by a source
+    DAYS = 40
+    # requests per second allowed to the mock board by the fetch engine
+    RATE = 50
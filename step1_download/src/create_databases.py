@@ -1,5 +1,6 @@
 """
 This code creates key databases for various data that is being downloaded.
+Changes to existing tables are made through the versioned migrations in migrations.py.
 
 Author: Natalie Chun
 Created:  November 22, 2018
@@ -7,37 +8,9 @@ Created:  November 22, 2018
 """
 
 
+import re
 import sqlite3
-
-def update_table(tablename,newtablequery,insertstatement):
-    """Update table"""
-    
-    conn = sqlite3.connect("egyptOLX.db")
-    c = conn.cursor()
-
-    query ='''PRAGMA table_info({});'''
-    print(c.execute(query.format(tablename)).fetchall())    
-    
-    query = "ALTER TABLE {} RENAME TO {}_temp;"
-    c.execute(query.format(tablename,tablename))
-    
-    c.execute(newtablequery)
-    
-    query = "INSERT INTO {} ({}) SELECT {} FROM {}_temp;"
-    c.execute(query.format(tablename,insertstatement,insertstatement,tablename))
-    
-    query ='''PRAGMA table_info({});'''
-    print(c.execute(query.format(tablename)).fetchall())
-    
-    query = '''DROP TABLE IF EXISTS {}_temp;'''
-    c.execute(query.format(tablename))
-    
-    temp = c.execute('''SELECT * FROM {};'''.format(tablename)).fetchall()
-    print("Number of entries in converted table {}: {}".format(tablename,len(temp)))
-    
-    conn.commit()
-    conn.close()
-
+import sys
 
 def reset_tables():
     """Reset all of the tables."""
@@ -94,10 +67,10 @@ def get_olx_table_schema():
         uid INTEGER,
         i_photo INTEGER,
         i_featured INTEGER,
-        href VARCHAR(50),
+        urllinkshort VARCHAR(50),
         PRIMARY KEY(uid,postdate));'''
 
-    tables['jobadpage'] = '''CREATE TABLE IF NOT EXISTS jobadpage (
+    tables['jobadpagedata'] = '''CREATE TABLE IF NOT EXISTS jobadpagedata (
         downloaddate DATE,
         downloadtime VARCHAR(5),
         country VARCHAR(15),
@@ -123,7 +96,23 @@ def get_olx_table_schema():
         PRIMARY KEY(downloaddate,uid,postdate));'''
         
     return(tables)
-        
+
+
+def get_olx_table_indexes():
+    """Set secondary indexes for OLX tables."""
+
+    indexes = {}
+    # OLXDownloader.check_changes_region looks up urls by subregion and sector
+    indexes['idx_jobadpageurls_region_sector'] = '''CREATE INDEX IF NOT EXISTS idx_jobadpageurls_region_sector
+        ON jobadpageurls (country, fsubreg, jobsector);'''
+    # revisits filter out ads that are closed, and the revisit history and archiving look up the ads of a country by uid
+    indexes['idx_jobadpagedata_country_stat'] = '''CREATE INDEX IF NOT EXISTS idx_jobadpagedata_country_stat
+        ON jobadpagedata (country, stat, uid);'''
+    indexes['idx_jobadpagedata_uid'] = '''CREATE INDEX IF NOT EXISTS idx_jobadpagedata_uid
+        ON jobadpagedata (country, uid);'''
+    return(indexes)
+
+
 def get_wuzzuf_table_schema():
     """Set schema for relevant Wuzzuf tables."""
     tables = {}
@@ -168,7 +157,18 @@ def get_wuzzuf_table_schema():
 		PRIMARY KEY(uid,postdate,downloaddate));
 		'''
     return(tables)   
-     
+
+
+def get_wuzzuf_table_indexes():
+    """Set secondary indexes for Wuzzuf tables."""
+
+    indexes = {}
+    # WuzzufDownloader.remainingquery and seedquery select the ads of a country posted in a range of days
+    indexes['idx_jobadpageurls_country_postdate'] = '''CREATE INDEX IF NOT EXISTS idx_jobadpageurls_country_postdate
+        ON jobadpageurls (country, postdate);'''
+    return(indexes)
+
+
      
 def get_tanqeeb_table_schema():
     tables = {}
@@ -228,6 +228,36 @@ def get_tanqeeb_table_schema():
         PRIMARY KEY(country, uniqueid));
         """
     return(tables)
+
+
+def get_tanqeeb_table_indexes():
+    """Set secondary indexes for Tanqeeb tables."""
+
+    indexes = {}
+    # ads of a country are looked up by id when the pending ads are filled
+    indexes['idx_jobadpageurls_country_uniqueid'] = """CREATE INDEX IF NOT EXISTS idx_jobadpageurls_country_uniqueid
+        ON jobadpageurls (country, uniqueid);"""
+    # TanQeebDownloader.get_new_jobad_pages selects the ads of a country that were not fetched yet
+    indexes['idx_pendingads_country_fetched'] = """CREATE INDEX IF NOT EXISTS idx_pendingads_country_fetched
+        ON pendingads (country, fetched);"""
+    return(indexes)
+
+
+def get_pendingads_table_schema():
+    """Set schema for the Tanqeeb ads to fetch.  Each ad has one row however many
+    categories list it, fetched is NULL until its page has been fetched.
+    """
+
+    tables = {}
+    tables['pendingads'] = """CREATE TABLE IF NOT EXISTS pendingads (
+        country VARCHAR(15),
+        uniqueid VARCHAR(50),
+        href VARCHAR(100),
+        added VARCHAR(10),
+        fetched VARCHAR(10),
+        PRIMARY KEY(country, uniqueid));
+        """
+    return(tables)
     
 def get_tanqeebcv_table_schema():
     
@@ -272,5 +302,179 @@ def get_tanqeebcv_table_schema():
     """
     return(tables)
         
+
+def get_frontier_table_schema():
+    """Set schema for the crawl frontier of ad pages that are revisited (OLX and Wuzzuf)."""
+
+    tables = {}
+    tables['frontier'] = """CREATE TABLE IF NOT EXISTS frontier (
+        country VARCHAR(20),
+        uid INTEGER,
+        href VARCHAR(200),
+        postdate DATE,
+        priority INTEGER,
+        next_visit_at VARCHAR(19),
+        last_visit_at VARCHAR(19),
+        visits INTEGER,
+        changerate REAL,
+        revisit_days REAL,
+        PRIMARY KEY(country, uid));
+        """
+    return(tables)
+
+
+def get_pagevisit_table_schema():
+    """Set schema for the content hash of each revisited ad page and the visits that found it unchanged."""
+
+    tables = {}
+    tables['pagehashes'] = """CREATE TABLE IF NOT EXISTS pagehashes (
+        country VARCHAR(20),
+        uid INTEGER,
+        hash VARCHAR(40),
+        hashtime VARCHAR(16),
+        PRIMARY KEY(country, uid));
+        """
+    tables['unchangedvisits'] = """CREATE TABLE IF NOT EXISTS unchangedvisits (
+        country VARCHAR(20),
+        uid INTEGER,
+        downloaddate DATE,
+        downloadtime VARCHAR(5),
+        PRIMARY KEY(country, uid, downloaddate, downloadtime));
+        """
+    return(tables)
+
+
+def get_listingcursor_table_schema():
+    """Set schema for the cursors of paginator.Paginator, the next page of each listing being crawled."""
+
+    tables = {}
+    tables['listingcursors'] = """CREATE TABLE IF NOT EXISTS listingcursors (
+        country VARCHAR(20),
+        listing VARCHAR(200),
+        nexturl VARCHAR(300),
+        pages INTEGER,
+        started VARCHAR(19),
+        updated VARCHAR(19),
+        finished INTEGER,
+        stopdate VARCHAR(10),
+        PRIMARY KEY(country, listing));
+        """
+    return(tables)
+
+
+def get_frontier_table_indexes():
+    """Set secondary indexes for the crawl frontier."""
+
+    indexes = {}
+    # frontier.Frontier.due pulls the due ads of a country in priority order
+    indexes['idx_frontier_due'] = """CREATE INDEX IF NOT EXISTS idx_frontier_due
+        ON frontier (country, next_visit_at, priority);"""
+    return(indexes)
+
+
+def create_indexes(conn, indexes):
+    """Create declared indexes, recreating any index whose definition has changed."""
+
+    existing = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL;").fetchall())
+    normalize = lambda sql: re.sub(r'\s+', ' ', sql.replace('IF NOT EXISTS ', '')).strip().rstrip(';').lower()
+    for name, query in indexes.items():
+        if name in existing and normalize(existing[name]) != normalize(query):
+            print("Recreating index %s" % (name))
+            conn.execute("DROP INDEX %s;" % (name))
+        conn.execute(query)
+    conn.commit()
+
+
+def check_query_plans(conn, queries):
+    """Run EXPLAIN QUERY PLAN on each query and return the ones that do a full table scan."""
+
+    scans = {}
+    for name, query in queries.items():
+        params = [None] * query.count('?')
+        plan = conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()
+        details = [row[-1] for row in plan]
+        fullscans = [d for d in details if d.startswith('SCAN') and 'USING' not in d and 'CONSTANT ROW' not in d]
+        if len(fullscans) > 0:
+            scans[name] = details
+    return(scans)
+
+
+def get_schemas():
+    """Return {name: (tables, indexes)} of each schema whose hot queries are checked."""
+
+    return({
+        'olx': (get_olx_table_schema(), get_olx_table_indexes()),
+        'wuzzuf': (get_wuzzuf_table_schema(), get_wuzzuf_table_indexes()),
+        'tanqeeb': (dict(get_tanqeeb_table_schema(), **get_pendingads_table_schema()), get_tanqeeb_table_indexes()),
+        'frontier': (get_frontier_table_schema(), get_frontier_table_indexes()),
+        'pagevisits': (get_pagevisit_table_schema(), {}),
+    })
+
+
+def get_hot_queries():
+    """Return {name: {query name: query}} of the reads run on every download that should not
+    scan a whole table, for each schema of get_schemas.  The queries are taken from the classes
+    that run them, imported here because they import this module.
+    """
+
+    from config import FrontierConfig
+    from basedownloader import BaseDownloader
+    from frontier import Frontier
+    from olxdownloader import OLXDownloader
+    from tanqeebdownloader import TanQeebDownloader
+    from wuzzufdownloader import WuzzufDownloader
+
+    uids = ','.join(['?'] * 3)
+    history = lambda cls: Frontier.historyquery % (', '.join(cls.revisithistory[1]), cls.revisithistory[0], uids)
+    return({
+        'olx': {
+            'region_sector_urls': OLXDownloader.regionsectorquery,
+            'remaining_urls': OLXDownloader.remainingquery,
+            'frontier_seed': OLXDownloader.seedquery % (FrontierConfig.MAXAGE),
+            'revisit_history': history(OLXDownloader),
+        },
+        'wuzzuf': {
+            'remaining_urls': WuzzufDownloader.remainingquery,
+            'frontier_seed': WuzzufDownloader.seedquery % (FrontierConfig.MAXAGE),
+            'revisit_history': history(WuzzufDownloader),
+        },
+        'tanqeeb': {
+            'new_jobad_pages': TanQeebDownloader.newpagesquery,
+        },
+        'frontier': {
+            'due': Frontier.duequery,
+        },
+        'pagevisits': {
+            'hashes': BaseDownloader.hashquery % (uids),
+            'unchanged': Frontier.unchangedquery % ('unchangedvisits', uids),
+        },
+    })
+
+
+def build_schema(name):
+    """Return an in-memory database with the tables and indexes of a schema of get_schemas."""
+
+    tables, indexes = get_schemas()[name]
+    conn = sqlite3.connect(':memory:')
+    for query in tables.values():
+        conn.execute(query)
+    create_indexes(conn, indexes)
+    return(conn)
+
+
+def check_schemas():
+    """Build each schema with its indexes in memory and check that no hot query scans a full table."""
+
+    failed = 0
+    for name, queries in sorted(get_hot_queries().items()):
+        conn = build_schema(name)
+        for qname, details in check_query_plans(conn, queries).items():
+            print("Full table scan in %s query %s: %s" % (name, qname, details))
+            failed += 1
+        conn.close()
+    print("Query plan check: %d queries with full table scans" % (failed))
+    return(failed)
+
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    sys.exit(1 if check_schemas() > 0 else 0)
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""
+Purpose:  This module contains the connection factory for the sqlite databases
+used by the downloaders.  Connections are opened in WAL mode with pragmas tuned
+for the scraping workload and reused for each database path, so that readers
+such as the step2 preprocessors can query while a crawl is writing.  A reused
+connection is shared by every object in the thread that opened the path, so
+close_db only closes it once each connect_db has been matched by a close_db.
+"""
+
+import os
+import sqlite3
+import threading
+from config import DatabaseConfig
+
+
+_connections = {}
+# number of connect_db calls not yet matched by close_db for each connection
+_references = {}
+_lock = threading.Lock()
+
+
+def _key(dbpath):
+    # sqlite connections can only be used in the thread and process that created them
+    return((os.path.abspath(dbpath), os.getpid(), threading.get_ident()))
+
+
+def set_pragmas(conn):
+    """Set journal mode and tuning pragmas on a connection."""
+
+    conn.execute("PRAGMA journal_mode=%s;" % (DatabaseConfig.JOURNAL_MODE))
+    conn.execute("PRAGMA synchronous=%s;" % (DatabaseConfig.SYNCHRONOUS))
+    conn.execute("PRAGMA cache_size=%d;" % (DatabaseConfig.CACHE_SIZE))
+    conn.execute("PRAGMA mmap_size=%d;" % (DatabaseConfig.MMAP_SIZE))
+    conn.execute("PRAGMA temp_store=%s;" % (DatabaseConfig.TEMP_STORE))
+    return(conn)
+
+
+def _open(dbpath, timeout, hold):
+    key = _key(dbpath)
+    with _lock:
+        conn = _connections.get(key)
+    if conn is None:
+        # only this thread opens connections under key, so there is no race between the lookup and the insert
+        conn = set_pragmas(sqlite3.connect(dbpath, timeout=timeout))
+        with _lock:
+            _connections[key] = conn
+            _references[key] = 0
+    if hold:
+        with _lock:
+            _references[key] += 1
+    return(conn)
+
+
+def connect_db(dbpath, timeout=DatabaseConfig.TIMEOUT):
+    """Return a connection for dbpath, reusing an open one from this thread if there is one.
+    The connection stays open until every connect_db for it is matched by a close_db.
+    """
+
+    return(_open(dbpath, timeout, True))
+
+
+def get_db(dbpath, timeout=DatabaseConfig.TIMEOUT):
+    """Return this thread's connection for dbpath like connect_db, for objects that look the
+    connection up on every use instead of keeping it.  It is not closed by close_db while
+    other users hold it, and is opened again if it was closed.
+    """
+
+    return(_open(dbpath, timeout, False))
+
+
+def close_db(conn):
+    """Release a connection returned by connect_db.  It is closed and forgotten once no
+    other connect_db for it is still open.  Connections not made by connect_db are closed.
+    """
+
+    with _lock:
+        keys = [key for key, value in _connections.items() if value is conn]
+        for key in keys:
+            _references[key] -= 1
+            if _references[key] > 0:
+                return
+            del _connections[key]
+            del _references[key]
+    conn.close()
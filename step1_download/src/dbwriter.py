@@ -0,0 +1,169 @@
+"""
+Purpose:  This module contains a single writer for each sqlite database file.
+Downloaders push their statements and rows onto a queue and the writer applies
+them in large batched transactions, so many crawlers can feed the same
+database without running into "database is locked".
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from dbconnect import connect_db, close_db
+
+
+class DatabaseWriter(threading.Thread):
+    """Thread that owns a database file.  Messages read from the queue are:
+    ('execute', query, rows), ('transaction', statements, ackqueue), ('flush', ackqueue)
+    and ('stop', None).
+    """
+
+    def __init__(self, dbpath, inqueue, batchsize=5000, interval=2.0):
+        super(DatabaseWriter, self).__init__(daemon=True)
+        self.dbpath = dbpath
+        self.inqueue = inqueue
+        self.batchsize = batchsize
+        self.interval = interval
+        self.counts = {'rows': 0, 'transactions': 0, 'errors': 0}
+
+    def _apply(self, conn, pending):
+        """Apply pending statements in one transaction.  If the transaction fails
+        each statement is applied on its own so one bad statement does not lose the batch.
+        """
+
+        if len(pending) == 0:
+            return
+        try:
+            with conn:
+                for query, rows in pending:
+                    conn.executemany(query, rows)
+            self.counts['transactions'] += 1
+            self.counts['rows'] += sum([len(rows) for query, rows in pending])
+        except sqlite3.Error:
+            for query, rows in pending:
+                try:
+                    with conn:
+                        conn.executemany(query, rows)
+                    self.counts['transactions'] += 1
+                    self.counts['rows'] += len(rows)
+                except sqlite3.Error as e:
+                    self.counts['errors'] += 1
+                    print("Error writing to %s: %s\n%s" % (self.dbpath, e, query))
+        del pending[:]
+
+    def _apply_transaction(self, conn, statements):
+        """Apply a list of (query, rows) in one immediate transaction, all or nothing.
+        Returns None if it was committed, otherwise the error.
+        """
+
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            for query, rows in statements:
+                conn.executemany(query, rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            self.counts['errors'] += 1
+            print("Error writing to %s: %s" % (self.dbpath, e))
+            return(str(e))
+        self.counts['transactions'] += 1
+        self.counts['rows'] += sum([len(rows) for query, rows in statements])
+        return(None)
+
+    def run(self):
+        conn = connect_db(self.dbpath)
+        pending = []
+        numrows = 0
+        lastapply = time.time()
+        while True:
+            try:
+                msg = self.inqueue.get(timeout=self.interval)
+            except queue.Empty:
+                msg = None
+            if msg is not None and msg[0] == 'execute':
+                query, rows = msg[1], msg[2]
+                # merge consecutive messages for the same statement so order is kept
+                if len(pending) > 0 and pending[-1][0] == query:
+                    pending[-1][1].extend(rows)
+                else:
+                    pending.append((query, list(rows)))
+                numrows += len(rows)
+                if numrows < self.batchsize and time.time() - lastapply < self.interval:
+                    continue
+            self._apply(conn, pending)
+            numrows = 0
+            lastapply = time.time()
+            if msg is None:
+                continue
+            if msg[0] == 'flush':
+                msg[1].put(True)
+            elif msg[0] == 'transaction':
+                msg[2].put(self._apply_transaction(conn, msg[1]))
+            elif msg[0] == 'stop':
+                break
+        close_db(conn)
+        print("Writer for %s applied %d rows in %d transactions (%d errors)" % (
+            self.dbpath, self.counts['rows'], self.counts['transactions'], self.counts['errors']))
+
+
+class WriterClient(object):
+    """Handle given to a downloader to send statements to the writer of a database.
+    It can be passed to another process when the queues come from a multiprocessing manager.
+    """
+
+    def __init__(self, inqueue, ackqueue):
+        self.inqueue = inqueue
+        self.ackqueue = ackqueue
+
+    def execute(self, query, rows=((),)):
+        """Queue a statement to be executed for each row of parameters."""
+
+        self.inqueue.put(('execute', query, [tuple(row) for row in rows]))
+
+    def transaction(self, statements):
+        """Execute a list of (query, rows) in one transaction after everything sent so far
+        and wait until it is committed.  Raises sqlite3.Error if it was rolled back.
+        """
+
+        self.inqueue.put(('transaction', [(query, [tuple(row) for row in rows]) for query, rows in statements], self.ackqueue))
+        error = self.ackqueue.get()
+        if error is not None:
+            raise sqlite3.Error(error)
+
+    def flush(self):
+        """Wait until everything sent so far has been committed."""
+
+        self.inqueue.put(('flush', self.ackqueue))
+        self.ackqueue.get()
+
+
+class WriterService(object):
+    """Start one writer for each database file and hand out clients for it.
+    Pass a multiprocessing manager when the downloaders run in other processes.
+    """
+
+    def __init__(self, manager=None, batchsize=5000):
+        self.manager = manager
+        self.batchsize = batchsize
+        self.writers = {}
+
+    def _queue(self):
+        return(self.manager.Queue() if self.manager is not None else queue.Queue())
+
+    def client(self, dbpath):
+        """Return a client for the writer that owns dbpath."""
+
+        if dbpath not in self.writers:
+            writer = DatabaseWriter(dbpath, self._queue(), batchsize=self.batchsize)
+            writer.start()
+            self.writers[dbpath] = writer
+        return(WriterClient(self.writers[dbpath].inqueue, self._queue()))
+
+    def close(self):
+        """Apply outstanding writes and stop all writers."""
+
+        for writer in self.writers.values():
+            writer.inqueue.put(('stop', None))
+        for writer in self.writers.values():
+            writer.join()
+        self.writers = {}
@@ -0,0 +1,372 @@
+"""
+Purpose:  This module contains an asynchronous fetch engine that is shared by
+the downloaders.  Many requests are kept in flight across different hosts
+while each host is paced with a token bucket, so politeness no longer depends
+on a serial sleep before every request.
+
+Failed requests are tried again after an exponential backoff with jitter.  A
+circuit breaker pauses a host after repeated failures, and each download job
+has a deadline after which nothing more is requested.  Urls that still fail
+are deferred rather than holding up the crawl: they are not requested again
+until the caller takes them back with take_deferred, e.g. to retry them at
+the end of a batch or to schedule them for the next run.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import os
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from config import FetchConfig
+from httpsession import get_session
+
+
+class TokenBucket(object):
+    """Token bucket used to pace requests made to a single host.  Tokens are
+    reserved in advance so that concurrent callers queue up behind each other
+    rather than all waking up at the same time.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return the number of seconds to wait before using it."""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return(0.0)
+            return(-self.tokens / self.rate)
+
+
+class CircuitBreaker(object):
+    """Pause requests to a host after repeated failures.  After failures consecutive
+    failed requests the breaker opens and requests fail straight away for cooldown
+    seconds, then a single trial request is let through.  A success closes the
+    breaker, a failed trial opens it again for twice as long, up to maxcooldown.
+    """
+
+    def __init__(self, failures=FetchConfig.BREAKERFAILURES, cooldown=FetchConfig.COOLDOWN,
+                 maxcooldown=FetchConfig.MAXCOOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.maxcooldown = maxcooldown
+        self.count = 0
+        self.wait = cooldown
+        self.openuntil = None
+        self.trial = False
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request may be made to the host now."""
+
+        with self.lock:
+            if self.openuntil is None:
+                return(True)
+            if self.trial or time.monotonic() < self.openuntil:
+                return(False)
+            self.trial = True
+            return(True)
+
+    def release(self):
+        """Give back a trial request that allow let through but that was not made."""
+
+        with self.lock:
+            self.trial = False
+
+    def success(self):
+        with self.lock:
+            self.count = 0
+            self.wait = self.cooldown
+            self.openuntil = None
+            self.trial = False
+
+    def failure(self):
+        """Record a failed request, returns True if this opened the breaker."""
+
+        with self.lock:
+            self.count += 1
+            if self.trial:
+                self.wait = min(2 * self.wait, self.maxcooldown)
+            elif self.openuntil is not None or self.count < self.failures:
+                return(False)
+            self.openuntil = time.monotonic() + self.wait
+            self.trial = False
+            self.trips += 1
+            return(True)
+
+
+class FetchEngine(object):
+    """Fetch pages from many hosts at once.  Each host has its own token bucket,
+    concurrency limit and circuit breaker while the blocking requests themselves
+    run on a thread pool.
+    """
+
+    # statuses worth trying again, any other status other than 200 means the page is gone
+    retrystatus = (408, 425, 429, 500, 502, 503, 504)
+
+    def __init__(self, rate=FetchConfig.RATE, burst=FetchConfig.BURST,
+                 concurrency=FetchConfig.CONCURRENCY, perhost=FetchConfig.PERHOST,
+                 tries=FetchConfig.TRIES, backoff=FetchConfig.BACKOFF, maxbackoff=FetchConfig.MAXBACKOFF,
+                 deadline=FetchConfig.DEADLINE, session=None):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.perhost = perhost
+        self.tries = tries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.session = session if session is not None else get_session()
+        self.buckets = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        # event loop of fetch_many, created in the process that uses it and run by one caller at a time
+        self.loop = None
+        self.looppid = None
+        self.looplock = threading.Lock()
+        self.start_run(deadline)
+
+    def start_run(self, deadline=FetchConfig.DEADLINE):
+        """Start a download job: set its deadline in seconds from now (None for no limit)
+        and clear the deferred and gone urls.  Circuit breakers are kept, a host that is
+        down for one job is likely to be down for the next one too.
+        """
+
+        with self.lock:
+            self.deadline = time.monotonic() + deadline if deadline is not None else None
+            self.deferred = collections.OrderedDict()
+            self.gone = set()
+            self.counts = {'failures': 0, 'timeouts': 0, 'retries': 0, 'gone': 0, 'deferred': 0}
+
+    def _bucket(self, url):
+        """Return the token bucket for the host of a url."""
+
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return(self.buckets[host])
+
+    def _breaker(self, url):
+        """Return the circuit breaker for the host of a url."""
+
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker()
+            return(self.breakers[host])
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def expired(self, wait=0):
+        """Return True if the deadline of the job has passed, or will have after waiting wait seconds."""
+
+        return(self.deadline is not None and time.monotonic() + wait >= self.deadline)
+
+    def _wait(self, count):
+        """Seconds to wait before try count, a random time up to an exponentially growing cap."""
+
+        if count == 0:
+            return(0.0)
+        return(random.uniform(0, min(self.maxbackoff, self.backoff * 2 ** (count - 1))))
+
+    def _skip(self, url, breaker, wait=0):
+        """Return True if url should not be requested after waiting wait seconds.  Urls
+        that are gone or deferred in this job are not requested again, and urls are deferred
+        once the deadline will have passed or while the circuit breaker of their host is open.
+        The deadline is checked first, so the breaker only lets a trial through for a
+        request that is then made.
+        """
+
+        with self.lock:
+            if url in self.gone or url in self.deferred:
+                return(True)
+        if self.expired(wait):
+            self._defer(url, 'deadline')
+            return(True)
+        if not breaker.allow():
+            self._defer(url, 'circuit open')
+            return(True)
+        return(False)
+
+    def _defer(self, url, reason):
+        with self.lock:
+            if url not in self.deferred:
+                self.deferred[url] = reason
+                self.counts['deferred'] += 1
+
+    def _get(self, url, breaker):
+        """Blocking request of a single url on a pooled connection.  Returns (body, retry)
+        where body is None if the request failed, and retry is True if it is worth trying again.
+        """
+
+        try:
+            status, body = self.session.get(url)
+        except Exception as e:
+            self._count('timeouts' if isinstance(e, socket.timeout) else 'failures')
+            if breaker.failure():
+                print("Pausing requests to %s after repeated failures" % (urllib.parse.urlsplit(url).netloc))
+            print("Error for URL %s : %s (%r)" % (url, datetime.datetime.now(), e))
+            return(None, True)
+        if status in self.retrystatus:
+            self._count('failures')
+            if breaker.failure():
+                print("Pausing requests to %s after repeated failures" % (urllib.parse.urlsplit(url).netloc))
+            return(None, True)
+        # the host answered, so it is up even if the page is gone
+        breaker.success()
+        if status == 200:
+            return(body, False)
+        with self.lock:
+            self.gone.add(url)
+            self.counts['gone'] += 1
+        return(None, False)
+
+    def fetch(self, url):
+        """Request a url up to self.tries times, backing off between tries.  Returns
+        None if the page is gone or could not be retrieved, in which case the url is deferred.
+        """
+
+        bucket = self._bucket(url)
+        breaker = self._breaker(url)
+        for count in range(self.tries):
+            wait = self._wait(count)
+            if self._skip(url, breaker, wait):
+                return(None)
+            if count > 0:
+                self._count('retries')
+            try:
+                time.sleep(wait + bucket.reserve())
+            except BaseException:
+                breaker.release()
+                raise
+            body, retry = self._get(url, breaker)
+            if not retry:
+                return(body)
+        self._defer(url, 'failed %d tries' % (self.tries))
+        return(None)
+
+    async def _fetch_async(self, url, loop, limit, hostlimits):
+        """Coroutine version of fetch, only the requests themselves hold a slot of the thread pool."""
+
+        bucket = self._bucket(url)
+        breaker = self._breaker(url)
+        host = urllib.parse.urlsplit(url).netloc
+        if host not in hostlimits:
+            hostlimits[host] = asyncio.Semaphore(self.perhost)
+        async with hostlimits[host]:
+            for count in range(self.tries):
+                wait = self._wait(count)
+                if self._skip(url, breaker, wait):
+                    return(None)
+                if count > 0:
+                    self._count('retries')
+                try:
+                    await asyncio.sleep(wait + bucket.reserve())
+                except BaseException:
+                    # cancelled before the request was made
+                    breaker.release()
+                    raise
+                async with limit:
+                    body, retry = await loop.run_in_executor(self.executor, self._get, url, breaker)
+                if not retry:
+                    return(body)
+        self._defer(url, 'failed %d tries' % (self.tries))
+        return(None)
+
+    async def _gather(self, urls, loop):
+        limit = asyncio.Semaphore(self.concurrency)
+        hostlimits = {}
+        tasks = [self._fetch_async(url, loop, limit, hostlimits) for url in urls]
+        return(await asyncio.gather(*tasks))
+
+    def fetch_many(self, urls):
+        """Fetch a list of urls concurrently.  Returns the bodies in the same
+        order as the urls with None for any url that could not be retrieved.
+        """
+
+        if len(urls) == 0:
+            return([])
+        with self.looplock:
+            if self.loop is None or self.looppid != os.getpid():
+                self.loop = asyncio.new_event_loop()
+                self.looppid = os.getpid()
+            return(self.loop.run_until_complete(self._gather(list(urls), self.loop)))
+
+    def is_deferred(self, *urls):
+        """Return True if any of urls failed or was skipped in this job, rather than being gone."""
+
+        with self.lock:
+            return(any([url in self.deferred for url in urls]))
+
+    def is_gone(self, *urls):
+        """Return True if any of urls answered with a status that means the page no longer exists."""
+
+        with self.lock:
+            return(any([url in self.gone for url in urls]))
+
+    def take_deferred(self, urls=None):
+        """Remove urls (default all) from the deferred queue so they can be requested
+        again.  Returns a list of (url, reason) for the urls removed.
+        """
+
+        with self.lock:
+            urls = list(self.deferred.keys()) if urls is None else [url for url in urls if url in self.deferred]
+            return([(url, self.deferred.pop(url)) for url in urls])
+
+    def report(self):
+        """Print request counts and connection reuse for the session pool along with
+        failed requests, retries and deferred urls.
+        """
+
+        stats = self.session.stats()
+        print("Requests: %d, new connections: %d, reused connections: %d (reuse rate %.1f%%)" % (
+            stats['requests'], stats['connections'], stats['reused'], 100*stats['reuserate']))
+        if stats['bytes'] > 0:
+            print("Bytes received: %d compressed, %d decoded" % (stats['rawbytes'], stats['bytes']))
+        with self.lock:
+            counts = dict(self.counts)
+            reasons = collections.Counter(self.deferred.values())
+            trips = dict([(host, b.trips) for host, b in self.breakers.items() if b.trips > 0])
+        print("Failed requests: %d (%d timeouts), retries: %d, pages gone: %d, urls deferred: %d (%d still deferred %s)" % (
+            counts['failures'] + counts['timeouts'], counts['timeouts'], counts['retries'], counts['gone'],
+            counts['deferred'], sum(reasons.values()), dict(reasons)))
+        if len(trips) > 0:
+            print("Hosts paused by the circuit breaker: %s" % (trips))
+        if self.expired():
+            print("Deadline of the download job was reached")
+
+
+_engine = None
+
+def get_engine():
+    """Return the fetch engine shared by all downloaders in this process."""
+
+    global _engine
+    if _engine is None:
+        _engine = FetchEngine()
+    return(_engine)
+
+
+def set_engine(engine):
+    """Replace the fetch engine shared by the downloaders, e.g. to change its pacing."""
+
+    global _engine
+    _engine = engine
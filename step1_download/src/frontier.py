@@ -0,0 +1,245 @@
+"""
+Purpose:  This module contains the crawl frontier used to schedule visits of
+job ad pages.  Every known ad url of a country is kept in the frontier table
+with the time of its next visit and a priority.  The scheduler pulls due ads
+in bulk and moves each one forward as soon as it is handed out, so an ad is
+never fetched twice in a run.  Revisit intervals are jittered per ad so that
+revisits spread evenly over the days instead of coming in weekly spikes.
+
+When the tracked fields of an ad are known, its revisit interval is learned
+from its snapshot history: ads whose counts change quickly are revisited more
+often and ads that do not change are backed off.  Visits that found the page
+unchanged write no snapshot, they count as a snapshot equal to the one before.
+"""
+
+import datetime
+import math
+import zlib
+from config import FrontierConfig
+
+
+TIMEFORMAT = '%Y-%m-%d %H:%M:%S'
+
+# priorities, lower is visited first
+NEW = 0
+REVISIT = 1
+
+
+def estimate_rate(visits, changes, days):
+    """Estimate changes per day from visits-1 gaps spread over days in which changes
+    were seen, correcting for changes missed between two visits (Cho & Garcia-Molina).
+    """
+
+    n = visits - 1
+    if n <= 0 or days <= 0:
+        return(None)
+    return(-math.log((n - changes + 0.5) / (n + 0.5)) / (days / n))
+
+
+def _jitter(uid):
+    """Fraction in [0, 1) that is fixed for each ad, used to spread revisits."""
+    return(zlib.crc32(str(uid).encode('utf-8')) / 2.0**32)
+
+
+class Frontier(object):
+    """Schedule of ad pages to visit for one country.  Reads go through conn
+    while writes are sent with execute, followed by sync before the next read.
+    """
+
+    # reads run for every batch of due ads, kept here so create_databases can check their plans
+    historyquery = """SELECT uid, downloaddate, downloadtime, %s FROM %s
+                WHERE country = ? AND uid IN (%s) ORDER BY uid, downloaddate, downloadtime;"""
+    unchangedquery = """SELECT uid, downloaddate, downloadtime FROM %s
+                WHERE country = ? AND uid IN (%s);"""
+    duequery = """SELECT uid, href, postdate FROM frontier
+            WHERE country = ? AND next_visit_at <= ? ORDER BY priority, next_visit_at LIMIT ?;"""
+
+    def __init__(self, conn, execute, sync, country, interval=FrontierConfig.INTERVAL,
+                 maxage=FrontierConfig.MAXAGE, history=None, unchanged=None):
+        self.conn = conn
+        self.execute = execute
+        self.sync = sync
+        self.country = country
+        self.interval = interval
+        self.maxage = maxage
+        # (table, fields) of the snapshots whose changes drive the revisit interval
+        self.history = history
+        # table of visits that found the page unchanged, (country, uid, downloaddate, downloadtime)
+        self.unchanged = unchanged
+
+    def _postdate(self, postdate):
+        try:
+            return(datetime.datetime.strptime(str(postdate)[:10], '%Y-%m-%d'))
+        except ValueError:
+            return(None)
+
+    def change_rates(self, uids):
+        """Return {uid: (visits, changes, days)} from the snapshot history of the ads,
+        where changes counts consecutive snapshots in which a tracked field differs.
+        """
+
+        if self.history is None or len(uids) == 0:
+            return({})
+        table, fields = self.history
+        snapshots = {}
+        for i in range(0, len(uids), 500):
+            chunk = list(uids[i:i+500])
+            query = self.historyquery % (', '.join(fields), table, ','.join(['?']*len(chunk)))
+            for row in self.conn.execute(query, [self.country] + chunk).fetchall():
+                # closed and missing pages have no tracked fields
+                if all([value is None for value in row[3:]]):
+                    continue
+                snapshots.setdefault(row[0], []).append(row[1:])
+        if self.unchanged is not None:
+            snapshots = self._add_unchanged(snapshots)
+        rates = {}
+        for uid, rows in snapshots.items():
+            changes = sum([1 for a, b in zip(rows[:-1], rows[1:]) if a[2:] != b[2:]])
+            try:
+                first = datetime.datetime.strptime('%s %s' % (rows[0][0], rows[0][1]), '%Y-%m-%d %H:%M')
+                last = datetime.datetime.strptime('%s %s' % (rows[-1][0], rows[-1][1]), '%Y-%m-%d %H:%M')
+                days = (last - first).total_seconds() / 86400.0
+            except (TypeError, ValueError):
+                days = 0
+            rates[uid] = (len(rows), changes, days)
+        return(rates)
+
+    def _add_unchanged(self, snapshots):
+        """Add the unchanged visits of the ads to their snapshots, each a copy of the snapshot before it."""
+
+        visits = {}
+        uids = list(snapshots.keys())
+        for i in range(0, len(uids), 500):
+            chunk = uids[i:i+500]
+            query = self.unchangedquery % (self.unchanged, ','.join(['?']*len(chunk)))
+            for uid, date, time in self.conn.execute(query, [self.country] + chunk).fetchall():
+                visits.setdefault(uid, []).append((date, time))
+        for uid, times in visits.items():
+            merged = sorted([(row[0], row[1], row) for row in snapshots[uid]] + [(date, time, None) for date, time in times],
+                            key=lambda visit: (visit[0], visit[1]))
+            rows = []
+            for date, time, row in merged:
+                if row is None:
+                    if len(rows) == 0:
+                        continue
+                    row = (date, time) + tuple(rows[-1][2:])
+                rows.append(row)
+            snapshots[uid] = rows
+        return(snapshots)
+
+    def revisit_days(self, stats):
+        """Days until the next visit of an ad given (visits, changes, days) of its history.
+        Ads are revisited about once per expected change and ads without changes are
+        backed off, within FrontierConfig.MININTERVAL and MAXINTERVAL.  Returns
+        (days, rate) where rate is None if the history is too short to learn from.
+        """
+
+        if stats is None:
+            return(self.interval, None)
+        visits, changes, days = stats
+        rate = estimate_rate(visits, changes, days)
+        if rate is None:
+            return(self.interval, None)
+        if rate > 0:
+            interval = 1.0 / rate
+        else:
+            interval = days / (visits - 1) * FrontierConfig.BACKOFF
+        return(min(max(interval, FrontierConfig.MININTERVAL), FrontierConfig.MAXINTERVAL), rate)
+
+    def next_visit(self, uid, postdate, now, interval=None):
+        """Time of the next visit after a visit at now, None once the ad is older than maxage."""
+
+        if interval is None:
+            days = self.interval * (0.5 + _jitter(uid))
+        else:
+            days = interval * (0.75 + 0.5 * _jitter(uid))
+        nextvisit = now + datetime.timedelta(days=days)
+        postdate = self._postdate(postdate)
+        if postdate is not None and nextvisit.replace(tzinfo=None) > postdate + datetime.timedelta(days=self.maxage):
+            return(None)
+        return(nextvisit)
+
+    def seed(self, now, query, params=()):
+        """Add ads that are not yet in the frontier.  query must select
+        (uid, href, postdate) and new ads are due right away with priority NEW.
+        Ads that were retired and are older than maxage are removed.
+        """
+
+        self.sync()
+        rows = self.conn.execute(query, params).fetchall()
+        insert = """INSERT OR IGNORE INTO frontier (country, uid, href, postdate, priority, next_visit_at, last_visit_at, visits)
+            VALUES (?,?,?,?,?,?,NULL,0);"""
+        self.execute(insert, [[self.country, uid, href, postdate, NEW, now.strftime(TIMEFORMAT)] for uid, href, postdate in rows])
+        cutoff = (now - datetime.timedelta(days=self.maxage)).strftime('%Y-%m-%d')
+        query = """DELETE FROM frontier WHERE country = ? AND next_visit_at IS NULL AND DATE(postdate) < DATE(?);"""
+        self.execute(query, [[self.country, cutoff]])
+        self.sync()
+        return(len(rows))
+
+    def due(self, now, limit=FrontierConfig.BATCHSIZE):
+        """Pull up to limit ads that are due at now, new ads first.  The ads are
+        rescheduled before they are returned.  Returns a list of (uid, href, postdate).
+        """
+
+        self.sync()
+        rows = self.conn.execute(self.duequery, [self.country, now.strftime(TIMEFORMAT), limit]).fetchall()
+        rates = self.change_rates([uid for uid, href, postdate in rows])
+
+        updates = []
+        for uid, href, postdate in rows:
+            interval, rate = self.revisit_days(rates.get(uid))
+            nextvisit = self.next_visit(uid, postdate, now, interval=interval if rate is not None else None)
+            nextvisit = nextvisit.strftime(TIMEFORMAT) if nextvisit is not None else None
+            updates.append([REVISIT, nextvisit, now.strftime(TIMEFORMAT), rate, interval, self.country, uid])
+        query = """UPDATE frontier SET priority = ?, next_visit_at = ?, last_visit_at = ?, visits = visits + 1,
+            changerate = ?, revisit_days = ? WHERE country = ? AND uid = ?;"""
+        self.execute(query, updates)
+        self.sync()
+        return(rows)
+
+    def retire(self, uids):
+        """Stop visiting ads that were found to be closed or gone."""
+
+        query = """UPDATE frontier SET next_visit_at = NULL WHERE country = ? AND uid = ?;"""
+        self.execute(query, [[self.country, uid] for uid in uids])
+
+    def defer(self, uids, when):
+        """Make ads whose pages could not be fetched due again at when instead of
+        waiting for their next scheduled visit.
+        """
+
+        query = """UPDATE frontier SET next_visit_at = ? WHERE country = ? AND uid = ? AND next_visit_at IS NOT NULL;"""
+        self.execute(query, [[when.strftime(TIMEFORMAT), self.country, uid] for uid in uids])
+
+    def report(self, now):
+        """Print the number of ads due now and scheduled for each of the coming days."""
+
+        query = """SELECT SUBSTR(next_visit_at, 1, 10), COUNT(*) FROM frontier
+            WHERE country = ? AND next_visit_at IS NOT NULL GROUP BY 1 ORDER BY 1;"""
+        today = now.strftime('%Y-%m-%d')
+        counts = self.conn.execute(query, [self.country]).fetchall()
+        overdue = sum([n for day, n in counts if day < today])
+        print("Frontier for %s: %d overdue, scheduled %s" % (self.country, overdue, [(day, n) for day, n in counts if day >= today][:14]))
+
+    def report_savings(self):
+        """Compare the learned revisit intervals of the scheduled ads with the fixed
+        schedule of one visit every self.interval days.  With changes arriving at rate r,
+        a visit every d days sees a change with probability 1-exp(-r*d), so the changes
+        detected per day are (1-exp(-r*d))/d for each ad.
+        """
+
+        query = """SELECT changerate, revisit_days FROM frontier
+            WHERE country = ? AND next_visit_at IS NOT NULL AND changerate IS NOT NULL;"""
+        rows = self.conn.execute(query, [self.country]).fetchall()
+        if len(rows) == 0:
+            print("No change rates learned yet for %s" % (self.country))
+            return(None)
+        fixed = len(rows) / float(self.interval)
+        adaptive = sum([1.0 / days for rate, days in rows])
+        fixedcoverage = sum([(1 - math.exp(-rate * self.interval)) / self.interval for rate, days in rows])
+        adaptivecoverage = sum([(1 - math.exp(-rate * days)) / days for rate, days in rows])
+        print("Revisits per day for %d ads in %s: %.1f fixed, %.1f adaptive (%.1f%% saved)" % (
+            len(rows), self.country, fixed, adaptive, 100 * (1 - adaptive / fixed)))
+        print("Changes detected per day: %.1f fixed, %.1f adaptive" % (fixedcoverage, adaptivecoverage))
+        return({'ads': len(rows), 'fixed': fixed, 'adaptive': adaptive,
+                'fixedcoverage': fixedcoverage, 'adaptivecoverage': adaptivecoverage})
@@ -0,0 +1,147 @@
+"""
+Purpose:  This module contains the html parsing backend used by the downloaders.
+The tree builder is chosen with ParserConfig.BACKEND (html.parser, lxml or
+html5lib) and extractors can ask for only the subtrees they read, so the rest
+of the page is never turned into a tree.  benchmark() times an extractor with
+each backend, with and without subtree selection, and checks that every
+combination extracts the same rows.  region_hash() fingerprints the text of
+those subtrees so a revisited page that did not change need not be extracted.
+"""
+
+import hashlib
+import time
+from bs4 import BeautifulSoup, SoupStrainer
+from config import ParserConfig
+
+
+def available_backends():
+    """Return the tree builders that are installed, html.parser is always available."""
+
+    backends = ['html.parser']
+    for backend, module in [('lxml', 'lxml'), ('html5lib', 'html5lib')]:
+        try:
+            __import__(module)
+            backends.append(backend)
+        except ImportError:
+            pass
+    return(backends)
+
+
+_backend = None
+_strain = ParserConfig.STRAIN
+
+
+def set_backend(backend=None, strain=None):
+    """Select the tree builder used by make_soup and whether subtrees are selected.
+    Falls back to html.parser if the backend is not installed.
+    """
+
+    global _backend, _strain
+    backend = backend if backend is not None else ParserConfig.BACKEND
+    if backend not in available_backends():
+        print("Parser backend %s is not installed, using html.parser" % (backend))
+        backend = 'html.parser'
+    _backend = backend
+    if strain is not None:
+        _strain = strain
+    return(_backend)
+
+
+def get_backend():
+    if _backend is None:
+        set_backend()
+    return(_backend)
+
+
+class Strainer(SoupStrainer):
+    """Strainer that keeps a tag if match(name, attrs) is true.  bs4 asks a strainer
+    whether to build each tag with search_tag before 4.13 and with allow_tag_creation
+    from 4.13 on, and only passes the tag name to a function strainer from 4.13 on,
+    so both methods are answered here from the name and attributes.
+    """
+
+    def __init__(self, names, match):
+        # the names are only there so that text outside the kept tags is dropped
+        SoupStrainer.__init__(self, name=sorted(names))
+        self.match = match
+
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        if hasattr(markup_name, 'attrs'):
+            markup_name, markup_attrs = markup_name.name, markup_name.attrs
+        return(self.match(markup_name, markup_attrs))
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return(self.match(name, attrs))
+
+
+def only(*selectors):
+    """Return a strainer keeping the subtrees matched by selectors.  A selector is
+    (tag, classes) or (tag, classes, id) where classes is a space separated string
+    of classes that must all be present, or None to match on the tag only.
+    """
+
+    selectors = [(s[0], set(s[1].split()) if s[1] is not None else set(), s[2] if len(s) > 2 else None) for s in selectors]
+
+    def match(name, attrs):
+        attrs = dict(attrs) if attrs is not None else {}
+        classes = attrs.get('class') or []
+        classes = set(classes.split() if isinstance(classes, str) else classes)
+        for tag, wanted, tagid in selectors:
+            if name == tag and wanted.issubset(classes) and (tagid is None or attrs.get('id') == tagid):
+                return(True)
+        return(False)
+
+    return(Strainer(set([tag for tag, wanted, tagid in selectors]), match))
+
+
+def make_soup(response, strainer=None):
+    """Parse a page with the selected backend.  If a strainer is given only the
+    subtrees it matches are built, html5lib does not support this and builds the full tree.
+    A page that was already parsed with the same strainer is returned as it is.
+    """
+
+    if isinstance(response, BeautifulSoup):
+        return(response)
+    backend = get_backend()
+    if strainer is None or not _strain or backend == 'html5lib':
+        return(BeautifulSoup(response, backend))
+    return(BeautifulSoup(response, backend, parse_only=strainer))
+
+
+def region_hash(soup):
+    """Hash of the text of a parsed page, normally only the subtrees kept by a strainer.
+    Whitespace and markup are ignored so only a change in the content changes the hash.
+    """
+
+    text = ' '.join(soup.get_text(' ').split())
+    return(hashlib.sha1(text.encode('utf-8')).hexdigest())
+
+
+def benchmark(extract, pages, backends=None, repeat=3):
+    """Time extract(page) over pages for each backend, with and without subtree
+    selection.  Rows are compared with html.parser on the full tree.  Returns a list
+    of dicts with the backend, whether subtrees were selected, pages/sec and whether
+    the rows matched.
+    """
+
+    backends = backends if backends is not None else available_backends()
+    previous = (get_backend(), _strain)
+    results = []
+    try:
+        set_backend('html.parser', strain=False)
+        reference = [extract(page) for page in pages]
+        for backend in backends:
+            for strain in [False, True]:
+                set_backend(backend, strain=strain)
+                starttime = time.time()
+                for i in range(repeat):
+                    rows = [extract(page) for page in pages]
+                seconds = (time.time() - starttime) / repeat
+                results.append({'backend': backend, 'strain': strain, 'pages': len(pages),
+                                'pagespersec': len(pages) / max(seconds, 1e-9), 'match': rows == reference})
+    finally:
+        set_backend(previous[0], strain=previous[1])
+    for r in results:
+        print("%-12s %-8s %8.1f pages/sec  rows %s" % (r['backend'], 'subtree' if r['strain'] else 'full',
+                                                     r['pagespersec'], 'match' if r['match'] else 'DIFFER'))
+    return(results)
@@ -0,0 +1,172 @@
+"""
+Purpose:  This module contains a pooled keep-alive HTTP session that is shared
+by all of the downloaders.  Connections are kept open and reused for each host
+so that thousands of ad pages do not each pay for a new TCP and TLS handshake.
+Connections have a connect and a read timeout so a dead host cannot hang a worker.
+"""
+
+import http.client
+import socket
+import ssl
+import sys
+import threading
+import urllib.parse
+import zlib
+from config import FetchConfig
+
+
+class SessionPool(object):
+    """Pool of keep-alive connections with a limit on connections per host.
+    Responses are requested with gzip/deflate encoding and decoded transparently.
+    """
+
+    headers = {
+        'User-Agent': 'Python-urllib/%d.%d' % sys.version_info[:2],
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    }
+
+    def __init__(self, perhost=FetchConfig.PERHOST, maxredirects=5,
+                 connecttimeout=FetchConfig.CONNECTTIMEOUT, readtimeout=FetchConfig.READTIMEOUT):
+        self.perhost = perhost
+        self.maxredirects = maxredirects
+        self.connecttimeout = connecttimeout
+        self.readtimeout = readtimeout
+        self.context = ssl.create_default_context()
+        self.idle = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'connections': 0, 'reused': 0, 'bytes': 0, 'rawbytes': 0}
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counts[key] += value
+
+    def _limit(self, key):
+        with self.lock:
+            if key not in self.limits:
+                self.limits[key] = threading.BoundedSemaphore(self.perhost)
+            return(self.limits[key])
+
+    def _acquire(self, key):
+        """Return an idle connection for the host or open a new one."""
+
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) > 0:
+                self.counts['reused'] += 1
+                return(conns.pop(), True)
+        return(self._connect(key), False)
+
+    def _connect(self, key):
+        """Open a new connection to the host.  The connect timeout applies while
+        connecting, after that the read timeout applies to each read on the socket.
+        """
+
+        self._count('connections')
+        scheme, host = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, context=self.context, timeout=self.connecttimeout)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=self.connecttimeout)
+        conn.connect()
+        conn.sock.settimeout(self.readtimeout)
+        return(conn)
+
+    def _release(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def _decode(self, response, body):
+        """Decompress body based on the content encoding of the response."""
+
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        if encoding == 'gzip':
+            return(zlib.decompress(body, 16 + zlib.MAX_WBITS))
+        elif encoding == 'deflate':
+            try:
+                return(zlib.decompress(body))
+            except zlib.error:
+                return(zlib.decompress(body, -zlib.MAX_WBITS))
+        return(body)
+
+    def _request(self, url):
+        """Make a single request on a pooled connection.  Returns (status, response, body)."""
+
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        with self._limit(key):
+            conn, reused = self._acquire(key)
+            try:
+                conn.request('GET', path, headers=self.headers)
+                response = conn.getresponse()
+            except Exception as e:
+                # a connection that failed is closed and never goes back to the pool
+                conn.close()
+                # only a keep-alive connection closed by the server is worth a fresh one, a host
+                # that is not answering would only keep a fresh connection waiting again
+                if not reused or isinstance(e, socket.timeout) or not isinstance(e, (http.client.HTTPException, ConnectionError)):
+                    raise
+                conn = self._connect(key)
+                try:
+                    conn.request('GET', path, headers=self.headers)
+                    response = conn.getresponse()
+                except Exception:
+                    conn.close()
+                    raise
+            try:
+                body = response.read()
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+        self._count('requests')
+        self._count('rawbytes', len(body))
+        body = self._decode(response, body)
+        self._count('bytes', len(body))
+        return(response.status, response, body)
+
+    def get(self, url):
+        """Request a url following redirects.  Returns (status, body)."""
+
+        for count in range(self.maxredirects + 1):
+            status, response, body = self._request(url)
+            location = response.getheader('Location')
+            if status in (301, 302, 303, 307, 308) and location is not None:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return(status, body)
+        return(status, body)
+
+    def stats(self):
+        """Return request counts along with the connection reuse rate."""
+
+        with self.lock:
+            stats = dict(self.counts)
+        total = stats['connections'] + stats['reused']
+        stats['reuserate'] = stats['reused'] / total if total > 0 else 0.0
+        return(stats)
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+
+_session = None
+
+def get_session():
+    """Return the session pool shared by all downloaders in this process."""
+
+    global _session
+    if _session is None:
+        _session = SessionPool()
+    return(_session)
@@ -3,53 +3,214 @@ Purpose:  This class consists of functions to scrape job advertisement data
 from OLX websites.  It is developed to store information in a SQL database
 that contains historical data on page views and other information.
 
-TODO:  Exploit that we can send out requests to different websites at once.
-Parallel process this....
+Each (site, country) download runs as its own job in a process pool so that
+requests are sent out to different websites at once.  Every job writes its
+own log file and the exit status is aggregated across all jobs.  Jobs that
+share a database file send their writes to a single writer for that file.
+
+In reparse mode no pages are requested.  The job ad tables are rebuilt from
+the raw pages kept by each downloader, one job at a time with the pages of a
+job parsed on all cores.
 
 Author:  Natalie Chun
 Created: 22 November 2018
 """
 
+import argparse
+import concurrent.futures
+import datetime
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from config import FileConfig, FetchConfig
+from basedownloader import export_archive
+from dbwriter import WriterService
+from fetchengine import get_engine
+from migrations import migrate_file
 from olxdownloader import OLXDownloader
 from wuzzufdownloader import WuzzufDownloader
+from tanqeebdownloader import TanQeebDownloader
+
+
+RUNDATA = {
+    'olx' : True,
+    'wuzzuf' : False,
+    'tanqeeb': True
+}
+
+COUNTRYPARAMS = {
+    'olx': [
+        {"country":"jordan", "url":"https://olx.jo/en/", "timezone":"Asia/Amman"},
+        {"country":"egypt", "url":"https://olx.com.eg/en/", "timezone":"Africa/Cairo"}
+    ],
+    'tanqeeb': [
+        {"country":"algeria", "webname":"algerie", "timezone":"Africa/Algiers"},
+        {"country":"egypt", "webname":"egypt", "timezone":"Africa/Cairo"},
+        {"country":"jordan", "webname":"jordan", "timezone":"Asia/Amman"},
+        {"country":"morocco", "webname":"morocco", "timezone":"Africa/Casablanca"},
+        {"country":"tunisia", "webname":"tunisia", "timezone":"Africa/Tunis"}
+    ],
+    'wuzzuf': [
+        {"country":"egypt"}
+    ]
+}
 
+DOWNLOADERS = {
+    'olx': OLXDownloader,
+    'tanqeeb': TanQeebDownloader,
+    'wuzzuf': WuzzufDownloader
+}
 
-def main():
-    """Function to run downloads of various data."""
-    
-    rundata = {
-        'olx' : True,
-        'wuzzuf' : False,
-        'tanqeeb': True
-    }
-    
-    for rundata, value in rundata.items():
+
+def get_jobs(rundata=RUNDATA):
+    """List the (site, params) jobs that should be run."""
+
+    jobs = []
+    for site, value in rundata.items():
         if value:
-            if rundata == 'olx':
-    
-                countryparams = [
-                    {"country":"jordan", "url":"https://olx.jo/en/", "timezone":"Asia/Amman"},
-                    {"country":"egypt", "url":"https://olx.com.eg/en/", "timezone":"Africa/Cairo"}
-                ]
-                for params in countryparams:
-                    od = OLXDownloader(params)
-                    od.run_all()
-            elif rundata == 'tanqeeb':
-                countryparams = [
-                    {"country":"algeria", "webname":"algerie", "timezone":"Africa/Algiers"},
-                    {"country":"egypt", "webname":"egypt", "timezone":"Africa/Cairo"},
-                    {"country":"jordan", "webname":"jordan", "timezone":"Asia/Amman"},
-                    {"country":"morocco", "webname":"morocco", "timezone":"Africa/Casablanca"},
-                    {"country":"tunisia", "webname":"tunisia", "timezone":"Africa/Tunis"}
-                ]
-                for params in countryparams:
-                    td = TanQeebDownloader(params)
-                    td.run_all()
-            elif rundata == 'wuzzuf':
-                wd = WuzzufDownloader()
-                wd.run_all()
-        
-        
-if __name__ == "__main__":
-    main()
+            for params in COUNTRYPARAMS[site]:
+                jobs.append((site, params))
+    return(jobs)
+
+
+def run_job(site, params, logdir, writer=None, reparse=False):
+    """Run a single download job with its output written to its own log file.
+    If reparse is True stored pages are parsed again instead of downloading.
+    Returns (jobname, status, runtime) where status is 0 on success.
+    """
+
+    jobname = '%s_%s' % (site, params['country'])
+    logfile = os.path.join(logdir, '%s_%s.log' % (jobname, datetime.datetime.now().strftime('%Y%m%d')))
+    starttime = time.time()
+    stdout, stderr = sys.stdout, sys.stderr
+    status = 0
+    downloader = None
+    with open(logfile, 'a') as log:
+        sys.stdout = sys.stderr = log
+        try:
+            if site == 'olx':
+                downloader = OLXDownloader(params, writer=writer)
+            elif site == 'tanqeeb':
+                downloader = TanQeebDownloader(params, writer=writer)
+            elif site == 'wuzzuf':
+                downloader = WuzzufDownloader(writer=writer, params=params)
+            if reparse:
+                downloader.reparse()
+            else:
+                get_engine().start_run(FetchConfig.DEADLINE)
+                downloader.run_all()
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # write out rows still buffered if the run stopped early
+            if downloader is not None:
+                try:
+                    downloader.close()
+                except Exception:
+                    traceback.print_exc()
+                    status = 1
+            log.flush()
+            sys.stdout, sys.stderr = stdout, stderr
+    return(jobname, status, time.time()-starttime)
+
+
+def archive_all(jobs, datecur=None):
+    """On the first day of each month write the archived rows of each database into
+    its Parquet archive, once per database for the countries of its jobs.  Returns the
+    number of databases that failed.
+    """
+
+    datecur = datecur if datecur is not None else datetime.datetime.now()
+    if datecur.day != 1:
+        return(0)
+    failed = 0
+    for site in sorted(set([site for site, params in jobs])):
+        countries = [params['country'] for s, params in jobs if s == site]
+        if len(DOWNLOADERS[site].archivetables) == 0:
+            continue
+        try:
+            export_archive(os.path.join(FileConfig.EXTDIR, site), DOWNLOADERS[site].dbname,
+                           DOWNLOADERS[site].archivetables, countries, datecur)
+        except Exception:
+            traceback.print_exc()
+            failed += 1
+    return(failed)
 
+
+def reparse_all(jobs, logdir):
+    """Rebuild the job ad tables of each job from stored pages, one job after the other."""
+
+    results = []
+    for site, params in jobs:
+        jobname, status, runtime = run_job(site, params, logdir, reparse=True)
+        print("Reparse %s finished with status %d in %.0f seconds" % (jobname, status, runtime))
+        results.append((jobname, status, runtime))
+    return(results)
+
+
+def main(workers=None, rundata=RUNDATA, reparse=False):
+    """Function to run downloads of various data.  Jobs for each site and country
+    are run concurrently on a pool of worker processes.  Returns 0 if all jobs succeeded.
+    """
+
+    jobs = get_jobs(rundata)
+    if len(jobs) == 0:
+        # a process pool cannot be started without workers
+        print("No jobs to run, every site is switched off in rundata")
+        return(0)
+    logdir = os.path.join(FileConfig.datapath, 'logs')
+    if not os.path.exists(logdir):
+        os.makedirs(logdir)
+    workers = workers if workers is not None else len(jobs)
+    print("Running %d jobs on %d workers" % (len(jobs), workers))
+
+    # apply schema migrations once before the jobs sharing each database start
+    dbpaths = sorted(set([os.path.join(FileConfig.EXTDIR, site, DOWNLOADERS[site].dbname) for site, params in jobs]))
+    for dbpath in dbpaths:
+        if os.path.exists(dbpath):
+            migrate_file(dbpath)
+
+    if reparse:
+        starttime = time.time()
+        failed = [jobname for jobname, status, runtime in reparse_all(jobs, logdir) if status != 0]
+        print("Total reparse time: %.0f seconds, %d of %d jobs failed %s" % (time.time()-starttime, len(failed), len(jobs), failed))
+        return(1 if len(failed) > 0 else 0)
+
+    results = []
+    starttime = time.time()
+    manager = multiprocessing.Manager()
+    writers = WriterService(manager)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for site, params in jobs:
+            writer = writers.client(os.path.join(FileConfig.EXTDIR, site, DOWNLOADERS[site].dbname))
+            futures[executor.submit(run_job, site, params, logdir, writer)] = (site, params)
+        for future in concurrent.futures.as_completed(futures):
+            site, params = futures[future]
+            try:
+                jobname, status, runtime = future.result()
+            except Exception as e:
+                # worker process died before the job could report back
+                jobname, status, runtime = '%s_%s' % (site, params['country']), 1, time.time()-starttime
+                print("Job %s failed: %s" % (jobname, e))
+            print("Job %s finished with status %d in %.0f seconds" % (jobname, status, runtime))
+            results.append((jobname, status, runtime))
+    writers.close()
+    manager.shutdown()
+    # archived rows are exported after all jobs sharing a database have moved theirs
+    archivefailed = archive_all(jobs)
+
+    failed = [jobname for jobname, status, runtime in results if status != 0]
+    print("Total run time: %.0f seconds, %d of %d jobs failed %s" % (time.time()-starttime, len(failed), len(results), failed))
+    return(1 if len(failed) > 0 or archivefailed > 0 else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download job advertisement data.')
+    parser.add_argument('--workers', type=int, default=None, help='number of jobs run at once (default: one per job)')
+    parser.add_argument('--reparse', action='store_true', help='rebuild job ad tables from stored pages without downloading')
+    args = parser.parse_args()
+    sys.exit(main(workers=args.workers, reparse=args.reparse))
@@ -0,0 +1,288 @@
+"""
+Purpose:  This module contains the versioned schema migrations for the
+databases written by the downloaders.  The schema version is stored in each
+database (PRAGMA user_version) and pending migrations are applied in order.
+Tables are rebuilt online by copying rows in batches, so a migration never
+holds a long exclusive lock or loads a whole table into memory.  Jobs that
+share a database migrate it under a lock file next to it, so only one of them
+applies each migration.
+"""
+
+import argparse
+import os
+import time
+from dbconnect import connect_db, close_db
+from processlock import FileLock
+from create_databases import get_frontier_table_schema, get_frontier_table_indexes, get_pagevisit_table_schema, get_listingcursor_table_schema, get_pendingads_table_schema, create_indexes
+
+
+def get_version(conn):
+    return(conn.execute("PRAGMA user_version;").fetchone()[0])
+
+
+def set_version(conn, version):
+    conn.execute("PRAGMA user_version = %d;" % (int(version)))
+    conn.commit()
+
+
+def get_columns(conn, tablename):
+    return([row[1] for row in conn.execute("PRAGMA table_info(%s);" % (tablename)).fetchall()])
+
+
+def add_column(conn, tablename, columndef):
+    """Add a column to a table unless it already exists.  This does not copy any rows."""
+
+    column = columndef.split()[0]
+    if column not in get_columns(conn, tablename):
+        conn.execute("ALTER TABLE %s ADD COLUMN %s;" % (tablename, columndef))
+        conn.commit()
+
+
+def rebuild_table(conn, tablename, newtablequery, columns, key=None, batchsize=10000, onbatch=None):
+    """Rebuild a table with a new definition, copying the listed columns in batches.
+    Each batch is its own transaction so writers can get in between batches.  While
+    copying, triggers on the old table apply every insert, update and delete to the new
+    table, so rows written or deleted during the copy end up as they are in the old table.
+    Rows are matched by rowid, which is copied, unless key lists columns that are unique
+    in the new table, which is needed when its rowid is an INTEGER PRIMARY KEY.  The
+    secondary indexes of the old table are created again on the new table in the final
+    swap, which is the only step that holds the write lock for more than a batch.
+    newtablequery must create the table under the name tablename.  onbatch, if given,
+    is called with the number of rows copied so far after each batch is committed.
+    """
+
+    temptable = '%s_new' % (tablename)
+    copycols = (['rowid'] if key is None else []) + list(columns)
+    collist = ', '.join(copycols)
+    newlist = ', '.join(['NEW.%s' % (column) for column in copycols])
+    match = ' AND '.join(['%s IS OLD.%s' % (column, column) for column in (['rowid'] if key is None else key)])
+    conn.execute("DROP TABLE IF EXISTS %s;" % (temptable))
+    conn.execute(newtablequery.replace(tablename, temptable, 1))
+    for event in ['insert', 'update', 'delete']:
+        conn.execute("DROP TRIGGER IF EXISTS %s_rebuild_%s;" % (tablename, event))
+    conn.execute("""CREATE TRIGGER %s_rebuild_insert AFTER INSERT ON %s BEGIN
+        INSERT OR REPLACE INTO %s (%s) VALUES (%s); END;""" % (tablename, tablename, temptable, collist, newlist))
+    conn.execute("""CREATE TRIGGER %s_rebuild_update AFTER UPDATE ON %s BEGIN
+        DELETE FROM %s WHERE %s;
+        INSERT OR REPLACE INTO %s (%s) VALUES (%s); END;""" % (tablename, tablename, temptable, match, temptable, collist, newlist))
+    conn.execute("""CREATE TRIGGER %s_rebuild_delete AFTER DELETE ON %s BEGIN
+        DELETE FROM %s WHERE %s; END;""" % (tablename, tablename, temptable, match))
+    conn.commit()
+
+    total = conn.execute("SELECT COUNT(*) FROM %s;" % (tablename)).fetchone()[0]
+    maxrowid = conn.execute("SELECT MAX(rowid) FROM %s;" % (tablename)).fetchone()[0] or 0
+    print("Copying %d rows of %s" % (total, tablename))
+    # rows already written by a trigger are newer than the batch and are kept
+    query = "INSERT OR IGNORE INTO %s (%s) SELECT %s FROM %s WHERE rowid > ? AND rowid <= ?;" % (temptable, collist, collist, tablename)
+    starttime = time.time()
+    copied = 0
+    lastrowid = 0
+    while lastrowid < maxrowid:
+        with conn:
+            cur = conn.execute(query, [lastrowid, lastrowid + batchsize])
+        copied += cur.rowcount
+        lastrowid += batchsize
+        print("Copied %d of %d rows of %s (%.0f seconds)" % (copied, total, tablename, time.time()-starttime))
+        if onbatch is not None:
+            onbatch(copied)
+
+    # swap in the new table with the indexes of the old one, dropping the old table drops its triggers
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        indexes = [row[0] for row in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL;",
+                                                  [tablename]).fetchall()]
+        conn.execute("DROP TABLE %s;" % (tablename))
+        conn.execute("ALTER TABLE %s RENAME TO %s;" % (temptable, tablename))
+        for index in indexes:
+            conn.execute(index)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    newtotal = conn.execute("SELECT COUNT(*) FROM %s;" % (tablename)).fetchone()[0]
+    print("Number of entries in converted table %s: %d" % (tablename, newtotal))
+
+
+class Migration(object):
+    """A single schema change that moves a database to version."""
+
+    def __init__(self, version, description, apply):
+        self.version = version
+        self.description = description
+        self.apply = apply
+
+
+def _baseline(conn):
+    """Schema as created by create_databases, nothing to change."""
+    pass
+
+
+def _create_archivelog(conn):
+    """Keep the watermark of each incremental archive run, per table and country."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS archivelog (
+        tablename VARCHAR(30),
+        country VARCHAR(20),
+        rundate DATE,
+        cutoffdate DATE,
+        numuids INTEGER,
+        numrows INTEGER,
+        seconds REAL,
+        PRIMARY KEY(tablename, country, rundate));""")
+    conn.commit()
+
+
+def _pad_date(date):
+    """Zero-pad a year-month-day date such as 2018-3-5, other values are returned as they are."""
+
+    try:
+        year, month, day = [int(part) for part in date.split('-')]
+    except (AttributeError, ValueError):
+        return(date)
+    return('%d-%02d-%02d' % (year, month, day))
+
+
+def _pad_listing_postdates(conn, batchsize=10000):
+    """Zero-pad the postdates of OLX listings written before they were padded, in every
+    table they were copied to, so DATE() and comparisons with padded dates can read them.
+    A row whose padded twin is already in the table is a duplicate and is dropped.
+    Each batch of rows is its own transaction.
+    """
+
+    conn.create_function('pad_date', 1, _pad_date)
+    for tablename in ['jobadpageurls', 'jobadpagedata', 'archivedjobadpageurls', 'archivedjobadpagedata', 'frontier']:
+        if 'postdate' not in get_columns(conn, tablename):
+            continue
+        lastrowid = 0
+        numrows = 0
+        while True:
+            rowids = [str(row[0]) for row in conn.execute("""SELECT rowid FROM %s WHERE rowid > ?
+                AND postdate NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+                ORDER BY rowid LIMIT ?;""" % (tablename), [lastrowid, batchsize]).fetchall()]
+            if len(rowids) == 0:
+                break
+            lastrowid = int(rowids[-1])
+            conn.execute("""UPDATE OR IGNORE %s SET postdate = pad_date(postdate) WHERE rowid IN (%s);""" % (tablename, ','.join(rowids)))
+            conn.execute("""DELETE FROM %s WHERE rowid IN (%s) AND postdate != pad_date(postdate);""" % (tablename, ','.join(rowids)))
+            conn.commit()
+            numrows += len(rowids)
+        if numrows > 0:
+            print("Padded the postdates of %d rows of %s" % (numrows, tablename))
+
+
+def _create_frontier(conn):
+    """Add the crawl frontier used to schedule revisits of ad pages."""
+    for query in get_frontier_table_schema().values():
+        conn.execute(query)
+    create_indexes(conn, get_frontier_table_indexes())
+
+
+def _add_frontier_rates(conn):
+    """Keep the learned change rate and revisit interval of each ad in the frontier."""
+    add_column(conn, 'frontier', 'changerate REAL')
+    add_column(conn, 'frontier', 'revisit_days REAL')
+
+
+def _create_pagevisits(conn):
+    """Keep a content hash of each revisited ad page and the visits that found it unchanged."""
+    for query in get_pagevisit_table_schema().values():
+        conn.execute(query)
+    conn.commit()
+
+
+def _create_listingcursors(conn):
+    """Checkpoint the next page of each listing so a crawl can be resumed."""
+    for query in get_listingcursor_table_schema().values():
+        conn.execute(query)
+    conn.commit()
+
+
+def _create_pendingads(conn):
+    """Keep one row per Tanqeeb ad to fetch.  Ads already in jobadpage are marked as
+    fetched and the other ads in jobadpageurls are pending.
+    """
+    for query in get_pendingads_table_schema().values():
+        conn.execute(query)
+    conn.execute("""INSERT OR IGNORE INTO pendingads (country, uniqueid, href, added, fetched)
+        SELECT country, uniqueid, NULL, MIN(postdate), MIN(postdate) FROM jobadpage GROUP BY country, uniqueid;""")
+    conn.execute("""INSERT OR IGNORE INTO pendingads (country, uniqueid, href, added, fetched)
+        SELECT country, uniqueid, MIN(href), MIN(postdate), NULL FROM jobadpageurls GROUP BY country, uniqueid;""")
+    conn.commit()
+
+
+# migrations for each database file, in increasing version order
+MIGRATIONS = {
+    'OLX.db': [
+        Migration(1, 'baseline schema', _baseline),
+        Migration(2, 'add archivelog watermark table', _create_archivelog),
+        Migration(3, 'add crawl frontier', _create_frontier),
+        Migration(4, 'add change rates to frontier', _add_frontier_rates),
+        Migration(5, 'zero-pad listing postdates', _pad_listing_postdates),
+        Migration(6, 'add page hashes and unchanged visits', _create_pagevisits),
+    ],
+    'wuzzuf_new.db': [
+        Migration(1, 'baseline schema', _baseline),
+        Migration(2, 'add archivelog watermark table', _create_archivelog),
+        Migration(3, 'add crawl frontier', _create_frontier),
+        Migration(4, 'add change rates to frontier', _add_frontier_rates),
+        Migration(5, 'add page hashes and unchanged visits', _create_pagevisits),
+    ],
+    'tanqeeb.db': [
+        Migration(1, 'baseline schema', _baseline),
+        Migration(2, 'add listing cursors', _create_listingcursors),
+        Migration(3, 'add pending ads', _create_pendingads),
+    ],
+    'tanqeebcv.db': [
+        Migration(1, 'baseline schema', _baseline),
+    ],
+}
+
+
+def migrate(conn, dbname, target=None):
+    """Apply pending migrations registered for dbname.  Returns the schema version.
+    The version is read and the migrations applied while holding <database>.migrate.lock,
+    so a job that waited for another one to migrate finds the new version.
+    """
+
+    # the main database file of the connection, empty for an in-memory database
+    dbpath = conn.execute("PRAGMA database_list;").fetchone()[2]
+    if dbpath == '':
+        return(_migrate(conn, dbname, target))
+    with FileLock(dbpath + '.migrate.lock'):
+        return(_migrate(conn, dbname, target))
+
+
+def _migrate(conn, dbname, target):
+    migrations = MIGRATIONS.get(dbname, [])
+    # end any read transaction so the version is read from the latest state of the file
+    conn.commit()
+    version = get_version(conn)
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        if target is not None and migration.version > target:
+            break
+        print("Migrating %s to version %d: %s" % (dbname, migration.version, migration.description))
+        starttime = time.time()
+        migration.apply(conn)
+        set_version(conn, migration.version)
+        version = migration.version
+        print("Migrated %s to version %d in %.0f seconds" % (dbname, version, time.time()-starttime))
+    return(version)
+
+
+def migrate_file(dbpath, target=None):
+    """Apply pending migrations to the database file at dbpath."""
+
+    conn = connect_db(dbpath)
+    try:
+        return(migrate(conn, os.path.basename(dbpath), target=target))
+    finally:
+        close_db(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply schema migrations to a downloader database.')
+    parser.add_argument('dbpath', help='path to OLX.db, wuzzuf_new.db, tanqeeb.db or tanqeebcv.db')
+    parser.add_argument('--target', type=int, default=None, help='migrate up to this version only')
+    args = parser.parse_args()
+    print("Schema version: %d" % (migrate_file(args.dbpath, target=args.target)))
@@ -0,0 +1,457 @@
+"""
+Purpose:  This module contains a local stand-in for the job boards so that a
+full crawl can be load-tested without touching the real sites.  The server
+makes up Wuzzuf search and job pages, OLX sitemap, region, listing and ad
+pages and Tanqeeb main, category, summary and ad pages with the markup the
+downloaders parse.  Pages are the same for the same url, while the response
+latency and the share of failed requests are set per run.
+
+The driver starts the server, points each downloader at it with a fresh data
+directory and runs run_all, then reports pages served and database rows
+written per minute for each site:
+
+    python src/mockboard.py
+    python src/mockboard.py --sites olx --latency 0.2 --errors 0.05 --pages 5
+
+Urls served (the site is the first part of the path):
+    /wuzzuf/search/jobs?start=<n>           /wuzzuf/jobs/p/<id>-<title>
+    /olx/en/sitemap/regions/                /olx/en/jobs-services/<subregion>/
+    /olx/en/jobs-services/<subregion>/<sector>/?page=<n>
+    /olx/en/ad/<title>-ID<id>.html
+    /tanqeeb/en                             /tanqeeb/en/category/<category>
+    /tanqeeb/en/jobs/<subcat>?page=<n>      /tanqeeb/en/jobs/view/<id>-<title>
+    /_stats
+"""
+
+import argparse
+import datetime
+import gzip
+import http.server
+import json
+import multiprocessing
+import os
+import random
+import re
+import socketserver
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from config import MockBoardConfig, FetchConfig, FileConfig
+
+
+WORDS = ('job experience team work company customer sales engineer manager skills office support '
+         'development marketing service project data quality training finance business senior junior').split()
+SECTORS = ['sales', 'engineering', 'accounting', 'customer-service', 'it', 'marketing', 'education', 'medical']
+REGIONS = [('Amman', ['Abdali', 'Shmeisani', 'Sweifieh', 'Khalda', 'Marka']),
+           ('Irbid', ['Hakama', 'Husn', 'Ramtha', 'Sareeh', 'Aidoun']),
+           ('Zarqa', ['Russeifa', 'Hashemiya', 'Azraq', 'Dhlail', 'Sukhna'])]
+CATEGORIES = ['Sales', 'Engineering', 'Accounting', 'Marketing', 'Education', 'Medical']
+
+
+def _rng(*key):
+    """Random generator seeded by key so the same url always gives the same page."""
+    return(random.Random(zlib.crc32('/'.join([str(k) for k in key]).encode('utf-8'))))
+
+
+def _text(rng, n):
+    return(' '.join([rng.choice(WORDS) for i in range(n)]))
+
+
+def _closed(uid, closedrate):
+    return(_rng('closed', uid).random() < closedrate)
+
+
+class Board(object):
+    """Makes up the pages of the three sites.  base is the scheme and host the
+    downloaders use to reach the server, so that links point back to it.
+    """
+
+    def __init__(self, pages=MockBoardConfig.PAGES, adsperpage=MockBoardConfig.ADSPERPAGE,
+                 closedrate=MockBoardConfig.CLOSEDRATE, padding=MockBoardConfig.PADDING, days=MockBoardConfig.DAYS):
+        self.pages = pages
+        self.adsperpage = adsperpage
+        self.closedrate = closedrate
+        self.padding = padding
+        self.days = days
+
+    def _page(self, title, body, head=''):
+        """Wrap content in page chrome of about self.padding bytes."""
+
+        rng = _rng('chrome', title)
+        nav = []
+        size = 0
+        while size < self.padding:
+            item = '<li class="nav-item"><a class="nav-link" href="/p/%d">%s</a></li>\n' % (rng.randint(1, 10**6), _text(rng, 3))
+            nav.append(item)
+            size += len(item)
+        return(('<!DOCTYPE html>\n<html lang="en"><head><meta charset="utf-8"><title>%s</title>%s</head><body>'
+                '<header><nav class="navbar"><ul class="nav">%s</ul></nav></header>\n<main>%s</main>\n'
+                '<footer><p>%s</p></footer></body></html>\n') % (title, head, ''.join(nav), body, _text(rng, 40)))
+
+    def _age(self, index, total):
+        """Days since posting of the index-th newest of total ads."""
+        return(int(index * self.days / max(total, 1)))
+
+    # ------------------------------------------------------------------ wuzzuf
+
+    def wuzzuf_search(self, base, start):
+        total = self.pages * self.adsperpage
+        now = datetime.datetime.now()
+        jobs = []
+        for i in range(start, min(start + self.adsperpage, total)):
+            uid = 200000 + i
+            posted = now - datetime.timedelta(days=self._age(i, total), minutes=i)
+            jobs.append('<div class="new-time"><a href="%sjobs/p/%d-%s?o=%d">%s</a><time title="%s">%s</time></div>' % (
+                base, uid, _text(_rng(uid), 3).replace(' ', '-'), i, _text(_rng(uid), 4).title(),
+                posted.strftime('%A, %B %d, %Y at %H:%M%p'), posted.strftime('%d %b')))
+        pager = ''
+        if start + self.adsperpage < total:
+            pager = '<ul class="pagination"><li class="pag-next"><a href="%ssearch/jobs?start=%d&amp;filters%%5Bcountry%%5D%%5B0%%5D=Egypt">Next</a></li></ul>' % (
+                base, start + self.adsperpage)
+        return(self._page('Jobs in Egypt - Wuzzuf', '<div class="content-card card-has-jobs">%s%s</div>' % (''.join(jobs), pager)))
+
+    def wuzzuf_job(self, uid):
+        rng = _rng('wuzzuf', uid)
+        total = self.pages * self.adsperpage
+        posted = datetime.datetime.now() - datetime.timedelta(days=self._age(uid - 200000, total))
+        days = max((datetime.datetime.now() - posted).days, 0) + 1
+        alert = '<div class="alert alert-danger alert-job col-sm-12">This job is no longer available</div>' if _closed(uid, self.closedrate) else ''
+        summary = ''.join(['<dl><dt>%s:</dt><dd>%s</dd></dl>' % kv for kv in [
+            ('Experience Needed', '%d to %d years' % (rng.randint(0, 3), rng.randint(4, 10))), ('Career Level', 'Experienced (Non-Manager)'),
+            ('Job Type', rng.choice(['Full Time', 'Part Time'])), ('Salary', rng.choice(['Negotiable', '5,000 To 8,000 EGP Per Month'])),
+            ('Education Level', "Bachelor's Degree"), ('Gender', 'Not specified'), ('Travel Frequency', 'Never'),
+            ('Languages', 'Arabic, English'), ('Vacancies', '%d open positions' % rng.randint(1, 5))]])
+        body = ('%s<div class="job-main-card content-card"><h1 class="job-title">%s</h1><a class="job-company-name" href="#">%s</a>'
+                '<span class="job-company-location">Cairo, Egypt</span><div class="applicants-num">%d</div><span class="vacancies-num">%d</span>'
+                '<div class="applicants-stat-num">%d</div><div class="applicants-stat-num">%d</div><div class="applicants-stat-num">%d</div>'
+                '<p class="job-post-date" title="%s">posted</p></div><div class="row job-summary">%s</div>'
+                '<div class="about-job content-card"><p>%s</p><div class="labels-wrapper"><a href="#">%s</a><a href="#">%s</a></div></div>'
+                '<div class="job-requirements content-card"><meta itemprop="skills" content="%s"><ul>%s</ul></div>'
+                '<div class="industries labels-wrapper"><a href="#">%s</a></div>') % (
+                alert, _text(rng, 4).title(), _text(rng, 2).title(), 7 * days + rng.randint(0, 20), rng.randint(1, 5),
+                5 * days, days // 2, days, posted.strftime('%A, %B %d, %Y at %I:%M%p'), summary, _text(rng, 80),
+                _text(rng, 2).title(), _text(rng, 2).title(), ', '.join([rng.choice(WORDS) for i in range(5)]),
+                ''.join(['<li>%s.</li>' % _text(rng, 10) for i in range(8)]), _text(rng, 3).title())
+        return(self._page('Job - Wuzzuf', body))
+
+    # ------------------------------------------------------------------ olx
+
+    def _olx_regions(self):
+        return([(region, subregions[:MockBoardConfig.OLXSUBREGIONS]) for region, subregions in REGIONS[:MockBoardConfig.OLXREGIONS]])
+
+    def olx_sitemap(self):
+        parts = []
+        for region, subregions in self._olx_regions():
+            counts = [_rng(s).randint(50, 500) for s in subregions]
+            parts.append('<div class="bgef pding5_10 marginbott10 margintop20 clr"><a href="#">%s</a> (%d)</div>' % (region, sum(counts)))
+            parts.append('<div class="clr marginbott10"><ul>%s</ul></div>' % ''.join([
+                '<li><a href="#">%s</a>\n(%d)</li>' % (s, n) for s, n in zip(subregions, counts)]))
+        return(self._page('Sitemap - OLX', '<div class="content text">%s</div>' % ''.join(parts)))
+
+    def olx_region(self, base, fsubreg):
+        links = ''.join(['<a class="topLink tdnone " href="%sjobs-services/%s/%s/"><span class="link">%s</span><span class="counter nowrap">%d</span></a>' % (
+            base, fsubreg, sector, sector.replace('-', ' ').title(), _rng(fsubreg, sector).randint(10, 300))
+            for sector in SECTORS[:MockBoardConfig.OLXSECTORS]])
+        return(self._page('Jobs - OLX', '<div class="wrapper"><div class="categories">%s</div></div>' % links))
+
+    def olx_listing(self, base, fsubreg, sector, page):
+        now = datetime.datetime.now()
+        total = self.pages * self.adsperpage
+        ads = []
+        for i in range((page - 1) * self.adsperpage, min(page * self.adsperpage, total)):
+            uid = 100000000 + zlib.crc32(('%s/%s/%d' % (fsubreg, sector, i)).encode('utf-8')) % 10**8
+            age = self._age(i, total)
+            posted = now - datetime.timedelta(days=age)
+            date = 'Today %s' % posted.strftime('%H:%M') if age == 0 else 'Yesterday %s' % posted.strftime('%H:%M') if age == 1 else posted.strftime('%d  %b')
+            rng = _rng('olx', uid)
+            photo = 'https://olx.jo/static/img/jobs-services-thumb.png' if rng.random() < 0.7 else 'https://img.olx.jo/%d.jpg' % uid
+            paid = '<span class="ads__item__paidicon icon paid"></span>' if rng.random() < 0.1 else ''
+            ads.append('<div class="ads__item"><div class="ads__item__photos-holder"><a class="ads__item__photos-link detailsLink {id:%d}" '
+                       'data-statkey="ad.observed.list" href="#"><img src="%s"></a>%s</div><div class="ads__item__info">'
+                       '<a class="ads__item__title" href="%sad/%s-ID%d.html">%s</a><p class="ads__item__date">%s</p></div></div>' % (
+                       uid, photo, paid, base, _text(rng, 3).replace(' ', '-'), uid, _text(rng, 4), date))
+        pager = '<div class="pager rel clr"><form><input type="submit" class="button {page:%d}" value="%d"></form></div>' % (self.pages, self.pages)
+        return(self._page('Jobs - OLX', '<div class="wrapper"><div class="listing">%s</div>%s</div>' % (''.join(ads), pager)))
+
+    def olx_ad(self, uid):
+        if _closed(uid, self.closedrate):
+            return(self._page('OLX', '<div class="wrapper"><h2>This ad is no longer available</h2></div>'))
+        rng = _rng('olx', uid)
+        posted = datetime.datetime.now() - datetime.timedelta(days=rng.randint(0, self.days))
+        views = rng.randint(10, 100) + 5 * (datetime.datetime.now() - posted).days
+        params = ''.join(['<td class="col"><table class="item"><tr><th>%s</th><td class="value"><strong>%s</strong></td></tr></table></td>' % kv for kv in [
+            ('Experience Level', rng.choice(['Entry level', 'Experienced'])), ('Education Level', 'Bachelors'),
+            ('Type', rng.choice(['Sales', 'Engineering'])), ('Employment Type', rng.choice(['Full time', 'Part time']))]])
+        body = ('<div class="wrapper"><div class="clr offerheadinner pding15 pdingright20"><h1>%s</h1>'
+                '<span class="pdingleft10 brlefte5">Added at %s, Ad ID: %d</span></div>'
+                '<div class="clr descriptioncontent marginbott20"><table class="details"><tr>%s</tr></table></div>'
+                '<div class="clr" id="textContent"><p>%s</p></div><div class="pdingtop10"><span>Views:<strong>%d</strong></span></div>'
+                '<div class="pricelabel tcenter"><strong>%d JOD</strong></div>'
+                '<div class="user-box"><a href="#user">profile</a><p class="user-box__info__name">%s</p>'
+                '<p class="user-box__info__age">On site since %s</p></div>'
+                '<div class="contactbox innerbox br3 bgfff rel"><span>Email Seller</span></div>'
+                '<div class="contactbox-indent rel brkword">Show phone</div></div>') % (
+                _text(rng, 4), posted.strftime('%H:%M, %d %B %Y'), uid, params, _text(rng, 100), views,
+                rng.randint(200, 900), _text(rng, 2).title(), posted.strftime('%b %Y'))
+        return(self._page('Ad - OLX', body))
+
+    # ------------------------------------------------------------------ tanqeeb
+
+    def tanqeeb_main(self):
+        names = ['%s Jobs' % c for c in CATEGORIES[:MockBoardConfig.TANQEEBCATEGORIES]]
+        links = ''.join(['<li><a href="/en/category/%s"><img src="/img/%d.png">%s</a></li>' % (
+            name.split(' ')[0].lower(), i, name) for i, name in enumerate(names)])
+        links += '<li><a href="/en/jobs/amman">Jobs in Amman</a></li>'
+        return(self._page('Tanqeeb', '<div class="tab-content"><ul class="row">%s</ul></div>' % links))
+
+    def tanqeeb_category(self, cat):
+        links = ''.join(['<li><a href="/en/jobs/%s-%s">%s %s Jobs</a></li>' % (cat, word, cat.title(), word.title())
+                         for word in WORDS[:MockBoardConfig.TANQEEBSUBCATS]])
+        return(self._page('Tanqeeb', '<div class="panel panel-default"><ul class="row">%s</ul></div>' % links))
+
+    def tanqeeb_summary(self, base, subcat, page):
+        now = datetime.datetime.now()
+        total = self.pages * self.adsperpage
+        jobs = []
+        for i in range((page - 1) * self.adsperpage, min(page * self.adsperpage, total)):
+            # ads are listed under several subcategories, as on the real site
+            uid = 800000 + zlib.crc32(('%s/%d' % (subcat.split('-')[0], i)).encode('utf-8')) % (total * MockBoardConfig.TANQEEBSUBCATS)
+            rng = _rng('tanqeeb', uid)
+            posted = now - datetime.timedelta(days=self._age(i, total))
+            jobs.append('<div id="job_%d" data-id="%d" class="job-box%s"><h2><a href="/en/jobs/view/%d-%s">%s</a></h2>'
+                        '<div class="meta-desc"><a href="#">%s</a> <span>%s</span></div><p>%s</p></div>' % (
+                        uid, uid, ' featured_job' if rng.random() < 0.1 else '', uid, _text(rng, 2).replace(' ', '-'),
+                        _text(rng, 4).title(), _text(rng, 2).title(), '%d %s' % (posted.day, posted.strftime('%B %Y')), _text(rng, 30)))
+        head = ''
+        if page < self.pages:
+            head = '<link rel="next" href="%sen/jobs/%s?page=%d">' % (base, subcat, page + 1)
+        return(self._page('Tanqeeb', '<div id="jobs_list">%s</div>' % ''.join(jobs), head=head))
+
+    def tanqeeb_ad(self, uid):
+        if _closed(uid, self.closedrate):
+            return(self._page('Tanqeeb', '<div class="alert alert-warning">This job has expired</div>'))
+        rng = _rng('tanqeeb', uid)
+        posted = datetime.datetime.now() - datetime.timedelta(days=rng.randint(0, self.days))
+        rows = ''.join(['<tr><th>%s</th><td>%s</td></tr>' % kv for kv in [
+            ('Posted date', '%d %s' % (posted.day, posted.strftime('%B %Y'))), ('Location', 'Amman'), ('Job Type', 'Full Time'),
+            ('Company', _text(rng, 2).title()), ('Required Experience', '2 - 5 Years'), ('Salary', 'Negotiable'),
+            ('Education', 'Bachelor Degree'), ('Publisher', '<img src="https://www.tanqeeb.com/img/thumb_bayt.png">')]])
+        body = '<h1>%s</h1><table class="table job-details-table">%s</table><div class="job-details"><p>%s</p></div>' % (
+            _text(rng, 4).title(), rows, _text(rng, 120))
+        return(self._page('Tanqeeb', body))
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Routes requests to the pages of the board, after the configured delay and
+    failing the configured share of requests.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _route(self, path, query):
+        board = self.server.board
+        base = 'http://%s/' % (self.headers.get('Host'))
+        parts = [p for p in path.split('/') if p != '']
+        site = parts[0] if len(parts) > 0 else ''
+        page = int(query.get('page', ['1'])[0])
+        if site == 'wuzzuf':
+            if parts[1:3] == ['search', 'jobs']:
+                return(board.wuzzuf_search(base + 'wuzzuf/', int(query.get('start', ['0'])[0])))
+            if parts[1:3] == ['jobs', 'p'] and len(parts) == 4:
+                return(board.wuzzuf_job(int(parts[3].split('-')[0])))
+        elif site == 'olx':
+            base += 'olx/en/'
+            if parts[2:] == ['sitemap', 'regions']:
+                return(board.olx_sitemap())
+            if len(parts) == 4 and parts[2] == 'jobs-services':
+                return(board.olx_region(base, parts[3]))
+            if len(parts) == 5 and parts[2] == 'jobs-services':
+                return(board.olx_listing(base, parts[3], parts[4], page))
+            if len(parts) == 4 and parts[2] == 'ad':
+                m = re.search(r'-ID(\d+)\.html$', parts[3])
+                if m is not None:
+                    return(board.olx_ad(int(m.group(1))))
+        elif site == 'tanqeeb':
+            base += 'tanqeeb/'
+            if parts[1:] == ['en']:
+                return(board.tanqeeb_main())
+            if len(parts) == 4 and parts[2] == 'category':
+                return(board.tanqeeb_category(parts[3]))
+            if len(parts) == 5 and parts[2:4] == ['jobs', 'view']:
+                return(board.tanqeeb_ad(int(parts[4].split('-')[0])))
+            if len(parts) == 4 and parts[2] == 'jobs':
+                return(board.tanqeeb_summary(base, parts[3], page))
+        return(None)
+
+    def _send(self, status, body, contenttype='text/html; charset=utf-8'):
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) > 0:
+            body = gzip.compress(body)
+            encoding = 'gzip'
+        else:
+            encoding = None
+        self.send_response(status)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parts.query)
+        if parts.path == '/_stats':
+            self._send(200, json.dumps(self.server.stats()).encode('utf-8'), 'application/json')
+            return
+        site = [p for p in parts.path.split('/') if p != ''][:1]
+        site = site[0] if len(site) > 0 else ''
+        time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.server.errorrate:
+            self.server.count(site, 'errors')
+            self._send(503, b'Service Unavailable')
+            return
+        html = self._route(parts.path, query)
+        if html is None:
+            self.server.count(site, 'missing')
+            self._send(404, b'Not Found')
+            return
+        body = html.encode('utf-8')
+        self.server.count(site, 'pages')
+        self.server.count(site, 'bytes', len(body))
+        self._send(200, body)
+
+
+class MockServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded server for the mock board that counts the pages it serves per site."""
+
+    daemon_threads = True
+
+    def __init__(self, address, board, latency=MockBoardConfig.LATENCY, errorrate=MockBoardConfig.ERRORRATE):
+        http.server.HTTPServer.__init__(self, address, Handler)
+        self.board = board
+        self.latency = latency
+        self.errorrate = errorrate
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def count(self, site, key, value=1):
+        with self.lock:
+            counts = self.counts.setdefault(site, {'pages': 0, 'errors': 0, 'missing': 0, 'bytes': 0})
+            counts[key] += value
+
+    def stats(self):
+        with self.lock:
+            return(json.loads(json.dumps(self.counts)))
+
+
+def serve(port, board, latency, errorrate, ready):
+    """Run the mock server until the process is terminated, ready receives the port."""
+
+    server = MockServer(('127.0.0.1', port), board, latency, errorrate)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def count_rows(dbpath):
+    """Number of rows in each table of a database."""
+
+    if not os.path.exists(dbpath):
+        return({})
+    conn = sqlite3.connect(dbpath)
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
+        return({table: conn.execute("SELECT COUNT(*) FROM %s;" % (table)).fetchone()[0] for table in tables})
+    finally:
+        conn.close()
+
+
+def get_stats(port):
+    with urllib.request.urlopen('http://127.0.0.1:%d/_stats' % (port)) as response:
+        return(json.loads(response.read().decode('utf-8')))
+
+
+def drive(sites, port, workdir, rate=MockBoardConfig.RATE):
+    """Run the downloader of each site against the mock board on port, with all data
+    kept in workdir.  Returns a list with pages served and rows written for each site.
+    """
+
+    # imported here so that the server process does not load the downloaders
+    import main_download
+    from fetchengine import FetchEngine, set_engine
+
+    FileConfig.datapath = workdir
+    FileConfig.EXTDIR = os.path.join(workdir, 'data', 'external')
+    for site in ['olx', 'wuzzuf', 'tanqeeb']:
+        if not os.path.exists(os.path.join(FileConfig.EXTDIR, site)):
+            os.makedirs(os.path.join(FileConfig.EXTDIR, site))
+    logdir = os.path.join(workdir, 'logs')
+    if not os.path.exists(logdir):
+        os.makedirs(logdir)
+    set_engine(FetchEngine(rate=rate, burst=max(FetchConfig.BURST, int(rate))))
+
+    results = []
+    for site in sites:
+        params = dict(main_download.COUNTRYPARAMS[site][0])
+        params['url'] = 'http://127.0.0.1:%d/%s/' % (port, site + '/en' if site == 'olx' else site)
+        dbpath = os.path.join(FileConfig.EXTDIR, site, main_download.DOWNLOADERS[site].dbname)
+        rowsbefore = sum(count_rows(dbpath).values())
+        statsbefore = get_stats(port).get(site, {})
+        jobname, status, runtime = main_download.run_job(site, params, logdir)
+        statsafter = get_stats(port).get(site, {})
+        rows = sum(count_rows(dbpath).values()) - rowsbefore
+        pages = statsafter.get('pages', 0) - statsbefore.get('pages', 0)
+        errors = statsafter.get('errors', 0) - statsbefore.get('errors', 0)
+        minutes = max(runtime, 1e-6) / 60.0
+        results.append({'site': site, 'status': status, 'seconds': runtime, 'pages': pages, 'errors': errors,
+                        'rows': rows, 'pagesperminute': pages / minutes, 'rowsperminute': rows / minutes})
+        print("%-8s status %d in %6.1f seconds: %5d pages (%d errors), %6d rows, %8.1f pages/minute, %8.1f rows/minute" % (
+            site, status, runtime, pages, errors, rows, pages / minutes, rows / minutes))
+    print("Logs of the runs are in %s" % (logdir))
+    return(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the downloaders against a local mock job board.")
+    parser.add_argument('--sites', nargs='+', default=['wuzzuf', 'olx', 'tanqeeb'], help="sites to crawl")
+    parser.add_argument('--latency', type=float, default=MockBoardConfig.LATENCY, help="mean seconds before each response")
+    parser.add_argument('--errors', type=float, default=MockBoardConfig.ERRORRATE, help="fraction of requests that fail with 503")
+    parser.add_argument('--closed', type=float, default=MockBoardConfig.CLOSEDRATE, help="fraction of ads that are closed")
+    parser.add_argument('--pages', type=int, default=MockBoardConfig.PAGES, help="listing pages per source")
+    parser.add_argument('--ads', type=int, default=MockBoardConfig.ADSPERPAGE, help="ads per listing page")
+    parser.add_argument('--rate', type=float, default=MockBoardConfig.RATE, help="requests per second allowed by the fetch engine")
+    parser.add_argument('--port', type=int, default=0, help="port of the server (default any free port)")
+    parser.add_argument('--workdir', help="directory for the databases and logs (default a new temporary directory)")
+    parser.add_argument('--serve', action='store_true', help="only run the server")
+    args = parser.parse_args(argv)
+
+    board = Board(pages=args.pages, adsperpage=args.ads, closedrate=args.closed)
+    if args.serve:
+        server = MockServer(('127.0.0.1', args.port), board, args.latency, args.errors)
+        print("Serving the mock job board on port %d" % (server.server_address[1]))
+        server.serve_forever()
+        return(0)
+
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(args.port, board, args.latency, args.errors, ready), daemon=True)
+    process.start()
+    try:
+        port = ready.get(timeout=30)
+        workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='mockboard')
+        print("Mock job board on port %d, data in %s" % (port, workdir))
+        results = drive(args.sites, port, workdir, args.rate)
+    finally:
+        process.terminate()
+        process.join()
+    return(1 if any([r['status'] != 0 for r in results]) else 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
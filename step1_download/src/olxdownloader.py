@@ -15,28 +15,71 @@ import time
 import random
 import sqlite3
 import urllib.request
-from bs4 import BeautifulSoup
 import pandas as pd
 import numpy as np
 import re
 import os
 from basedownloader import BaseDownloader
-from config import FileConfig
-from create_databases import get_olx_table_schema
+from htmlparse import make_soup, only
+from dbconnect import connect_db
+from config import FileConfig, FrontierConfig
+from create_databases import get_olx_table_schema, get_olx_table_indexes
+
+# subtrees of an ad page read by OLXDownloader.get_jobpage
+JOBPAGE = only(('span', 'pdingleft10 brlefte5'), ('div', 'clr offerheadinner pding15 pdingright20'),
+               ('div', 'clr', 'textContent'), ('div', 'clr descriptioncontent marginbott20'),
+               ('div', 'pdingtop10'), ('div', 'pricelabel tcenter'), ('div', 'user-box'),
+               ('div', 'contactbox innerbox br3 bgfff rel'), ('div', 'contactbox-indent rel brkword'))
 
 class OLXDownloader(BaseDownloader):
+
+    dbname = "OLX.db"
+    archivetables = ('jobadpagedata',)
+    # page views are tracked on each revisit
+    revisithistory = ('jobadpagedata', ['pageviews'])
+    hashregions = JOBPAGE
+    jobpagequery = '''INSERT OR IGNORE INTO jobadpagedata (downloaddate, downloadtime, country, uid, postdate, posttime, pageviews, title, experiencelevel, educationlevel, type, employtype, compensation, description, textlanguage, userhref, username, userjoinmt, userjoinyear, emailavail, phoneavail, stat)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
+    # jobadpagedata has no region, downloaded ads reach their region sector through jobadpageurls
+    changedregionsquery = """SELECT DISTINCT a.country, a.region, a.freg, a.subregion, a.fsubreg, 
+                    a.sector, a.urlregsector 
+                FROM regionjobadcounts a 
+                INNER JOIN regionjobadcounts b 
+                    ON a.region = b.region AND a.subregion = b.subregion AND a.sector = b.sector 
+                WHERE a.country = ? 
+                    AND ((DATE(a.downloaddate,'+5 DAYS') >= (SELECT DISTINCT MAX(DATE(downloaddate)) FROM regionjobadcounts) 
+                    AND (a.totalposts != b.totalposts) AND DATE(a.downloaddate,'-2 DAYS') == DATE(b.downloaddate)) OR 
+                (a.fsubreg NOT IN (SELECT DISTINCT u.fsubreg FROM jobadpagedata d
+                INNER JOIN jobadpageurls u ON d.country = u.country AND d.uid = u.uid
+                WHERE a.country = u.country AND u.country = ? AND a.region = u.region AND a.freg = u.freg AND a.subregion = u.subregion AND a.fsubreg = u.fsubreg AND a.downloaddate = d.downloaddate)))
+                ;"""
+    # reads run for every listing and every download, their plans are checked by create_databases.check_schemas
+    regionsectorquery = '''SELECT uid FROM jobadpageurls WHERE country = ? AND fsubreg = ? AND jobsector = ?;'''
+    remainingquery = '''SELECT COUNT(DISTINCT uid) FROM jobadpageurls WHERE country = ? AND fsubreg = ? AND jobsector = ?
+                AND postdate >= ? AND postdate < ?;'''
+    seedquery = '''SELECT uid, urllinkshort, MAX(postdate)
+                    FROM jobadpageurls 
+                    WHERE country = ? AND DATE(postdate) >= DATE(?,'-%d days') 
+                    AND uid NOT IN 
+                    (SELECT DISTINCT uid FROM jobadpagedata WHERE country = ? AND stat = 'CLOSED')
+                    GROUP BY uid;'''
     
-    def __init__(self, params):
+    def __init__(self, params, writer=None):
         #super(OLXDownloader, self).__init__(params)
         self.extdir = os.path.join(FileConfig.EXTDIR,'olx')
-        self.conn = sqlite3.connect(os.path.join(FileConfig.EXTDIR, 'olx', "OLX.db"), timeout=3)
+        self.conn = connect_db(os.path.join(self.extdir, self.dbname))
+        self.writer = writer
         self.cursor = self.conn.cursor()
+        self._set_params(params)
+        self._create_table_schema(get_olx_table_schema(), get_olx_table_indexes())
+        print("Start Time: {}".format(self.datecur))
+
+    def _set_params(self, params):
+        self.params = params
         self.country = params["country"]
         self.tz = timezone(params["timezone"])
         self.url = params["url"]
         self.datecur = datetime.datetime.now(self.tz).date()
-        self._create_table_schema(get_olx_table_schema())
-        print("Start Time: {}".format(self.datecur))
         
     def get_region_data(self, debug=False):
         """Gets aggregated counts of advertisements by different regions in given country."""
@@ -46,9 +89,10 @@ class OLXDownloader(BaseDownloader):
         downloadtime = datetimecur.strftime('%H:%M')
 
         url = self.url + 'sitemap/regions/'
-        req = urllib.request.Request(url)
-        response = urllib.request.urlopen(req)
-        soup = BeautifulSoup(response, 'html.parser')
+        response = self._request_until_succeed(url)
+        if response is None:
+            return
+        soup = make_soup(response)
 
         name_box = soup.find('div', attrs={'class': 'content text'})
         regions = name_box.find_all('div', attrs={'class':'bgef pding5_10 marginbott10 margintop20 clr'})
@@ -85,10 +129,10 @@ class OLXDownloader(BaseDownloader):
                 fsubregname = re.sub('[-](-)?(-)?','-',fsubregname)
                 row = [downloaddate, downloadtime, self.country, regionname[i], fregname[i], subregname, fsubregname,totalposts[i], subposts]
                 query = '''INSERT OR IGNORE INTO regionadcounts (downloaddate, downloadtime, country, region, freg, subregion, fsubreg, totalregposts, subposts) VALUES (?,?,?,?,?,?,?,?,?) ;'''
-                self.cursor.execute(query, row)
+                self._insert('regionadcounts', query, row)
     
         #commit entries to the database
-        self.conn.commit()
+        self._flush_rows()
         
     def get_region_jobdata(self, debug=True):
         """Loop through the key industries and regions to investigate the counts of postings
@@ -117,15 +161,11 @@ class OLXDownloader(BaseDownloader):
                 #print(subreghref[sector])
                 rowvalues = [downloaddate,downloadtime,self.country,region,freg,subregion,fsubreg,sector,subreghref[sector],numposts]
                 query = '''INSERT OR IGNORE INTO regionjobadcounts (downloaddate, downloadtime, country, region, freg, subregion, fsubreg, sector, urlregsector, totalposts) VALUES (?,?,?,?,?,?,?,?,?,?);'''
-                self.cursor.execute(query,rowvalues)
-         
+                self._insert('regionjobadcounts', query, rowvalues)
                 if i % 100 == 0:
                     print(i,rowvalues)
-                    self.conn.commit()
-            # sleep to make sure not too many requests are being made
-            time.sleep(random.randint(1,3))
         
-        self.conn.commit()
+        self._flush_rows()
          
     def get_job_urls(self, url):
         """Obtains all sector variables and associated reference links that will be input into our database"""
@@ -137,14 +177,14 @@ class OLXDownloader(BaseDownloader):
         # certain regions have no job postings
         if response is None:
             return([sector, href])        
-        soup = BeautifulSoup(response, 'html.parser')
+        soup = make_soup(response)
 
         #get counts of number of jobs in different areas
         name_box = soup.find_all('div', attrs={'class': 'wrapper'})
     
         for name in name_box:
             #print(name)
-            newnames = name.find_all('a', attrs={'class' : 'topLink tdnone '})
+            newnames = name.find_all('a', attrs={'class' : 'topLink tdnone'})
             if len(newnames) > 0:
                 for i, n in enumerate(newnames):
                     sect = n.find('span', attrs='link').get_text().strip()
@@ -162,10 +202,12 @@ class OLXDownloader(BaseDownloader):
         """
  
         urllist = []
+        # load the known ids before this run adds any
+        seen = self.seen
         response = self._request_until_succeed(url)
         if response is None:
             return(response)
-        soup = BeautifulSoup(response, 'html.parser')
+        soup = make_soup(response)
     
         #now find out the total number of pages available
         try:
@@ -186,10 +228,10 @@ class OLXDownloader(BaseDownloader):
             newurl = url
             if cnt > 1:
                 newurl = url + '?page='+str(cnt)
-            response = self._request_until_succeed(url)
+            response = self._request_until_succeed(newurl)
             if response is None:
                 return(None)
-            soup = BeautifulSoup(response, 'html.parser')
+            soup = make_soup(response)
         
             #get the current time
             datetimecur = datetime.datetime.now(self.tz)
@@ -197,6 +239,7 @@ class OLXDownloader(BaseDownloader):
     
             adlinks = soup.find_all('div',attrs={'class':'ads__item__info'})
             adphotos = soup.find_all('div',attrs={'class':"ads__item__photos-holder"})
+            uids = []
         
             #now loop through all of the relevant data and grab the ad information
             for i, val1 in enumerate(adphotos):
@@ -236,7 +279,7 @@ class OLXDownloader(BaseDownloader):
                             yr = datetimecur.year
                         else:
                             yr = datetimecur.year - 1
-                        postdate = str(yr)+'-'+str(mt)+'-'+str(day)
+                        postdate = '%d-%02d-%02d' % (yr, mt, int(day))
         
                     i_photo = 0
                     i_featured = 0
@@ -248,8 +291,10 @@ class OLXDownloader(BaseDownloader):
                     #print(rowvalues)
                     query = '''INSERT OR IGNORE INTO jobadpageurls (country, region, freg, subregion, fsubreg, jobsector, postdate, uid, i_photo, i_featured,
                     urllinkshort) VALUES(?, ?,?,?,?,?,?,?,?,?,?);'''
-                    self.cursor.execute(query,rowvalues)
-                    self.conn.commit()
+                    self._insert('jobadpageurls', query, rowvalues)
+                    uids.append(uid)
+            # write the whole listing page in one transaction
+            self._flush_rows()
     
             #now store the last date retrieved as the midaddate
             #print(yr,mt,day)
@@ -257,12 +302,19 @@ class OLXDownloader(BaseDownloader):
                 minaddate = datetime.date(int(yr),int(mt),int(day))
             except:
                 minaddate = datetimecur.date()
+            if seen.page(uids) and minaddate >= lastdownloaddate and cnt < int(totalpages):
+                # the pages after this one list ads that were collected before
+                remaining = self.conn.execute(self.remainingquery, [self.country, fsubreg, jobsector, lastdownloaddate.strftime('%Y-%m-%d'),
+                                                      minaddate.strftime('%Y-%m-%d')]).fetchone()[0]
+                seen.stop(remaining, len(uids), int(totalpages) - cnt)
+                break
             cnt+=1
-            time.sleep(random.randint(1,5))
-        self.conn.commit()
         
-    def get_jobpage(self, uid, postdate, url, translation=False):
-        """Get the data from each job page and insert into database"""
+    def get_jobpage(self, uid, postdate, url, translation=False, response=None, fetchtime=None):
+        """Get the data from each job page and insert into database.  The page is
+        requested unless an already fetched response is passed in, fetchtime is
+        the time it was fetched (default now).
+        """
     
         data = {}
         cols = ['downloaddate', 'downloadtime', 'country', 'uid', 'postdate', 'posttime', 'pageviews', 'title',
@@ -272,17 +324,18 @@ class OLXDownloader(BaseDownloader):
         fields = ['Experience Level','Employment Type','Education Level','Type','Compensation']
         
         ### note want to add in the actual time download if we are to use the page views as proxy    
-        datetimecur = datetime.datetime.now(self.tz)
+        datetimecur = fetchtime if fetchtime is not None else datetime.datetime.now(self.tz)
         data['country'] = self.country
         data['uid'] = uid
         data['postdate'] = postdate
         data['downloaddate'] = datetimecur.strftime('%Y-%m-%d')
         data['downloadtime'] = datetimecur.strftime('%H:%M')
         
-        response = self._request_until_succeed(url)
+        if response is None:
+            response = self._request_until_succeed(url)
         if response is not None:
             #get content for ad posting data and check if available as some are no longer available
-            soup = BeautifulSoup(response, 'html.parser')
+            soup = make_soup(response, JOBPAGE)
             addata = soup.find('span',attrs={'class':'pdingleft10 brlefte5'})
             
         data['stat'] = 'NOT FOUND' if response is None else 'CLOSED' if addata is None else 'OPEN' 
@@ -375,26 +428,14 @@ class OLXDownloader(BaseDownloader):
         """Select only region sectors where total posts have changed at least once over the last 5 days"""
         
         c = self.cursor
-        query = """SELECT DISTINCT a.country, a.region, a.freg, a.subregion, a.fsubreg, 
-                    a.sector, a.urlregsector 
-                FROM regionjobadcounts a 
-                INNER JOIN regionjobadcounts b 
-                    ON a.region = b.region AND a.subregion = b.subregion AND a.sector = b.sector 
-                WHERE a.country = '%s' 
-                    AND ((DATE(a.downloaddate,'+5 DAYS') >= (SELECT DISTINCT MAX(DATE(downloaddate)) FROM regionjobadcounts) 
-                    AND (a.totalposts != b.totalposts) AND DATE(a.downloaddate,'-2 DAYS') == DATE(b.downloaddate)) OR 
-                (a.fsubreg NOT IN (SELECT DISTINCT fsubreg FROM jobadpagedata
-                WHERE a.country = country AND country = '%s' AND a.region = region AND a.freg = freg AND a.subregion = subregion AND a.fsubreg = fsubreg AND a.downloaddate = downloaddate)))
-                ;""" % (self.country, self.country)
-        regsector = c.execute(query).fetchall()
+        regsector = c.execute(self.changedregionsquery, [self.country, self.country]).fetchall()
         print("Region-sectors to grab: {}".format(len(regsector)))
         cols = ['country','region','freg','subregion','fsubreg','sector','urlregsector']
         for i, reg in enumerate(regsector[datast:]):
             if debug and i > 2:
                 break
             d = {col: reg[n] for n, col in enumerate(cols)}
-            query = '''SELECT uid FROM jobadpageurls WHERE country='{}' AND fsubreg = '{}' AND jobsector = '{}';'''
-            ids = c.execute(query.format(self.country, d['fsubreg'],d['sector'])).fetchall()
+            ids = c.execute(self.regionsectorquery, [self.country, d['fsubreg'], d['sector']]).fetchall()
             query = '''SELECT MAX(DATE(downloaddate)) FROM jobadpagedata WHERE country='{}' AND uid IN (SELECT uid FROM jobadpageurls WHERE country='{}' AND fsubreg = '{}' AND jobsector = '{}');'''
             lastdate = c.execute(query.format(self.country, self.country, d['fsubreg'],d['sector'])).fetchall()[0][0]
             query = '''SELECT COUNT(*) FROM jobadpageurls WHERE country='{}' AND fsubreg == '{}' AND jobsector == '{}';'''
@@ -410,44 +451,61 @@ class OLXDownloader(BaseDownloader):
                 dateval = datetime.date(int(temp[0]),int(temp[1]),int(temp[2]))
             #if there is data in the database lets only insert data posted after the last date downloaded
             self.get_jobpage_urls(d['region'],d['freg'],d['subregion'],d['fsubreg'],d['sector'],d['urlregsector'],dateval)
+            self._sync()
             query = '''SELECT COUNT(*) FROM jobadpageurls WHERE country='{}' AND fsubreg == '{}' AND jobsector == '{}';'''
             newnumentries = c.execute(query.format(self.country, d['fsubreg'],d['sector'])).fetchall()[0][0]
             if i % 1000 == 0:
                 print("Last Download Date for sub-region {} and sector {}: {}".format(d['fsubreg'],d['sector'],lastdate))
                 print("Number new pages entered into jobadpageurls for subregion {} and sector {}: {}".format(d['fsubreg'],d['sector'],newnumentries-oldnumentries))
-        self.conn.commit()
   
     def get_new_page_data(self, debug=False):
         """Only get new data where it is the most recent and status is open.  Ads in
-        OLX are live for 3 months so if we rotate through for at least 15 weeks this should cover
-        everything.
+        OLX are live for 3 months so ads are kept in the crawl frontier for 93 days after posting
+        and due ads are pulled from it in batches.  Ads that are closed are no longer revisited.
         """
         
-        jobpageurllist = []
-        for i in range(0,15):
-            d = i*7
-            query = '''SELECT DISTINCT uid, postdate, urllinkshort, country
-                        FROM jobadpageurls 
-                        WHERE country = '%s' AND DATE(postdate) = DATE('%s','-%d days') 
-                        AND uid NOT IN 
-                        (SELECT DISTINCT uid 
-                        FROM jobadpagedata WHERE country='%s' 
-                        AND (stat = 'CLOSED' OR DATE(postdate) <= DATE('%s','-93 days')));''' % (self.country, self.datecur.strftime('%Y-%m-%d'), d, self.country, self.datecur)
-            temp = self.cursor.execute(query).fetchall()
-            jobpageurllist = jobpageurllist + temp
-        print("Number of pages to query: {}".format(len(jobpageurllist)))
-        #print(jobpageurllist[0:10])
+        now = datetime.datetime.now(self.tz)
+        query = self.seedquery % (self.maxrevisitdays)
+        numurls = self.frontier.seed(now, query, [self.country, self.datecur.strftime('%Y-%m-%d'), self.country])
+        print("Number of urls checked for the frontier: {}".format(numurls))
         
-        for i, urlinfo in enumerate(jobpageurllist):
-            if debug and i > 2:
+        query = self.jobpagequery
+        numpages = 0
+        while True:
+            jobpageurllist = self.frontier.due(now, limit=3 if debug else FrontierConfig.BATCHSIZE)
+            if len(jobpageurllist) == 0:
                 break
-            print(urlinfo)
-            query = '''INSERT OR IGNORE INTO jobadpagedata (downloaddate, downloadtime, country, uid, postdate, posttime, pageviews, title, experiencelevel, educationlevel, type, employtype, compensation, description, textlanguage, userhref, username, userjoinmt, userjoinyear, emailavail, phoneavail, stat)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
-            url = self.url + 'ad/'+urlinfo[2]
-            rowvalues = self.get_jobpage(urlinfo[0], urlinfo[1], url, translation=False)
-            self.cursor.execute(query, rowvalues)
-            self.conn.commit() 
+            numpages += len(jobpageurllist)
+            print("Number of pages to query: {}".format(len(jobpageurllist)))
+            # pages are fetched, parsed and written in separate stages
+            items = [(self.url + 'ad/'+urlinfo[1], urlinfo[0], urlinfo[2]) for urlinfo in jobpageurllist]
+            closed = []
+            deferred = []
+            for (url, uid, postdate), response, rows in self._pipeline_pages(items):
+                print(url)
+                if rows is None and self.engine.is_deferred(url):
+                    deferred.append(uid)
+                    continue
+                if rows is None:
+                    # the page is gone, it is not requested again
+                    rows = [('jobadpagedata', query, self.get_jobpage(uid, postdate, url, translation=False))]
+                for table, rowquery, rowvalues in rows:
+                    self._insert(table, rowquery, rowvalues)
+                    if table == 'jobadpagedata' and rowvalues[-1] in ['CLOSED', 'NOT FOUND']:
+                        closed.append(uid)
+            self.frontier.retire(closed)
+            self._defer_pages(deferred, now)
+            if debug:
+                break
+        print("Number of pages queried: {}".format(numpages))
+        self.frontier.report(now)
+        self.frontier.report_savings()
+
+    def _parse_page(self, url, response, fetchtime, uid, postdate):
+        """Parse a stored job page."""
+
+        rowvalues = self.get_jobpage(uid, postdate, url, translation=False, response=response, fetchtime=fetchtime)
+        return([('jobadpagedata', self.jobpagequery, rowvalues)])
 
     def run_all(self, debug=False):
         """Run key operations to update database."""
@@ -463,10 +521,15 @@ class OLXDownloader(BaseDownloader):
             self.get_region_jobdata(debug=debug)
             print("Run time for get_region_jobdata: {}".format(time.time()-starttime))
         regsector = self.check_changes_region(debug=debug)
+        self._sync()
+        self.seen.report()
         self.get_new_page_data(debug=debug)
+        self._sync()
         print("Run time for get_new_page_data: {}".format(time.time()-starttime))
         self._display_db_tables()
         self._archive_database('jobadpagedata', 'jobadpageurls',maxdays=90)
+        self.engine.report()
+        self.close()
         print("Total run time: {}".format(time.time()-starttime))
  
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+"""
+Purpose:  This module contains a paginator that pages through many listings
+at once.  Each listing (e.g. a job category) has a cursor with the url of its
+next page.  Pages are fetched for many listings together and the cursors are
+moved forward after each round.  Cursors are checkpointed in the
+listingcursors table, so a crawl that stops part way resumes each listing
+from its last page instead of starting every listing again from page 1.
+The date a crawl pages back to is kept with its cursors, so a resumed crawl
+stops where the interrupted one would have.
+"""
+
+import datetime
+from config import ListingConfig
+
+
+TIMEFORMAT = '%Y-%m-%d %H:%M:%S'
+DATEFORMAT = '%Y-%m-%d'
+
+
+class Paginator(object):
+    """Page through the listings of one country.  Reads go through conn while
+    writes are sent with execute, followed by sync before the next read.
+    """
+
+    def __init__(self, conn, execute, sync, country, width=ListingConfig.WIDTH, maxage=ListingConfig.CURSORAGE):
+        self.conn = conn
+        self.execute = execute
+        self.sync = sync
+        self.country = country
+        # listings whose next page is fetched together in a round
+        self.width = width
+        # hours after which an unfinished crawl is started again instead of resumed
+        self.maxage = maxage
+        self.counts = {'listings': 0, 'resumed': 0, 'pages': 0, 'rounds': 0, 'failed': 0}
+        # date the crawl pages back to, set by start
+        self.stopdate = None
+
+    def start(self, listings, now, stopdate=None):
+        """Return {listing: url of the next page} to crawl for listings, a dict of
+        {listing: url of its first page}.  An unfinished crawl that started less
+        than maxage hours ago is resumed: listings that finished in it are skipped,
+        and listings it has no cursor for, such as new categories, join it at their
+        first page.  Otherwise every listing starts at its first page.  stopdate is
+        the date a new crawl pages back to, a resumed crawl keeps the one it was
+        started with.  Either is left in self.stopdate.
+        """
+
+        self.sync()
+        query = """SELECT listing, nexturl, started, finished, stopdate FROM listingcursors WHERE country = ?;"""
+        rows = self.conn.execute(query, [self.country]).fetchall()
+        cutoff = (now - datetime.timedelta(hours=self.maxage)).strftime(TIMEFORMAT)
+        # cursors of the crawl in progress, older cursors are left from a crawl that is started again
+        current = dict([(listing, (nexturl, started, finished, saved)) for listing, nexturl, started, finished, saved in rows
+                        if started >= cutoff and listing in listings])
+        if any([finished == 0 for nexturl, started, finished, saved in current.values()]):
+            started = min([started for nexturl, started, finished, saved in current.values()])
+            saved = [saved for nexturl, started, finished, saved in current.values() if saved is not None]
+            if len(saved) > 0:
+                stopdate = datetime.datetime.strptime(min(saved), DATEFORMAT).date()
+            new = [(listing, url) for listing, url in listings.items() if listing not in current]
+            query = """INSERT OR REPLACE INTO listingcursors (country, listing, nexturl, pages, started, updated, finished, stopdate)
+                VALUES (?,?,?,0,?,?,0,?);"""
+            self.execute(query, [[self.country, listing, url, started, now.strftime(TIMEFORMAT), self._format(stopdate)]
+                                 for listing, url in new])
+            self.sync()
+            cursors = dict([(listing, current[listing][0] if listing in current else url) for listing, url in listings.items()
+                            if listing not in current or current[listing][2] == 0])
+            resumed = len(cursors) - len(new)
+            print("Resuming %d of %d listings from their last page back to %s, %d listings start at their first page" % (
+                resumed, len(listings), stopdate, len(new)))
+            self.counts['resumed'] += resumed
+            self.stopdate = stopdate
+            return(cursors)
+        self.execute("""DELETE FROM listingcursors WHERE country = ?;""", [[self.country]])
+        query = """INSERT INTO listingcursors (country, listing, nexturl, pages, started, updated, finished, stopdate)
+            VALUES (?,?,?,0,?,?,0,?);"""
+        self.execute(query, [[self.country, listing, url, now.strftime(TIMEFORMAT), now.strftime(TIMEFORMAT), self._format(stopdate)]
+                             for listing, url in listings.items()])
+        self.sync()
+        self.stopdate = stopdate
+        return(dict(listings))
+
+    def _format(self, date):
+        return(None if date is None else date.strftime(DATEFORMAT))
+
+    def checkpoint(self, moves):
+        """Save the cursors moved in a round, moves is a list of (listing, url of the next page or None)."""
+
+        updated = datetime.datetime.now().strftime(TIMEFORMAT)
+        query = """UPDATE listingcursors SET nexturl = ?, pages = pages + 1, updated = ?, finished = ?
+            WHERE country = ? AND listing = ?;"""
+        self.execute(query, [[url, updated, 1 if url is None else 0, self.country, listing] for listing, url in moves])
+
+    def run(self, listings, fetch, parse, now=None, stopdate=None):
+        """Start or resume a crawl of listings, a dict of {listing: url of its first page},
+        and crawl it, see start and crawl.
+        """
+
+        now = now if now is not None else datetime.datetime.now()
+        self.crawl(self.start(listings, now, stopdate), fetch, parse)
+
+    def crawl(self, cursors, fetch, parse):
+        """Crawl cursors returned by start.  fetch(urls) returns the bodies of a list of
+        urls (None if not retrieved) and parse(listing, url, body) handles a page and
+        returns the url of the next page to crawl, or None to stop.  A listing whose
+        page could not be fetched keeps its cursor for the next run.
+        """
+
+        self.counts['listings'] += len(cursors)
+        active = list(cursors.items())
+        while len(active) > 0:
+            batch, active = active[:self.width], active[self.width:]
+            moves = []
+            for (listing, url), body in zip(batch, fetch([url for listing, url in batch])):
+                if body is None:
+                    print("Could not get %s, listing is resumed from this page" % (url))
+                    self.counts['failed'] += 1
+                    continue
+                nexturl = parse(listing, url, body)
+                self.counts['pages'] += 1
+                moves.append((listing, nexturl))
+                if nexturl is not None:
+                    active.append((listing, nexturl))
+            self.checkpoint(moves)
+            self.counts['rounds'] += 1
+        self.sync()
+
+    def report(self):
+        """Print listings crawled, pages fetched and listings left to resume."""
+
+        counts = self.counts
+        print("Paged %d listings for %s (%d resumed): %d pages in %d rounds, %d listings stopped on a failed page" % (
+            counts['listings'], self.country, counts['resumed'], counts['pages'], counts['rounds'], counts['failed']))
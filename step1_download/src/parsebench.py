@@ -0,0 +1,351 @@
+"""
+Purpose:  This module contains an offline benchmark of the page extractors.
+Each extractor is run on recorded pages listed in the fixture manifest, with
+requests answered from the fixture and writes collected instead of sent to a
+database.  For each extractor it reports pages/sec, latency percentiles,
+peak memory and a digest of the rows extracted.  Results are saved under the
+commit they were run at, so a later run can be compared against them.
+
+Layout of the benchmark directory:
+    benchmarks/fixtures/manifest.json
+    benchmarks/fixtures/digests.json
+    benchmarks/fixtures/<site>/<page>.html
+    benchmarks/results/<commit>.json
+
+digests.json holds the digest of the rows each extractor is expected to
+extract from its fixtures, checked by tests/test_parsebench.py.  Rewrite it
+with --digests after recording a fixture or changing what an extractor returns.
+
+To run, compare with an earlier commit or record a new fixture:
+    python src/parsebench.py
+    python src/parsebench.py --compare benchmarks/results/<commit>.json
+    python src/parsebench.py --record tanqeeb_jobad_page <url or file> --args '{"uid": "1", "href": "/en/jobs/view/1"}'
+    python src/parsebench.py --digests
+"""
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import htmlparse
+from config import BenchmarkConfig, FileConfig
+from seenids import SeenIds
+
+
+# params the parsers are created with, the values do not change what is extracted
+PARAMS = {
+    'olx': {"country": "jordan", "url": "https://olx.jo/en/", "timezone": "Asia/Amman"},
+    'tanqeeb': {"country": "jordan", "webname": "jordan", "timezone": "Asia/Amman"},
+    'wuzzuf': {"country": "egypt"},
+}
+
+# time the fixture pages are taken to be fetched at
+FETCHTIME = datetime.datetime(2018, 10, 15, 12, 0)
+
+
+class Replay(object):
+    """Answers requests of a parser with a recorded page and collects the rows it writes."""
+
+    def __init__(self, parser):
+        self.rows = []
+        self.body = None
+        parser._request_until_succeed = lambda url: self.body
+        parser._insert = lambda table, query, row: self.rows.append(row)
+        parser._execute = lambda query, rows=((),): self.rows.extend(rows)
+        parser._flush_rows = lambda: None
+        parser._sync = lambda: None
+        # listings are always paged by date, there are no known ids
+        parser._seen = SeenIds(getattr(parser, 'country', None), fraction=None)
+
+    def run(self, call, body):
+        self.rows = []
+        self.body = body
+        result = call()
+        return(self.rows if result is None else result)
+
+
+def _olx(args):
+    from olxdownloader import OLXDownloader
+    return(OLXDownloader.parser(PARAMS['olx']))
+
+
+def _wuzzuf(args):
+    from wuzzufdownloader import WuzzufDownloader
+    return(WuzzufDownloader.parser(PARAMS['wuzzuf']))
+
+
+def _tanqeeb(args):
+    from tanqeebdownloader import TanQeebDownloader
+    parser = TanQeebDownloader.parser(PARAMS['tanqeeb'])
+    # never follow the next summary page
+    parser.lastdownloaddate = datetime.date.max
+    return(parser)
+
+
+def _tanqeebcv(args):
+    from tanqeebcvdownloader import TanQeebCVDownloader
+    return(TanQeebCVDownloader.parser(PARAMS['tanqeeb']))
+
+
+# extractor name: (create parser, call the extractor with (parser, body, args), keys or columns of rows that depend on the day of the run)
+EXTRACTORS = {
+    'wuzzuf_job_page': (_wuzzuf, lambda p, body, a: p.get_job_page(a['uid'], a['url'], a['postdate'], response=body, fetchtime=FETCHTIME), []),
+    'olx_jobpage': (_olx, lambda p, body, a: p.get_jobpage(a['uid'], a['postdate'], a['url'], response=body, fetchtime=FETCHTIME), []),
+    'olx_jobpage_urls': (_olx, lambda p, body, a: p.get_jobpage_urls(a['region'], a['freg'], a['subregion'], a['fsubreg'],
+                                                                      a['jobsector'], a['url'], datetime.date.today()), [6]),
+    'tanqeeb_page_urls': (_tanqeeb, lambda p, body, a: p.get_page_urls(a['url'], a['classvar']), []),
+    'tanqeeb_jobad_summary_page': (_tanqeeb, lambda p, body, a: p.get_jobad_summary_page(a['cat'], a['subcat'], a['href']), []),
+    'tanqeeb_jobad_page': (_tanqeeb, lambda p, body, a: p.get_jobad_page(a['uid'], a['href'], response=body), []),
+    'tanqeebcv_resume_page': (_tanqeebcv, lambda p, body, a: p.parse_resume_page(htmlparse.make_soup(body), a['uid']),
+                              ['downloaddate', 'last_active']),
+}
+
+
+def load_fixtures(fixturedir=BenchmarkConfig.FIXTUREDIR):
+    """Return {extractor: [(file, body, args)]} from the fixture manifest."""
+
+    with open(os.path.join(fixturedir, 'manifest.json'), 'r') as f:
+        manifest = json.load(f)
+    fixtures = {}
+    for entry in manifest:
+        with open(os.path.join(fixturedir, entry['file']), 'rb') as f:
+            body = f.read()
+        fixtures.setdefault(entry['extractor'], []).append((entry['file'], body, entry['args']))
+    return(fixtures)
+
+
+def load_digests(fixturedir=BenchmarkConfig.FIXTUREDIR):
+    """Return {extractor: digest} of the rows expected from the fixtures."""
+
+    with open(os.path.join(fixturedir, 'digests.json'), 'r') as f:
+        return(json.load(f))
+
+
+def save_digests(results, fixturedir=BenchmarkConfig.FIXTUREDIR):
+    """Record the row digests of a run as the ones expected from the fixtures."""
+
+    digests = dict([(name, r['rows']) for name, r in results['extractors'].items()])
+    path = os.path.join(fixturedir, 'digests.json')
+    with open(path, 'w') as f:
+        json.dump(digests, f, indent=1, sort_keys=True)
+    print("Saved digests to %s" % (path))
+    return(path)
+
+
+def percentile(values, q):
+    return(float(np.percentile(values, q)) if len(values) > 0 else 0.0)
+
+
+def _stable(row, volatile):
+    if isinstance(row, dict):
+        return(sorted([(k, v) for k, v in row.items() if k not in volatile]))
+    if isinstance(row, list) and len(row) > 0 and isinstance(row[0], list):
+        return([_stable(r, volatile) for r in row])
+    if isinstance(row, list):
+        return([v for i, v in enumerate(row) if i not in volatile])
+    return(row)
+
+
+def digest(results, volatile):
+    """Hash of the rows extracted from all pages, leaving out values that depend on the day of the run."""
+
+    rows = [repr(_stable(result, volatile)) for result in results]
+    return(hashlib.sha1('\n'.join(rows).encode('utf-8')).hexdigest()[:12])
+
+
+def run_extractor(name, pages, repeat=BenchmarkConfig.REPEAT):
+    """Time one extractor over its fixture pages.  Every page is parsed repeat times
+    for the latencies and once more under tracemalloc for the peak memory.
+    """
+
+    create, call, volatile = EXTRACTORS[name]
+    parser = create(pages[0][2])
+    replay = Replay(parser)
+    latencies = []
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(repeat):
+            for file, body, args in pages:
+                starttime = time.perf_counter()
+                result = replay.run(lambda: call(parser, body, args), body)
+                latencies.append(time.perf_counter() - starttime)
+                if i == 0:
+                    results.append(result)
+        peak = 0
+        for file, body, args in pages:
+            tracemalloc.start()
+            replay.run(lambda: call(parser, body, args), body)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return({
+        'pages': len(pages),
+        'bytes': sum([len(body) for file, body, args in pages]),
+        'pagespersec': len(latencies) / max(sum(latencies), 1e-9),
+        'p50': 1000 * percentile(latencies, 50),
+        'p90': 1000 * percentile(latencies, 90),
+        'p99': 1000 * percentile(latencies, 99),
+        'peakkb': peak / 1024.0,
+        'rows': digest(results, volatile),
+    })
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)))
+        return(commit.decode('utf-8').strip())
+    except (OSError, subprocess.CalledProcessError):
+        return('unknown')
+
+
+def run(names=None, repeat=BenchmarkConfig.REPEAT, fixturedir=BenchmarkConfig.FIXTUREDIR):
+    """Run the benchmark for the named extractors (default all) and return the results.
+    Extractors whose downloader cannot be imported are skipped.
+    """
+
+    fixtures = load_fixtures(fixturedir)
+    names = names if names is not None else sorted(fixtures.keys())
+    results = {'commit': git_commit(), 'created': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+               'python': platform.python_version(), 'backend': htmlparse.get_backend(), 'repeat': repeat, 'extractors': {}}
+    # the resume parser saves each page it parses, keep those out of the data directory
+    extdir = FileConfig.EXTDIR
+    tempdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(tempdir, 'tanqeeb', 'resumes'))
+    FileConfig.EXTDIR = tempdir
+    try:
+        for name in names:
+            if name not in EXTRACTORS or name not in fixtures:
+                print("No extractor or fixtures for %s" % (name))
+                continue
+            try:
+                results['extractors'][name] = run_extractor(name, fixtures[name], repeat)
+            except ImportError as e:
+                print("Skipping %s: %s" % (name, e))
+    finally:
+        FileConfig.EXTDIR = extdir
+        shutil.rmtree(tempdir, ignore_errors=True)
+    print_results(results)
+    return(results)
+
+
+def print_results(results):
+    print("Commit %s, python %s, %s backend" % (results['commit'], results['python'], results['backend']))
+    print("%-28s %5s %10s %8s %8s %8s %9s  %s" % ('extractor', 'pages', 'pages/sec', 'p50 ms', 'p90 ms', 'p99 ms', 'peak KB', 'rows'))
+    for name, r in sorted(results['extractors'].items()):
+        print("%-28s %5d %10.1f %8.2f %8.2f %8.2f %9.0f  %s" % (
+            name, r['pages'], r['pagespersec'], r['p50'], r['p90'], r['p99'], r['peakkb'], r['rows']))
+
+
+def save(results, resultdir=BenchmarkConfig.RESULTDIR):
+    if not os.path.exists(resultdir):
+        os.makedirs(resultdir)
+    path = os.path.join(resultdir, '%s.json' % (results['commit']))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print("Saved results to %s" % (path))
+    return(path)
+
+
+def compare(base, results, threshold=BenchmarkConfig.THRESHOLD):
+    """Compare results with a base run.  An extractor regresses if its pages/sec drops
+    or its p90 latency or peak memory grows by more than threshold, or if it extracts
+    different rows.  Returns the list of regressions.
+    """
+
+    regressions = []
+    print("Compared with commit %s:" % (base['commit']))
+    for name, r in sorted(results['extractors'].items()):
+        b = base['extractors'].get(name)
+        if b is None:
+            continue
+        speed = r['pagespersec'] / max(b['pagespersec'], 1e-9) - 1
+        latency = r['p90'] / max(b['p90'], 1e-9) - 1
+        memory = r['peakkb'] / max(b['peakkb'], 1e-9) - 1
+        problems = []
+        if speed < -threshold:
+            problems.append('slower')
+        if latency > threshold:
+            problems.append('p90 up')
+        if memory > threshold:
+            problems.append('more memory')
+        if r['rows'] != b['rows']:
+            problems.append('rows changed')
+        print("%-28s pages/sec %+6.1f%%  p90 %+6.1f%%  peak %+6.1f%%  %s" % (
+            name, 100 * speed, 100 * latency, 100 * memory, ', '.join(problems) if len(problems) > 0 else 'ok'))
+        if len(problems) > 0:
+            regressions.append((name, problems))
+    return(regressions)
+
+
+def record(extractor, source, args, fixturedir=BenchmarkConfig.FIXTUREDIR):
+    """Add a page to the fixtures of an extractor.  source is a url, which is fetched
+    once, or the path of a saved page.  args are the arguments the extractor is called with.
+    """
+
+    if extractor not in EXTRACTORS:
+        raise ValueError("Unknown extractor %s" % (extractor))
+    if os.path.exists(source):
+        with open(source, 'rb') as f:
+            body = f.read()
+    else:
+        from httpsession import get_session
+        status, body = get_session().get(source)
+        if status != 200:
+            raise ValueError("Request for %s returned status %d" % (source, status))
+    site = extractor.split('_')[0].replace('tanqeebcv', 'tanqeeb')
+    file = '%s/%s-%s.html' % (site, extractor, hashlib.sha1(body).hexdigest()[:8])
+    if not os.path.exists(os.path.join(fixturedir, site)):
+        os.makedirs(os.path.join(fixturedir, site))
+    with open(os.path.join(fixturedir, file), 'wb') as f:
+        f.write(body)
+    manifestpath = os.path.join(fixturedir, 'manifest.json')
+    with open(manifestpath, 'r') as f:
+        manifest = json.load(f)
+    manifest.append({'extractor': extractor, 'file': file, 'args': args})
+    with open(manifestpath, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    print("Recorded %s for %s" % (file, extractor))
+    return(file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the page extractors on recorded pages.")
+    parser.add_argument('--only', nargs='+', help="extractors to run (default all)")
+    parser.add_argument('--repeat', type=int, default=BenchmarkConfig.REPEAT, help="times each page is parsed")
+    parser.add_argument('--backend', help="tree builder to parse with (default ParserConfig.BACKEND)")
+    parser.add_argument('--compare', help="results file of an earlier run to compare against")
+    parser.add_argument('--nosave', action='store_true', help="do not save the results")
+    parser.add_argument('--record', nargs=2, metavar=('EXTRACTOR', 'SOURCE'), help="add a url or saved page to the fixtures")
+    parser.add_argument('--args', default='{}', help="json arguments of the extractor for --record")
+    parser.add_argument('--digests', action='store_true', help="record the digests of this run as the expected rows")
+    args = parser.parse_args(argv)
+
+    if args.record is not None:
+        record(args.record[0], args.record[1], json.loads(args.args))
+        return(0)
+    if args.backend is not None:
+        htmlparse.set_backend(args.backend)
+    results = run(args.only, args.repeat)
+    if not args.nosave:
+        save(results)
+    if args.digests:
+        save_digests(results)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)
+        if len(compare(base, results)) > 0:
+            return(1)
+    return(0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
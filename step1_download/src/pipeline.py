@@ -0,0 +1,305 @@
+"""
+Purpose:  This module contains a staged pipeline for downloading job ad pages.
+Fetching (network), parsing (BeautifulSoup) and writing (sqlite) run as
+separate stages connected by bounded queues:
+
+    fetch thread --> fetch queue --> parse dispatcher --> parse pool (processes)
+                 --> pending queue --> collector thread --> write queue --> caller
+
+The caller consumes parsed pages in its own thread and is the only writer.
+A full queue blocks the stage in front of it, so a slow stage holds back the
+ones before it instead of letting pages pile up in memory.  Items handled,
+busy time and queue depths are kept for each stage to show the bottleneck.
+Every wait on a queue also checks a stop event, set when a stage fails or the
+caller stops reading, so no stage is left blocked on a queue nobody serves.
+
+A download job starts one parse pool with get_parse_pool and hands it to each
+pipeline it runs.  A job that runs in a worker of main_download's job pool
+may not be able to start processes of its own, it then parses in the
+pipeline's dispatcher thread instead.
+"""
+
+import concurrent.futures
+import datetime
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from config import PipelineConfig
+
+
+_DONE = object()
+# seconds between checks of the stop event while waiting on a queue
+_POLL = 0.1
+
+
+def _parse_batch(cls, params, batch):
+    """Parse a batch of fetched pages in a worker process.  Returns a list with
+    the (table, query, row) to write for each page and the seconds spent parsing.
+    """
+
+    starttime = time.time()
+    parser = cls.parser(params)
+    results = []
+    for url, body, fetchtime, uid, postdate, previous in batch:
+        try:
+            results.append(parser._parse_visit(url, body, fetchtime, uid, postdate, previous))
+        except Exception:
+            print("Error parsing %s" % (url))
+            traceback.print_exc()
+            results.append([])
+    return(results, time.time()-starttime)
+
+
+class InlineExecutor(object):
+    """Stand-in for a process pool that runs each task in the thread that submits it."""
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return(future)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def get_parse_pool(parsers=PipelineConfig.PARSERS):
+    """Return a new pool of parsers processes to share between the pipelines of a job,
+    or an InlineExecutor in a daemon process, such as a worker of a process pool on
+    python before 3.9, which is not allowed to start processes of its own.
+    """
+
+    if multiprocessing.current_process().daemon:
+        return(InlineExecutor())
+    return(concurrent.futures.ProcessPoolExecutor(max_workers=parsers))
+
+
+class StageStats(object):
+    """Items handled, time spent working and queue depth seen by one stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.depths = []
+        self.lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def sample(self, depth):
+        with self.lock:
+            self.depths.append(depth)
+
+    def summary(self, elapsed):
+        with self.lock:
+            depth = sum(self.depths) / float(len(self.depths)) if len(self.depths) > 0 else 0.0
+            maxdepth = max(self.depths) if len(self.depths) > 0 else 0
+            return({'stage': self.name, 'items': self.items, 'busy': self.busy,
+                    'rate': self.items / max(elapsed, 1e-6), 'depth': depth, 'maxdepth': maxdepth})
+
+
+class Pipeline(object):
+    """Fetch, parse and hand back pages for a list of (url, uid, postdate).
+    Pages are parsed with cls.parser(params)._parse_visit on executor, the parse
+    pool of the job, given the content hash of the previous visit of the ad in
+    hashes.  Without an executor each run starts a pool of its own.
+    """
+
+    def __init__(self, engine, cls, params, tz=None, hashes=None, executor=None, parsers=PipelineConfig.PARSERS,
+                 queuesize=PipelineConfig.QUEUESIZE, batchsize=PipelineConfig.BATCHSIZE,
+                 chunksize=PipelineConfig.CHUNKSIZE):
+        self.engine = engine
+        self.executor = executor
+        self.cls = cls
+        self.params = params
+        self.tz = tz
+        self.hashes = hashes if hashes is not None else {}
+        self.parsers = parsers
+        self.queuesize = queuesize
+        self.batchsize = batchsize
+        self.chunksize = chunksize
+        self.stats = {name: StageStats(name) for name in ['fetch', 'parse', 'write']}
+        self.error = None
+        self.stop = threading.Event()
+
+    def _fail(self, e):
+        """Keep the first error of a stage and stop all the others."""
+
+        if self.error is None:
+            self.error = e
+        traceback.print_exc()
+        self.stop.set()
+
+    def _put(self, q, msg):
+        """Put msg on q once there is room.  Returns False without putting it if the pipeline was stopped."""
+
+        while not self.stop.is_set():
+            try:
+                q.put(msg, timeout=_POLL)
+                return(True)
+            except queue.Full:
+                pass
+        return(False)
+
+    def _get(self, q):
+        """Get the next message from q, or _DONE once the pipeline was stopped."""
+
+        while not self.stop.is_set():
+            try:
+                return(q.get(timeout=_POLL))
+            except queue.Empty:
+                pass
+        return(_DONE)
+
+    def _fetch(self, items, fetchq):
+        """Fetch stage: request pages chunk by chunk and queue (item, body, fetchtime)."""
+
+        try:
+            for i in range(0, len(items), self.chunksize):
+                if self.stop.is_set():
+                    break
+                chunk = items[i:i+self.chunksize]
+                starttime = time.time()
+                bodies = self.engine.fetch_many([url for url, uid, postdate in chunk])
+                fetchtime = datetime.datetime.now(self.tz)
+                self.stats['fetch'].add(len(chunk), time.time()-starttime)
+                for item, body in zip(chunk, bodies):
+                    if not self._put(fetchq, (item, body, fetchtime)):
+                        return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(fetchq, _DONE)
+
+    def _dispatch(self, fetchq, pendingq, executor):
+        """Parse stage: group fetched pages into batches and submit them to the pool.
+        Pages that could not be fetched skip the pool.
+        """
+
+        batch = []
+
+        def submit(batch):
+            pages = [(url, body, fetchtime, uid, postdate, self.hashes.get(str(uid)))
+                     for (url, uid, postdate), body, fetchtime in batch]
+            future = executor.submit(_parse_batch, self.cls, self.params, pages)
+            if not self._put(pendingq, (batch, future)):
+                future.cancel()
+
+        try:
+            while True:
+                msg = self._get(fetchq)
+                self.stats['parse'].sample(fetchq.qsize())
+                if msg is _DONE:
+                    break
+                item, body, fetchtime = msg
+                if body is None:
+                    self._put(pendingq, ([msg], None))
+                    continue
+                batch.append(msg)
+                if len(batch) >= self.batchsize:
+                    submit(batch)
+                    batch = []
+            if len(batch) > 0 and not self.stop.is_set():
+                submit(batch)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(pendingq, _DONE)
+
+    def _collect(self, pendingq, writeq):
+        """Wait for parsed batches in the order they were submitted and queue the pages for writing."""
+
+        try:
+            while True:
+                msg = self._get(pendingq)
+                if msg is _DONE:
+                    break
+                batch, future = msg
+                if future is None:
+                    results = [None] * len(batch)
+                else:
+                    results, seconds = future.result()
+                    self.stats['parse'].add(len(batch), seconds)
+                for (item, body, fetchtime), rows in zip(batch, results):
+                    if not self._put(writeq, (item, body, fetchtime, rows)):
+                        return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(writeq, _DONE)
+
+    def _cancel(self, pendingq):
+        """Cancel the parse batches left in pendingq after the pipeline was stopped."""
+
+        while True:
+            try:
+                msg = pendingq.get_nowait()
+            except queue.Empty:
+                return
+            if msg is not _DONE and msg[1] is not None:
+                msg[1].cancel()
+
+    def run(self, items):
+        """Yield (item, body, fetchtime, rows) for each (url, uid, postdate) in items, where
+        rows is the list of (table, query, row) parsed from the page, or None if the page
+        could not be fetched.  Time the caller spends between items is counted as write time.
+        If a stage fails the pipeline stops and its error is raised.  If the caller stops
+        reading early the stages are stopped and parse batches not yet started are cancelled.
+        """
+
+        items = list(items)
+        self.starttime = time.time()
+        self.error = None
+        self.stop = threading.Event()
+        fetchq = queue.Queue(maxsize=self.queuesize)
+        # each pending entry is a batch, so keep just enough to keep every parser busy
+        pendingq = queue.Queue(maxsize=max(1, 2 * self.parsers))
+        writeq = queue.Queue(maxsize=self.queuesize)
+        executor = self.executor if self.executor is not None else get_parse_pool(self.parsers)
+        try:
+            threads = [
+                threading.Thread(target=self._fetch, args=(items, fetchq), daemon=True),
+                threading.Thread(target=self._dispatch, args=(fetchq, pendingq, executor), daemon=True),
+                threading.Thread(target=self._collect, args=(pendingq, writeq), daemon=True),
+            ]
+            for thread in threads:
+                thread.start()
+            try:
+                while True:
+                    msg = self._get(writeq)
+                    self.stats['write'].sample(writeq.qsize())
+                    if msg is _DONE:
+                        break
+                    starttime = time.time()
+                    yield msg
+                    self.stats['write'].add(1, time.time()-starttime)
+            finally:
+                # all stages have finished unless one failed or the caller stopped reading
+                self.stop.set()
+                for thread in threads:
+                    thread.join()
+                self._cancel(pendingq)
+        finally:
+            if self.executor is None:
+                executor.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        """Print throughput and depth of the input queue of each stage.  The queue in
+        front of the bottleneck stays full while the queues after it stay empty.  Parse
+        busy time is summed over the worker processes.
+        """
+
+        elapsed = time.time() - self.starttime
+        for name in ['fetch', 'parse', 'write']:
+            s = self.stats[name].summary(elapsed)
+            print("Stage %s: %d pages, %.1f pages/sec, %.0f seconds busy, input queue depth %.1f (max %d)" % (
+                s['stage'], s['items'], s['rate'], s['busy'], s['depth'], s['maxdepth']))
@@ -0,0 +1,43 @@
+"""
+Purpose:  This module contains an exclusive lock on a file shared between
+processes, used where jobs running in separate processes update the same
+file, such as the archive manifest, or migrate the same database.
+"""
+
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock(object):
+    """Exclusive lock on a file held by one process at a time while the with block runs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+            return(self)
+        self.f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                return(self)
+            except OSError:
+                # LK_LOCK gives up after 10 seconds, keep waiting for the other process
+                time.sleep(1)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        self.f.close()
+        self.f = None
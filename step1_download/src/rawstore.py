@@ -0,0 +1,162 @@
+"""
+Purpose:  This module contains a content-addressed store for the raw pages
+fetched by the downloaders.  Bodies are compressed and appended to segment
+files, and each distinct body is stored only once under its sha1 hash.  An
+index database records every fetch by url and fetch time together with the
+ad it belongs to, so pages can be parsed again later without the network.
+
+Layout of a store directory:
+    <storedir>/index.db
+    <storedir>/segments/seg-<YYYYmmddHHMMSS>-<pid>-<n>.z
+"""
+
+import datetime
+import hashlib
+import os
+import zlib
+from config import RawStoreConfig
+from dbconnect import connect_db, close_db
+
+
+TIMEFORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def read_body(storedir, segment, offset, length):
+    """Read and decompress one body from a segment file.  This does not need the
+    index so it can be used from worker processes.
+    """
+
+    with open(os.path.join(storedir, 'segments', segment), 'rb') as f:
+        f.seek(offset)
+        return(zlib.decompress(f.read(length)))
+
+
+class RawStore(object):
+    """Append-only store of fetched page bodies.  Each process writes to its own
+    segment files and every write to the index is committed straight away, so
+    several downloaders can share a store directory without holding its write lock.
+    """
+
+    def __init__(self, storedir, segmentsize=RawStoreConfig.SEGMENTSIZE, level=RawStoreConfig.LEVEL):
+        self.storedir = storedir
+        self.segmentsize = segmentsize
+        self.level = level
+        if not os.path.exists(os.path.join(storedir, 'segments')):
+            os.makedirs(os.path.join(storedir, 'segments'))
+        self.conn = connect_db(os.path.join(storedir, 'index.db'))
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS blobs (
+            hash VARCHAR(40),
+            segment VARCHAR(50),
+            offset INTEGER,
+            length INTEGER,
+            size INTEGER,
+            PRIMARY KEY(hash));""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS fetches (
+            url VARCHAR(200),
+            fetchtime VARCHAR(19),
+            hash VARCHAR(40),
+            country VARCHAR(20),
+            uid VARCHAR(50),
+            postdate DATE,
+            PRIMARY KEY(url, fetchtime));""")
+        self.conn.execute("""CREATE INDEX IF NOT EXISTS idx_fetches_country_fetchtime ON fetches (country, fetchtime);""")
+        self.conn.commit()
+        self.segment = None
+        self.file = None
+        self.numsegments = 0
+        self.counts = {'bodies': 0, 'duplicates': 0, 'bytes': 0, 'stored': 0}
+
+    def _open_segment(self):
+        if self.file is not None:
+            self.file.close()
+        self.numsegments += 1
+        self.segment = 'seg-%s-%d-%d.z' % (datetime.datetime.now().strftime('%Y%m%d%H%M%S'), os.getpid(), self.numsegments)
+        self.file = open(os.path.join(self.storedir, 'segments', self.segment), 'ab')
+
+    def put(self, url, body, fetchtime, country=None, uid=None, postdate=None):
+        """Store a fetched body, record the fetch and commit.  Returns the hash of the body."""
+
+        digest = self._put(url, body, fetchtime, country, uid, postdate)
+        self.conn.commit()
+        return(digest)
+
+    def put_many(self, fetches):
+        """Store a list of (url, body, fetchtime, country, uid, postdate) in one commit.
+        Returns the hashes of the bodies.
+        """
+
+        digests = [self._put(*fetch) for fetch in fetches]
+        self.conn.commit()
+        return(digests)
+
+    def _put(self, url, body, fetchtime, country, uid, postdate):
+
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()
+        self.counts['bodies'] += 1
+        self.counts['bytes'] += len(body)
+        if self.conn.execute("SELECT 1 FROM blobs WHERE hash = ?;", [digest]).fetchone() is not None:
+            self.counts['duplicates'] += 1
+        else:
+            if self.file is None or self.file.tell() >= self.segmentsize:
+                self._open_segment()
+            data = zlib.compress(body, self.level)
+            offset = self.file.tell()
+            self.file.write(data)
+            # the body has to be on disk before the index points at it
+            self.file.flush()
+            self.conn.execute("INSERT OR IGNORE INTO blobs (hash, segment, offset, length, size) VALUES (?,?,?,?,?);",
+                              [digest, self.segment, offset, len(data), len(body)])
+            self.counts['stored'] += len(data)
+        self.conn.execute("INSERT OR REPLACE INTO fetches (url, fetchtime, hash, country, uid, postdate) VALUES (?,?,?,?,?,?);",
+                          [url, fetchtime.strftime(TIMEFORMAT), digest, country, None if uid is None else str(uid), postdate])
+        return(digest)
+
+    def get(self, digest):
+        """Return the body stored under a hash, None if it is not in the store."""
+
+        row = self.conn.execute("SELECT segment, offset, length FROM blobs WHERE hash = ?;", [digest]).fetchone()
+        if row is None:
+            return(None)
+        return(read_body(self.storedir, *row))
+
+    def entries(self, country=None, since=None):
+        """List fetches as (url, fetchtime, uid, postdate, segment, offset, length) in fetch order."""
+
+        self.conn.commit()
+        query = """SELECT f.url, f.fetchtime, f.uid, f.postdate, b.segment, b.offset, b.length
+            FROM fetches f INNER JOIN blobs b ON f.hash = b.hash WHERE 1 = 1"""
+        params = []
+        if country is not None:
+            query += " AND f.country = ?"
+            params.append(country)
+        if since is not None:
+            query += " AND f.fetchtime >= ?"
+            params.append(since)
+        query += " ORDER BY f.fetchtime;"
+        return(self.conn.execute(query, params).fetchall())
+
+    def last_before(self, country, before):
+        """List the last fetch of each ad of a country before a fetch time, as in entries."""
+
+        self.conn.commit()
+        query = """SELECT f.url, f.fetchtime, f.uid, f.postdate, b.segment, b.offset, b.length
+            FROM fetches f INNER JOIN blobs b ON f.hash = b.hash
+            WHERE f.country = ? AND f.uid IS NOT NULL AND f.fetchtime = (SELECT MAX(g.fetchtime) FROM fetches g
+                WHERE g.country = f.country AND g.uid = f.uid AND g.fetchtime < ?);"""
+        return(self.conn.execute(query, [country, before]).fetchall())
+
+    def report(self):
+        """Print the number of bodies stored and the space saved by compression and deduplication."""
+
+        counts = self.counts
+        print("Raw store: %d bodies (%d duplicates), %d bytes stored for %d bytes fetched" % (
+            counts['bodies'], counts['duplicates'], counts['stored'], counts['bytes']))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.conn.commit()
+        close_db(self.conn)
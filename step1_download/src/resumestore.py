@@ -0,0 +1,172 @@
+"""
+Purpose:  This module contains the stores that hold the resumes downloaded by
+TanQeebCVDownloader.  Resumes are nested documents, so they were kept in
+MongoDB.  SqliteResumeStore keeps the same documents as JSON in a sqlite
+database queried with the JSON1 functions, so the CV pipeline can also run
+and be benchmarked without a Mongo server.  Both stores read the id and
+download date of every resume in one projected query and write resumes in
+bulk upserts.
+"""
+
+import base64
+import datetime
+import json
+import os
+from config import FileConfig, ResumeConfig
+from dbconnect import connect_db, get_db, close_db
+
+
+TIMEFORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class MongoResumeStore(object):
+    """Resumes in the resumes collection of a MongoDB database."""
+
+    def __init__(self, host=ResumeConfig.MONGOHOST, port=ResumeConfig.MONGOPORT, dbname='tanqeeb', collection='resumes'):
+        from pymongo import MongoClient
+        self.client = MongoClient(host, port)
+        self.db = self.client[dbname]
+        self.collection = self.db[collection]
+
+    def dates(self):
+        """Return {id: download date} of every resume, None for resumes that failed to store."""
+
+        return(dict([(doc['_id'], doc.get('downloaddate')) for doc in self.collection.find({}, {'_id': 1, 'downloaddate': 1})]))
+
+    def upsert(self, docs):
+        """Insert or replace docs by _id in one bulk write.  Returns a list of
+        (doc, error) for the docs that could not be stored.
+        """
+
+        from pymongo import ReplaceOne
+        from pymongo.errors import BulkWriteError
+        if len(docs) == 0:
+            return([])
+        try:
+            self.collection.bulk_write([ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            return([(docs[error['index']], error['errmsg']) for error in e.details['writeErrors']])
+        except Exception:
+            # a document that cannot be encoded fails the whole batch before anything is sent
+            failed = []
+            for doc in docs:
+                try:
+                    self.collection.replace_one({'_id': doc['_id']}, doc, upsert=True)
+                except Exception as e:
+                    failed.append((doc, str(e)))
+            return(failed)
+        return([])
+
+    def get(self, uid):
+        """Return the resume with id uid, None if it is not stored."""
+
+        return(self.collection.find_one({'_id': uid}))
+
+    def find(self, errors=False):
+        """Iterate over the stored resumes, only those that failed to store if errors is True."""
+
+        return(self.collection.find({'error': {'$exists': errors}}))
+
+    def delete_errors(self):
+        """Delete the resumes that failed to store so they are downloaded again.  Returns the number deleted."""
+
+        return(self.collection.delete_many({'error': {'$exists': True}}).deleted_count)
+
+    def close(self):
+        self.client.close()
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return({'$date': value.strftime(TIMEFORMAT)})
+    if isinstance(value, bytes):
+        return({'$bytes': base64.b64encode(value).decode('ascii')})
+    raise TypeError("Cannot store %s in a resume" % (type(value).__name__))
+
+
+def _decode(obj):
+    if len(obj) == 1 and '$date' in obj:
+        return(datetime.datetime.strptime(obj['$date'], TIMEFORMAT))
+    if len(obj) == 1 and '$bytes' in obj:
+        return(base64.b64decode(obj['$bytes']))
+    return(obj)
+
+
+class SqliteResumeStore(object):
+    """Resumes as JSON documents in a sqlite database.  Dates and byte strings are
+    kept as {"$date": ...} and {"$bytes": ...} so documents come back as they went in.
+    """
+
+    def __init__(self, dbpath=None):
+        self.dbpath = dbpath if dbpath is not None else os.path.join(FileConfig.EXTDIR, 'tanqeeb', 'resumes.db')
+        # hold the connection until close, other uses look it up in their own thread
+        connect_db(self.dbpath)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS resumes (
+            id INTEGER,
+            downloaddate VARCHAR(26),
+            doc TEXT,
+            PRIMARY KEY(id));""")
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        return(get_db(self.dbpath))
+
+    def dates(self):
+        """Return {id: download date} of every resume, None for resumes that failed to store."""
+
+        rows = self.conn.execute("""SELECT id, downloaddate FROM resumes;""").fetchall()
+        return(dict([(uid, None if date is None else datetime.datetime.strptime(date, TIMEFORMAT)) for uid, date in rows]))
+
+    def upsert(self, docs):
+        """Insert or replace docs by _id in one transaction.  Returns a list of
+        (doc, error) for the docs that could not be stored.
+        """
+
+        rows, failed = [], []
+        for doc in docs:
+            try:
+                date = doc.get('downloaddate')
+                rows.append([doc['_id'], None if date is None else date.strftime(TIMEFORMAT),
+                             json.dumps(doc, default=_encode, ensure_ascii=False)])
+            except (TypeError, ValueError) as e:
+                failed.append((doc, str(e)))
+        self.conn.executemany("""INSERT OR REPLACE INTO resumes (id, downloaddate, doc) VALUES (?,?,json(?));""", rows)
+        self.conn.commit()
+        return(failed)
+
+    def get(self, uid):
+        """Return the resume with id uid, None if it is not stored."""
+
+        row = self.conn.execute("""SELECT doc FROM resumes WHERE id = ?;""", [uid]).fetchone()
+        return(None if row is None else json.loads(row[0], object_hook=_decode))
+
+    def find(self, errors=False):
+        """Iterate over the stored resumes, only those that failed to store if errors is True."""
+
+        query = """SELECT doc FROM resumes WHERE json_extract(doc, '$.error') IS %s NULL;""" % ('NOT' if errors else '')
+        for row in self.conn.execute(query):
+            yield(json.loads(row[0], object_hook=_decode))
+
+    def delete_errors(self):
+        """Delete the resumes that failed to store so they are downloaded again.  Returns the number deleted."""
+
+        deleted = self.conn.execute("""DELETE FROM resumes WHERE json_extract(doc, '$.error') IS NOT NULL;""").rowcount
+        self.conn.commit()
+        return(deleted)
+
+    def close(self):
+        conn = self.conn
+        conn.commit()
+        close_db(conn)
+
+
+STORES = {'mongo': MongoResumeStore, 'sqlite': SqliteResumeStore}
+
+
+def get_resume_store(name=ResumeConfig.STORE):
+    """Return a new resume store by name, one of STORES."""
+
+    if name not in STORES:
+        raise ValueError("Unknown resume store %s, expected one of %s" % (name, ', '.join(sorted(STORES))))
+    return(STORES[name]())
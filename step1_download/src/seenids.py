@@ -0,0 +1,73 @@
+"""
+Purpose:  This module contains the set of ad ids already known for a country,
+used to stop paging through listings early.  Listings show the newest ads
+first, so once most of the ads on a listing page are already known the pages
+after it only hold ads that were collected before.  The ids are loaded once
+per country when the first listing is crawled and new ids are added as they
+are found.
+"""
+
+import math
+from config import ListingConfig
+
+
+class SeenIds(object):
+    """Ids of the ads of one country that are already in the database.  Also
+    counts the listing pages requested and the ones skipped by stopping early.
+    """
+
+    def __init__(self, country, ids=(), fraction=ListingConfig.SEENFRACTION):
+        self.country = country
+        self.fraction = fraction
+        self.ids = set([str(uid) for uid in ids])
+        self.counts = {'pages': 0, 'stops': 0, 'saved': 0}
+
+    @classmethod
+    def load(cls, conn, table, column, country, fraction=ListingConfig.SEENFRACTION):
+        """Load the distinct ids in column of table for a country."""
+
+        query = """SELECT DISTINCT %s FROM %s WHERE country = ?;""" % (column, table)
+        seen = cls(country, [row[0] for row in conn.execute(query, [country])], fraction=fraction)
+        print("Loaded %d known ids of %s for %s" % (len(seen), table, country))
+        return(seen)
+
+    def __contains__(self, uid):
+        return(str(uid) in self.ids)
+
+    def __len__(self):
+        return(len(self.ids))
+
+    def page(self, uids):
+        """Record the ids found on a listing page and add them to the set.  Returns
+        True if at least self.fraction of them were already known, i.e. paging can stop.
+        Paging never stops early if self.fraction is None.
+        """
+
+        uids = [str(uid) for uid in uids]
+        self.counts['pages'] += 1
+        if len(uids) == 0 or self.fraction is None:
+            self.ids.update(uids)
+            return(False)
+        known = len([uid for uid in uids if uid in self.ids])
+        self.ids.update(uids)
+        return(known >= self.fraction * len(uids))
+
+    def stop(self, remaining, pagesize, maxpages=None):
+        """Record that paging stopped early.  remaining is the number of known ads the
+        pages after this one would have listed before the date rule stopped paging,
+        so about remaining/pagesize listing requests are saved.
+        """
+
+        saved = int(math.ceil(remaining / float(max(pagesize, 1))))
+        if maxpages is not None:
+            saved = min(saved, maxpages)
+        self.counts['stops'] += 1
+        self.counts['saved'] += saved
+        return(saved)
+
+    def report(self):
+        """Print the listing pages requested and the requests saved by stopping early."""
+
+        counts = self.counts
+        print("Listing pages requested for %s: %d, stopped early %d times on known ads, about %d listing requests saved" % (
+            self.country, counts['pages'], counts['stops'], counts['saved']))
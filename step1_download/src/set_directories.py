@@ -11,6 +11,7 @@ def check_data_directory():
     dirtype['data/interim'] = ['olx','tanqeeb','wuzzuf']
     dirtype['data/processed'] = ['finaldb']
     dirtype['figures'] = ['olx','tanqeeb','wuzzuf']
+    dirtype['logs'] = []
     
     for dir, dirlist in dirtype.items():
         dirpath = FileConfig.datapath
@@ -9,6 +9,7 @@ and should be updated.  Download new resume page.
 Check if the resume page exists in the database, if it does not then
 Start Mongodatabase before running.  In two command prompt windows enter the following:
 mongod, mongo
+or set ResumeConfig.STORE = 'sqlite' to keep resumes in a sqlite database instead.
 
 Author:  Natalie Chun
 Created: 3 March 2019
@@ -21,54 +22,56 @@ import random
 import sqlite3
 import csv
 import urllib.request
-from bs4 import BeautifulSoup
 import pandas as pd
 import numpy as np
 import re
 import os
-from googletrans import Translator
 import html2text
 from basedownloader import BaseDownloader
-from config import FileConfig
+from translation import get_translator
+from resumestore import get_resume_store
+from htmlparse import make_soup
+from dbconnect import connect_db
+from config import FileConfig, TranslationConfig, ResumeConfig
 from create_databases import get_tanqeebcv_table_schema
-from pymongo import MongoClient
-from bson.objectid import ObjectId
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 
 
 class TanQeebCVDownloader(BaseDownloader):
     """Class for downloading tanqeeb CVs.  Probably need to use selenium"""
+
+    dbname = "tanqeebcv.db"
     
     def __init__(self, params, loginparams, driver=None):
         #super(TanQeebDownloader, self).__init__()
         self.outdir = os.path.join(FileConfig.EXTDIR,'tanqeeb')
-        self.conn = sqlite3.connect(os.path.join(self.outdir,"tanqeebcv.db"), timeout=10)
+        self.conn = connect_db(os.path.join(self.outdir,self.dbname))
         self.cursor = self.conn.cursor()
         self._create_table_schema(get_tanqeebcv_table_schema())
+        self._set_params(params)
+        print("Start Time: {}".format(self.datecur))
+        
+        # resumes are nested documents, kept in MongoDB or in the sqlite stand-in (ResumeConfig.STORE)
+        self.store = get_resume_store()
+        
+        self.loginparams = loginparams
+        
+        # declare the driver
+        self.driver = driver if driver is not None else self.login()
+
+    def _set_params(self, params):
+        self.params = params
         self.country = params["country"]
         self.tz = timezone(params["timezone"])
         self.url = 'https://%s.tanqeeb.com/' % (params['webname'])
         self.datecur = datetime.datetime.now(self.tz)
-        print("Start Time: {}".format(self.datecur))
-        
-        # set terms for mongodb as better for storing resume type data
-        client = MongoClient('localhost', 27017)
-        db = client['tanqeeb']
-        resumes = db['resumes']
-        self.client = client
-        self.db = db
-        
         self.datemap = ['NULL', 'Jan','Feb','Mar','Apr','May',
                     'Jun','Jul','Aug','Sep',
                    'Oct','Nov','Dec']
         self.datefullmap = ['NULL', 'January','February','March','April','May',
                     'June','July','August','September',
                    'October','November','December']
-        self.loginparams = loginparams
-        
-        # declare the driver
-        self.driver = driver if driver is not None else self.login()
          
     def login(self):
         """Login to Indeed (if necessary)"""
@@ -245,7 +248,7 @@ class TanQeebCVDownloader(BaseDownloader):
         # sleep before trying to extract the page links...need some time lapse to download
         time.sleep(random.randint(3,6))
         try:
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
+            soup = make_soup(driver.page_source)
         except:
             return([])
         
@@ -266,7 +269,7 @@ class TanQeebCVDownloader(BaseDownloader):
             print(url)
             driver.get(url)
             try:
-                soup = BeautifulSoup(driver.page_source, 'html.parser')
+                soup = make_soup(driver.page_source)
             except:
                 return([])
             cards = soup.find_all('div', {'class':"job-box panel-content clearfix"})
@@ -313,57 +316,106 @@ class TanQeebCVDownloader(BaseDownloader):
     def clear_mongodb(self):
         """Clear database of fields that have errors to re-check and ensure scraper was working."""
         
-        resumes = self.db.resumes
-        temp = list(resumes.find({"error":{"$exists": True}},{'_id':1}))
-        print(len(temp))
-        print(temp[0:5])
-        for t in temp:
-            db.resumes.delete_one(t)
-        temp = list(resumes.find({"error":{"$exists": True}},{'_id':1}))
+        print("Deleted %d resumes with errors" % (self.store.delete_errors()))
+        temp = list(self.store.find(errors=True))
         assert len(temp) == 0, "Error deletion did not work"
             
-    def translate_text(self, textstr):
-        """Translate text string only if arabic characters in string"""
+    def _resume_text(self, textstr):
+        """Return a resume field as text, html fields are stored as bytes."""
         
         if type(textstr) == bytes:
             textstr = self.h.handle(textstr.decode('utf-8'))
-        if re.match(r'[\u0627-\u064a]', textstr, re.UNICODE) is not None:
-            try:
-                textstr = self.trans.translate(textstr, dest='en').text
-                time.sleep(random.randint(1,5))
-            except:
-                print("Error: %s" % (textstr))
-                textstr = 'Error'
         return(textstr)
             
+    def translate_texts(self, texts):
+        """Translate the texts that are in arabic in one call to the translation service,
+        other texts are returned as they are and texts that failed as None.
+        """
+        
+        texts = [self._resume_text(textstr) for textstr in texts]
+        arabic = [i for i, textstr in enumerate(texts) if re.match(r'[\u0627-\u064a]', textstr, re.UNICODE) is not None]
+        for i, translation in zip(arabic, self.trans.translate([texts[i] for i in arabic])):
+            texts[i] = translation
+        return(texts)
+            
+    def translate_text(self, textstr):
+        """Translate text string only if arabic characters in string"""
+        
+        textstr = self.translate_texts([textstr])[0]
+        return('Error' if textstr is None else textstr)
+            
     def insert_translation(self, entry):
         """Insert translation into database."""
         
+        self.insert_translations([entry])
+        
+    def insert_translations(self, entries):
+        """Insert translations into database in one transaction."""
+        
         query = """INSERT OR IGNORE INTO translation (id, downloaddate, column1, column2, listnum, translation_en) VALUES (?,?,?,?,?,?);"""
         cols = ['id','downloaddate','column1','column2','listnum','translation_en']
-        entryval = [entry[col] if col in entry else np.nan for col in cols]
-        #print(entryval)
-        self.cursor.execute(query,entryval)
+        self.cursor.executemany(query, [[entry[col] if col in entry else np.nan for col in cols] for entry in entries])
         self.conn.commit()
             
+    def _resume_fields(self, obs):
+        """List the fields of a resume to translate as (column1, column2, listnum, text),
+        or None if the resume has none of the sections that are translated.
+        """
+        
+        if not any([section in obs for section in ['education', 'skills', 'languages', 'projects', 'experiences', 'summary']]):
+            return(None)
+        fields = []
+        for j, e in enumerate(obs.get('education', [])):
+            if 'degree' in e:
+                fields.append(('education', 'degree', j, e['degree']))
+            if 'description' in e:
+                fields.append(('education', 'description', j, e['description']))
+        for j, l in enumerate(obs.get('skills', [])):
+            fields.append(('languages', 'type', j, l))
+        for j, l in enumerate(obs.get('languages', [])):
+            fields.append(('languages', 'type', j, l['type']))
+        for j, p in enumerate(obs.get('projects', [])):
+            if 'description' in p:
+                fields.append(('projects', 'description', j, p['description']))
+        for j, e in enumerate(obs.get('experiences', [])):
+            if 'jobtitle' in e:
+                fields.append(('experiences', 'jobtitle', j, e['jobtitle']))
+            if 'description' in e:
+                fields.append(('experiences', 'description', j, e['description']))
+        if 'summary' in obs:
+            fields.append(('summary', 'summary', 0, obs['summary']))
+        return(fields)
+            
+    def _translate_resumes(self, resumes):
+        """Translate the fields of a list of (resume, fields) together and insert them.
+        A resume with a field that could not be translated is left for the next run.
+        """
+        
+        translations = iter(self.translate_texts([text for obs, fields in resumes for column1, column2, listnum, text in fields]))
+        entries = []
+        for obs, fields in resumes:
+            resume = [{'id':obs['_id'], 'downloaddate':obs['downloaddate'], 'column1':column1, 'column2':column2,
+                       'listnum':listnum, 'translation_en':next(translations)} for column1, column2, listnum, text in fields]
+            if any([entry['translation_en'] is None for entry in resume]):
+                print("Error: %s" % (obs['_id']))
+                continue
+            entries.extend(resume)
+            print("Entry %d complete" % (obs['_id']))
+        self.insert_translations(entries)
+            
     def translate_resume(self):
-        """Translate resume info from arabic to english"""
+        """Translate resume info from arabic to english.  The fields of many resumes are
+        handed to the shared translation service at once, text it has translated before is not sent again.
+        """
         
         print("Starting to Translate")
-        self.trans = Translator()
+        self.trans = get_translator()
+        self.trans.start_run()
         h = html2text.HTML2Text()
         h.ignore_links = True
         self.h = h
-        db = self.db
-        # pull out resumes that have not been translated
-        resumes = self.db['resumes']
-        results = self.db.resumes.find({"error":{"$exists": False}})
-        df = pd.DataFrame(list(results))
-        print(df.head())
-        re1 = re.compile('(\d+)\-(\d+)\-(\d+)')
-        df['Birth Date'] = [row['Birth Date'] if re1.match(str(row['Birth Date'])) is not None else np.nan for i, row in df.iterrows()]
-        df['Birth Date'] = pd.to_datetime(df['Birth Date'], errors='ignore')
-        df['Marital Status'] = [np.nan if row['Marital Status'] == '-' else row['Marital Status'] for i, row in df.iterrows()]
+        # pull out resumes that have not been translated, resumes that failed to store have no download date
+        df = pd.DataFrame([(uid, date) for uid, date in self.store.dates().items() if date is not None], columns=['_id','downloaddate'])
 
         # create temporary table for checking
         df[['_id','downloaddate']].to_sql('temporary', self.conn, if_exists='replace')
@@ -372,102 +424,68 @@ class TanQeebCVDownloader(BaseDownloader):
         query = """SELECT DISTINCT _id, downloaddate FROM temporary t WHERE NOT EXISTS (SELECT * FROM translation WHERE t._id = id AND t.downloaddate = downloaddate) AND NOT EXISTS (SELECT * FROM no_translation WHERE t._id = id AND t.downloaddate = downloaddate);"""
         ids = pd.read_sql(query, self.conn)
         print(len(ids))
-        insert = False
+        pending, numtexts = [], 0
         for i, row in ids.iterrows():
-            obs = self.db.resumes.find_one({"_id": row['_id']})
-            entry = {'id':obs['_id'], 'downloaddate':obs['downloaddate']}
-            if 'education' in obs:
-                insert = True
-                for j, e in enumerate(obs['education']):
-                    if 'degree' in e:
-                        entry.update({'column1':'education', 'column2':'degree', 'listnum':j})
-                        entry['translation_en'] = self.translate_text(e['degree'])
-                        self.insert_translation(entry)
-                    if 'description' in e:
-                        entry.update({'column1':'education', 'column2':'description', 'listnum':j})
-                        entry['translation_en'] = self.translate_text(e['description'])
-                        self.insert_translation(entry)
-            if 'skills' in obs:
-                insert = True
-                for j, l in enumerate(obs['skills']):
-                    entry.update({'column1':'languages', 'column2':'type', 'listnum':j})
-                    entry['translation_en'] = self.translate_text(l)
-                    self.insert_translation(entry)
-            if 'languages' in obs:
-                insert = True
-                for j, l in enumerate(obs['languages']):
-                    entry.update({'column1':'languages', 'column2':'type', 'listnum':j})
-                    entry['translation_en'] = self.translate_text(l['type'])
-                    self.insert_translation(entry)
-            if 'projects' in obs:
-                insert = True
-                for j, p in enumerate(obs['projects']):
-                    if 'description' in p:
-                        entry.update({'column1':'projects', 'column2':'description','listnum':j})   
-                        entry['translation_en'] = self.translate_text(p['description'])
-                        self.insert_translation(entry)
-            if 'experiences' in obs:
-                insert = True
-                for j, e in enumerate(obs['experiences']):
-                    if 'jobtitle' in e:
-                        entry.update({'column1':'experiences', 'column2':'jobtitle','listnum':j})
-                        entry['translation_en'] = self.translate_text(e['jobtitle'])
-                        self.insert_translation(entry)
-                    if 'description' in e:
-                        entry.update({'column1':'experiences', 'column2':'description','listnum':j})
-                        entry['translation_en'] = self.translate_text(e['description'])
-                        self.insert_translation(entry)
-            if 'summary' in obs:
-                insert = True
-                entry.update({'column1':'summary', 'column2':'summary','listnum':0})    
-                entry['translation_en'] = self.translate_text(obs['summary'])
-                self.insert_translation(entry)
-            if insert == False:
+            obs = self.store.get(row['_id'])
+            fields = self._resume_fields(obs)
+            if fields is None:
                 query1 = """INSERT OR IGNORE INTO no_translation (id, downloaddate) VALUES (?,?);"""
                 self.cursor.execute(query1, [row['_id'],row['downloaddate']])
-            print("Entry %d complete" % (row['_id']))
+                continue
+            pending.append((obs, fields))
+            numtexts += len(fields)
+            if numtexts >= TranslationConfig.CHUNKSIZE:
+                self._translate_resumes(pending)
+                pending, numtexts = [], 0
+        self._translate_resumes(pending)
         self.cursor.execute("DROP TABLE temporary;")
+        self.trans.report()
+            
+    def _store_resumes(self, resumes):
+        """Write resumes to the store in one bulk upsert.  Resumes that cannot be stored
+        are replaced by an error entry, which clear_mongodb removes to download them again.
+        """
+        
+        failed = self.store.upsert(resumes)
+        for data, error in failed:
+            print("Error storing %s: %s" % (data['_id'], error))
+        self.store.upsert([{'_id':data['_id'], 'error':str(error)} for data, error in failed])
+        print("Inserted %d resumes" % (len(resumes) - len(failed)))
             
     def get_resume_pages(self):
-        """Get resume pages.  Store in mongodb.  TODO: FIXXX"""
+        """Get the resume pages that are not in the resume store or were downloaded more than
+        ResumeConfig.REFRESHDAYS days ago, and write them to the store in batches.
+        """
         
-        db = self.db
-        resumes = self.db.resumes
         driver = self.driver
         
         query = """SELECT DISTINCT id FROM resumelinks ORDER BY RANDOM() ;"""
-        df = pd.read_sql(query, self.conn)
-        # get all the ids in mongod db
-        py_ids = [int(i) for i in db.resumes.find().distinct('_id')]
-        print("Number of entries in mongo DB: %d" % (len(py_ids)))
-        df = df[~df['id'].isin(py_ids)]
-        
-        print("Trying to retrive %s pages" % (len(df)))
-
+        ids = [int(row[0]) for row in self.conn.execute(query).fetchall()]
+        # read the id and download date of every stored resume at once
+        dates = self.store.dates()
+        print("Number of entries in resume store: %d" % (len(dates)))
+        cutoff = None if ResumeConfig.REFRESHDAYS is None else datetime.datetime.now() - datetime.timedelta(days=ResumeConfig.REFRESHDAYS)
+        ids = [uid for uid in ids if uid not in dates or (cutoff is not None and dates[uid] is not None and dates[uid] < cutoff)]
+        print("Trying to retrive %s pages" % (len(ids)))
         
-        for uid in df['id']:
-            # check if the id exists and/or it is greater than 
-            criteria = {"$and": [{"_id": uid}, {"downloaddate": {'$lt': self.datecur - datetime.timedelta(days=30)}}]}
-            cnt1 = db.resumes.count_documents(criteria)
-            cnt2 = db.resumes.count_documents({'_id': uid})
+        resumes = []
+        for uid in ids:
             url = 'https://www.tanqeeb.com/profile/{}?open=1'.format(uid)
-            #print(url)
-            if cnt1 > 0 or cnt2 == 0:
-                driver.get(url)
-                # sleep before trying to extract the page links...need some time lapse to download
-                time.sleep(random.randint(2,4))
-                soup = BeautifulSoup(driver.page_source, 'html.parser')
-                data = self.parse_resume_page(soup, uid)
-                if cnt1 > 0:
-                    db.resumes.delete_one(criteria)
-                try:
-                    resumes.insert_one(data)
-                    print("Inserted %s" % (uid))
-                except Exception as e:
-                    print(e)
-                    data = {'_id':uid, 'error':e}
-                    resumes.insert_one(data)
+            driver.get(url)
+            # sleep before trying to extract the page links...need some time lapse to download
+            time.sleep(random.randint(2,4))
+            soup = make_soup(driver.page_source)
+            resumes.append(self.parse_resume_page(soup, uid))
+            if len(resumes) >= ResumeConfig.BATCHSIZE:
+                self._store_resumes(resumes)
+                resumes = []
+        self._store_resumes(resumes)
 
+    def close(self):
+        """Close the resume store along with the database of the downloader."""
+        if self.conn is not None:
+            self.store.close()
+        super(TanQeebCVDownloader, self).close()
         
         
 if __name__ == "__main__":
@@ -14,34 +14,55 @@ import random
 import sqlite3
 import csv
 import urllib.request
-from bs4 import BeautifulSoup
 import pandas as pd
 import numpy as np
 import re
 import os
-from googletrans import Translator
 import html2text
 from basedownloader import BaseDownloader
-from config import FileConfig
-from create_databases import get_tanqeeb_table_schema
+from paginator import Paginator
+from translation import get_translator
+from htmlparse import make_soup, only
+from dbconnect import connect_db
+from config import FileConfig, TranslationConfig
+from create_databases import get_tanqeeb_table_schema, get_tanqeeb_table_indexes
 
 
 countries = ['algeria','egypt','jordan','morocco','tunisia']
 
+# subtrees of a job ad page read by TanQeebDownloader.parse_jobad_page
+JOBADPAGE = only(('h1', None), ('table', 'table job-details-table'), ('div', 'alert alert-warning'), ('div', 'job-details'))
+
 class TanQeebDownloader(BaseDownloader):
+
+    dbname = "tanqeeb.db"
+    seenids = ("jobadpageurls", "uniqueid")
+    jobadpagequery = """INSERT OR IGNORE INTO jobadpage 
+                (country, uniqueid, postdate, location, jobtype, company, reqexp, salary, education, title, 
+                pubimg, description)
+                VALUES(?,?,?,?,?,?,?,?,?,?,?,?);"""
+    pendingquery = """INSERT OR IGNORE INTO pendingads (country, uniqueid, href, added, fetched) VALUES(?,?,?,?,NULL);"""
+    fetchedquery = """UPDATE pendingads SET fetched = ? WHERE country = ? AND uniqueid = ?;"""
+    # read run on every download, its plan is checked by create_databases.check_schemas
+    newpagesquery = """SELECT uniqueid, href FROM pendingads WHERE country = ? AND fetched IS NULL;"""
     
-    def __init__(self, params):
+    def __init__(self, params, writer=None):
         #super(TanQeebDownloader, self).__init__()
         self.extdir = os.path.join(FileConfig.EXTDIR,'tanqeeb')
         self.outdir = os.path.join(FileConfig.EXTDIR,'tanqeeb')
-        self.conn = sqlite3.connect(os.path.join(self.outdir,"tanqeeb.db"), timeout=3)
+        self.conn = connect_db(os.path.join(self.outdir,self.dbname))
+        self.writer = writer
         self.cursor = self.conn.cursor()
-        self._create_table_schema(get_tanqeeb_table_schema())
+        self._create_table_schema(get_tanqeeb_table_schema(), get_tanqeeb_table_indexes())
+        self._set_params(params)
+        print("Start Time: {}".format(self.datecur))
+
+    def _set_params(self, params):
+        self.params = params
         self.country = params["country"]
         self.tz = timezone(params["timezone"])
-        self.url = 'https://%s.tanqeeb.com/' % (params['webname'])
+        self.url = params['url'] if 'url' in params else 'https://%s.tanqeeb.com/' % (params['webname'])
         self.datecur = datetime.datetime.now(self.tz)
-        print("Start Time: {}".format(self.datecur))
         self.datemap = ['NULL', 'January','February','March','April','May',
                     'June','July','August','September',
                    'October','November','December']
@@ -52,7 +73,7 @@ class TanQeebDownloader(BaseDownloader):
         response = self._request_until_succeed(url)
         if response is None:
             return([])
-        soup = BeautifulSoup(response, 'html.parser')
+        soup = make_soup(response)
         #print(soup)
         temp1 = soup.find('div', {'class':classvar})
         temp2 = temp1.find_all('ul', {'class':'row'})
@@ -73,16 +94,16 @@ class TanQeebDownloader(BaseDownloader):
         
         # if getting new url data delete all of previous entries
         query = """DELETE FROM mainurls WHERE cat IS NOT NULL AND country = '%s';""" % (self.country)
-        self.cursor.execute(query)
-        self.conn.commit()
+        self._execute(query)
         query = """DELETE FROM categoryurls WHERE cat IS NOT NULL AND country = '%s';""" % (self.country)
-        self.cursor.execute(query)
-        self.conn.commit()
+        self._execute(query)
         
         # STEP 1:  get main page urls
         url = self.url + '/en'
         all_hrefs = []
         category_hrefs = self.get_page_urls(url, "tab-content")
+        query = """INSERT OR IGNORE INTO mainurls (downloaddate, country, topic, cat, href, img) VALUES(?, ?,?,?,?,?);"""
+        rows = []
         for row in category_hrefs:
             country, catname, href, img = row
             if re.match(r'\w+ Website Jobs', catname) or re.match(r'Tanqeeb', catname) is not None:
@@ -92,11 +113,10 @@ class TanQeebDownloader(BaseDownloader):
             elif re.match(r'Jobs in \w+', catname) is not None:
                 cattype = 'location'
             catname = re.sub(r'(Jobs in |( Website)* Jobs)','',catname)
-            query = """INSERT OR IGNORE INTO mainurls (downloaddate, country, topic, cat, href, img) VALUES(?, ?,?,?,?,?);"""
             row = [self.datecur.date(), country, cattype, catname, href, img]
-            self.cursor.execute(query,row)
-        self.conn.commit()
-        time.sleep(random.randint(1,5))
+            rows.append(row)
+        self._execute(query, rows)
+        self._sync()
         
         
         # STEP 2:  get category urls
@@ -112,11 +132,9 @@ class TanQeebDownloader(BaseDownloader):
             cat = cat.replace(' Jobs','')
             query = """INSERT OR IGNORE INTO categoryurls 
             (downloaddate, country, cat, subcat, href) VALUES(?,?,?,?,?);"""
-            for rowh in temp_hrefs:
-                row = [self.datecur.date(), country, cat, rowh[1].replace(' Jobs','').strip(), rowh[2]]
-                self.cursor.execute(query,row)
-            time.sleep(random.randint(2,5))
-        self.conn.commit()
+            rows = [[self.datecur.date(), country, cat, rowh[1].replace(' Jobs','').strip(), rowh[2]] for rowh in temp_hrefs]
+            self._execute(query, rows)
+        self._sync()
         
     def _clean_description(self, description):
         """Clean description of extraneous characters."""
@@ -130,21 +148,52 @@ class TanQeebDownloader(BaseDownloader):
         return(description)
         
     def get_jobad_summary_page(self, cat, subcat, href, pagetype='first'):
-        """Get summary page of job advertisements.
-        TODO:  Generalize to move onto next page.
+        """Get the summary pages of job advertisements of a subcategory, following
+        the next page links while ads are newer than self.lastdownloaddate.
         """
         print("Scraping page for category (%s) subcat (%s)" % (cat, subcat))
         if pagetype == 'first':
             url = self.url + href
         else:
             url = href
-        response = self._request_until_succeed(url)
-        if response is None:
-            return 
-        soup = BeautifulSoup(response, 'html.parser')
+        while url is not None:
+            response = self._request_until_succeed(url)
+            if response is None:
+                return
+            url = self.parse_jobad_summary_page(cat, subcat, response)
+
+    def get_jobad_summary_pages(self, categories):
+        """Get the summary pages of many subcategories at once with a paginator, a list of
+        (cat, subcat, href).  Progress is checkpointed so an interrupted crawl resumes
+        each subcategory from its last page.
+        """
+
+        listings = {}
+        names = {}
+        for cat, subcat, href in categories:
+            listings[href] = self.url + href
+            names[href] = (cat, subcat)
+
+        def parse(listing, url, response):
+            cat, subcat = names[listing]
+            print("Scraping page for category (%s) subcat (%s): %s" % (cat, subcat, url))
+            return(self.parse_jobad_summary_page(cat, subcat, response))
+
+        paginator = Paginator(self.conn, self._execute, self._sync, self.country)
+        cursors = paginator.start(listings, self.datecur, self.lastdownloaddate)
+        # a resumed crawl pages back to the date it started with, the ads it wrote since are newer
+        self.lastdownloaddate = paginator.stopdate
+        paginator.crawl(cursors, self.engine.fetch_many, parse)
+        paginator.report()
+
+    def parse_jobad_summary_page(self, cat, subcat, response):
+        """Insert the job ads listed on a summary page.  Returns the url of the next
+        page if the last ad on this page is not older than self.lastdownloaddate, otherwise None.
+        """
+        soup = make_soup(response)
         temp1 = soup.find('div', {'id':'jobs_list'})
         if temp1 is None:
-            return
+            return(None)
         temp2 = temp1.find_all('div', {'id':True})
         data = {}
         cols = ['country', 'cat', 'subcat', 'uniqueid', 'dataid', 
@@ -152,6 +201,7 @@ class TanQeebDownloader(BaseDownloader):
         data['country'] = self.country
         data['cat'] = cat
         data['subcat'] = subcat
+        pagedate = None
         for t2 in temp2:
             data['uniqueid'] = t2['data-id']
             data['dataid'] = t2['id']
@@ -175,109 +225,150 @@ class TanQeebDownloader(BaseDownloader):
                     i_featured, postdate, title, href, description) VALUES(?,?,?,?,?,?,?,?,?,?);"""
             row = [data[col] if col in data else np.nan for col in cols]
             #print(row)
-            self.cursor.execute(query,row)
-            self.conn.commit()
+            self._insert('jobadpageurls', query, row)
+            # an ad listed under several categories is only fetched once
+            self._insert('pendingads', self.pendingquery, [self.country, data['uniqueid'], data['href'], self.datecur.strftime('%Y-%m-%d')])
+        # write the whole summary page in one transaction
+        self._flush_rows()
      
         nextpage = soup.find('link',{'rel':'next'})
         # only scrape next summary page if date is greater than lastdownloaddate
         if nextpage is not None and pagedate is not None:
             if pagedate.date() >= self.lastdownloaddate:
                 print("Getting next page", nextpage['href'])
-                self.get_jobad_summary_page(cat, subcat, nextpage['href'], pagetype='next')
+                return(nextpage['href'])
+        return(None)
         
-    def get_jobad_page(self, uid, href):
-        """Get individual job ad pages."""
+    def parse_jobad_page(self, uid, response):
+        """Parse an individual job ad page.  Returns (row, expired) where row is None
+        if the page has no job details and expired is True if the ad is no longer listed.
+        """
         data = {}
-        url = self.url + href
-        print(url)
         # potential cols 
         cols = ['country','uid','Posted date','Location','Job Type',
                 'Company','Required Experience','Salary','Education','title','Publisher','description']
-        response = self._request_until_succeed(url)
-        soup = BeautifulSoup(response, 'html.parser')
+        soup = make_soup(response, JOBADPAGE)
         data['country'] = self.country
         data['uid'] = uid
-        temp = soup.find('h1', {'class':""})
+        # the title is the h1 without a class, bs4 4.13 and later no longer match a missing class with class=""
+        temp = soup.find(lambda tag: tag.name == 'h1' and not tag.get('class'))
         if temp is not None:
             data['title'] = temp.text.strip()
         tableinfo = soup.find('table', {'class':"table job-details-table"})
 
-        if tableinfo is not None:
-            for t in tableinfo.find_all('tr'):
-                varname = t.find('th').text.strip()
-                vardata = t.find('td').text.strip()
-                if varname == 'Posted date':
-                    temp = re.search(r'((\d+) (%s) (\d+))' % ('|'.join(self.datemap)),vardata)
-                    if temp is not None:
-                        vardata = datetime.date(int(temp.group(4)),self.datemap.index(temp.group(3)),int(temp.group(2))).strftime('%Y-%m-%d')
-                elif varname == 'Publisher':
-                    temp = t.find('img')
-                    t1 = re.search(r'(thumb.*?\.(png|jpeg))$',temp['src'])
-                    if t1 is not None:
-                        vardata = t1.group(1)
-                elif varname == 'Location':
-                    vardata = re.sub(r'\t', '', vardata)
-                data[varname] = vardata
-            data['description'] = self._clean_description(str(soup.find('div', {'class':'job-details'})))
-            query = """INSERT OR IGNORE INTO jobadpage 
-                (country, uniqueid, postdate, location, jobtype, company, reqexp, salary, education, title, 
-                pubimg, description)
-                VALUES(?,?,?,?,?,?,?,?,?,?,?,?);"""
-            row = [data[col] if col in data else np.nan for col in cols]
-            #print(row)
-            self.cursor.execute(query,row)
-            self.conn.commit()
-        else:
-            temp = soup.find('div',{'class':"alert alert-warning"})
-            if temp is not None:
-                # Delete the job ad number from href as it is no longer relevant (and we will not find it)
-                query = """DELETE FROM jobadpageurls
-                WHERE country = '%s' AND uniqueid = '%s' AND href = '%s';"""  % (self.country, uid, href)
-                self.cursor.execute(query)
-                self.conn.commit()
+        if tableinfo is None:
+            return(None, soup.find('div',{'class':"alert alert-warning"}) is not None)
+        for t in tableinfo.find_all('tr'):
+            varname = t.find('th').text.strip()
+            vardata = t.find('td').text.strip()
+            if varname == 'Posted date':
+                temp = re.search(r'((\d+) (%s) (\d+))' % ('|'.join(self.datemap)),vardata)
+                if temp is not None:
+                    vardata = datetime.date(int(temp.group(4)),self.datemap.index(temp.group(3)),int(temp.group(2))).strftime('%Y-%m-%d')
+            elif varname == 'Publisher':
+                temp = t.find('img')
+                t1 = re.search(r'(thumb.*?\.(png|jpeg))$',temp['src'])
+                if t1 is not None:
+                    vardata = t1.group(1)
+            elif varname == 'Location':
+                vardata = re.sub(r'\t', '', vardata)
+            data[varname] = vardata
+        data['description'] = self._clean_description(str(soup.find('div', {'class':'job-details'})))
+        row = [data[col] if col in data else np.nan for col in cols]
+        return(row, False)
+
+    def get_jobad_page(self, uid, href, response=None):
+        """Get individual job ad pages.  The page is requested unless an already
+        fetched response is passed in.
+        """
+        url = self.url + href
+        print(url)
+        if response is None:
+            response = self._request_until_succeed(url)
+        if response is None:
+            if self.engine.is_gone(url):
+                for table, query, row in self._expired_rows(url, uid, self.datecur):
+                    self._execute(query, [row])
+            return
+        row, expired = self.parse_jobad_page(uid, response)
+        if row is not None:
+            self._insert('jobadpage', self.jobadpagequery, row)
+            self._execute(self.fetchedquery, [[self.datecur.strftime('%Y-%m-%d'), self.country, uid]])
+        elif expired:
+            for table, query, row in self._expired_rows(url, uid, self.datecur):
+                self._execute(query, [row])
+
+    def _expired_rows(self, url, uid, fetchtime):
+        """Rows to write for an ad that is no longer listed or whose page is gone: its url
+        is deleted as we will not find it again, and it is marked as fetched so it is not
+        requested again.
+        """
+        query = """DELETE FROM jobadpageurls
+            WHERE country = ? AND uniqueid = ? AND href = ?;"""
+        return([('jobadpageurls', query, [self.country, uid, url[len(self.url):]]),
+                ('pendingads', self.fetchedquery, [fetchtime.strftime('%Y-%m-%d'), self.country, uid])])
+
+    def _parse_page(self, url, response, fetchtime, uid, postdate):
+        """Parse a fetched job ad page.  Urls of ads that are no longer listed are deleted."""
+
+        row, expired = self.parse_jobad_page(uid, response)
+        if row is not None:
+            return([('jobadpage', self.jobadpagequery, row),
+                    ('pendingads', self.fetchedquery, [fetchtime.strftime('%Y-%m-%d'), self.country, uid])])
+        if expired:
+            return(self._expired_rows(url, uid, fetchtime))
+        return([])
         
     def get_new_jobad_pages(self):
-        """Query data to get new job ad pages that have not been posted.
-        Time series data is irrelevant for Tanqeeb since there is nothing to capture.
+        """Fetch the pages of the ads that are pending, each ad once however many
+        categories list it.  Time series data is irrelevant for Tanqeeb since there is nothing to capture.
         """
 
-        query = """SELECT DISTINCT uniqueid, href FROM jobadpageurls 
-        WHERE country = '%s' AND uniqueid NOT IN
-        (SELECT uniqueid FROM jobadpage WHERE country = '%s')""" % (self.country, self.country)
-        jobadpages = self.cursor.execute(query).fetchall()
+        self._sync()
+        jobadpages = self.conn.execute(self.newpagesquery, [self.country]).fetchall()
         print("Downloading %d pages" % (len(jobadpages)))
-        for uid, href in jobadpages:
-            self.get_jobad_page(uid,href)
+        items = [(self.url + href, uid, None) for uid, href in jobadpages]
+        for (url, uid, postdate), response, rows in self._pipeline_pages(items):
+            print(url)
+            if rows is None and self.engine.is_gone(url):
+                # the page no longer exists, the ad stays pending only if it could not be fetched
+                rows = self._expired_rows(url, uid, self.datecur)
+            for table, query, row in rows if rows is not None else []:
+                self._insert(table, query, row)
         
     def translate_descriptions(self):
-        """Translate description from arabic to english"""
+        """Translate descriptions from arabic to english.  Descriptions are handed to the
+        shared translation service in chunks, text it has translated before is not sent again.
+        """
         
         print("Starting to Translate")
-        trans = Translator()
+        service = get_translator()
+        service.start_run()
         h = html2text.HTML2Text()
         h.ignore_links = True
         
+        self._sync()
         query = """SELECT DISTINCT country from jobadpage;"""
-        countries = self.conn.execute(query)
+        countries = self.conn.execute(query).fetchall()
         
+        insertquery = """INSERT OR IGNORE INTO translation (country, uniqueid, description_en) VALUES (?,?,?);"""
         for country in countries:
             query = """SELECT DISTINCT j.country, j.uniqueid, j.description FROM jobadpage j 
-            WHERE j.country='%s' AND NOT EXISTS (SELECT t.country, t.uniqueid FROM translation t WHERE j.country=t.country AND j.uniqueid=t.uniqueid);""" % (country[0]) 
-            results = pd.read_sql(query, self.conn)
+            WHERE j.country = ? AND NOT EXISTS (SELECT t.country, t.uniqueid FROM translation t WHERE j.country=t.country AND j.uniqueid=t.uniqueid);"""
+            results = self.conn.execute(query, [country[0]]).fetchall()
             print("Translating %s for %d descriptions" % (country[0], len(results)))
-            for i, row in results.iterrows():
-                temp = h.handle(row['description'].decode('utf-8'))
-                query = """INSERT OR IGNORE INTO translation (country, uniqueid, description_en) VALUES (?,?,?);"""
-                try:
-                    entry = [row['country'],row['uniqueid'],trans.translate(temp).text]
-                except:
-                    print("Error: %s" % (row['uniqueid']))
-                    entry = [row['country'],row['uniqueid'],'Error']
-                self.cursor.execute(query,entry)
-                self.conn.commit()
-                time.sleep(random.randint(1,3))
-                if i % 1000 == 0:
-                    print("Translating %d" % (i))
+            for i in range(0, len(results), TranslationConfig.CHUNKSIZE):
+                chunk = results[i:i+TranslationConfig.CHUNKSIZE]
+                texts = [h.handle(description.decode('utf-8') if isinstance(description, bytes) else description or '')
+                         for cty, uid, description in chunk]
+                for (cty, uid, description), translation in zip(chunk, service.translate(texts)):
+                    # descriptions that could not be translated are tried again on the next run
+                    if translation is None:
+                        print("Error: %s" % (uid))
+                        continue
+                    self._insert('translation', insertquery, [cty, uid, translation])
+                print("Translating %d" % (i + len(chunk)))
+        service.report()
               
     def run_all(self, debug=False):
         """Download all relevant data"""
@@ -295,16 +386,17 @@ class TanQeebDownloader(BaseDownloader):
         # download newly listed job ads
         self.lastdownloaddate = self._last_download_date('jobadpageurls', 'postdate')
         query = """SELECT DISTINCT cat, subcat, href FROM categoryurls WHERE country='%s';""" % (self.country)
-        df = pd.read_sql(query, self.conn)
-        for i, row in df.iterrows():
-            self.get_jobad_summary_page(row['cat'],row['subcat'],row['href'], pagetype='first')
-            if debug and i > 1:
-                break
+        categories = self.conn.execute(query).fetchall()
+        self.get_jobad_summary_pages(categories[:3] if debug else categories)
+        self._sync()
         self.get_new_jobad_pages()
+        self._sync()
         if self.country == 'tunisia':
             self.translate_descriptions()
+            self._sync()
         self._display_db_tables()
-        self.conn.close()
+        self.engine.report()
+        self.close()
        
 if __name__ == "__main__":
 
@@ -0,0 +1,302 @@
+"""
+Purpose:  This module contains the translation service shared by the Tanqeeb
+job ad and CV downloaders and the step2 preprocessors.  Texts are translated
+in batches by a pluggable backend, with a few requests in flight at a time,
+each paced by a token bucket instead of a sleep after every call.  Every
+translation is kept in a cache database keyed by a hash of the normalized
+text and the backend that translated it, so a text that was translated once,
+for any table, is never sent again, and the placeholders of LocalBackend are
+never served as real translations.
+
+Texts are split into sentences and lines before they are looked up, so the
+cache works as a translation memory: boilerplate such as company blurbs,
+section headers and degree names is translated once however many
+descriptions and CVs repeat it.
+
+Layout of the cache:
+    <FileConfig.EXTDIR>/translations.db
+"""
+
+import concurrent.futures
+import datetime
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from config import FileConfig, TranslationConfig
+from dbconnect import get_db
+from fetchengine import TokenBucket
+
+
+TIMEFORMAT = '%Y-%m-%d %H:%M:%S'
+
+# segments end at a line break or at the space after the end of a sentence
+SEGMENTEND = re.compile(r'([ \t]*\n\s*|(?<=[.!?\u061f\u061b])[ \t]+)')
+# list markers and emphasis around a segment are kept out of what is translated
+MARKUP = re.compile(r'^([\s*#>\-\u2022]*)(.*?)([\s*]*)$', re.S)
+LETTER = re.compile(r'[^\W\d_]')
+
+
+def normalize(text):
+    """Normalize a text before it is hashed: unicode NFC with runs of whitespace collapsed."""
+
+    return(re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip())
+
+
+def split_segments(text):
+    """Split a text into a list of (prefix, segment, suffix) where segment is a
+    sentence or line to translate, or '' if it has no letters.  Joining all the
+    parts gives back the text.
+    """
+
+    pieces = SEGMENTEND.split(text)
+    parts = []
+    for i in range(0, len(pieces), 2):
+        prefix, segment, suffix = MARKUP.match(pieces[i]).groups()
+        if LETTER.search(segment) is None:
+            prefix, segment, suffix = pieces[i], '', ''
+        parts.append((prefix, segment, suffix + (pieces[i+1] if i + 1 < len(pieces) else '')))
+    return(parts)
+
+
+def text_key(text, dest, backend):
+    """Return the cache key of a text translated into dest by the backend named backend."""
+
+    return(hashlib.sha1(('%s\x00%s\x00%s' % (backend, dest, normalize(text))).encode('utf-8')).hexdigest())
+
+
+class GoogleBackend(object):
+    """Translate through googletrans.  Several texts are joined into one request
+    and split again afterwards.  If the translation does not come back with as
+    many parts as were sent, each text of the batch is sent on its own.
+    """
+
+    name = 'google'
+    separator = '\n\n|||\n\n'
+
+    def __init__(self):
+        # googletrans keeps a session per Translator, so each worker thread gets its own
+        self.local = threading.local()
+
+    def _translator(self):
+        if getattr(self.local, 'translator', None) is None:
+            from googletrans import Translator
+            self.local.translator = Translator()
+        return(self.local.translator)
+
+    def translate(self, texts, dest='en'):
+        """Return the translations of a list of texts, in order."""
+
+        translator = self._translator()
+        if len(texts) > 1:
+            parts = translator.translate(self.separator.join(texts), dest=dest).text.split('|||')
+            if len(parts) == len(texts):
+                return([part.strip() for part in parts])
+        return([translator.translate(text, dest=dest).text for text in texts])
+
+
+class LocalBackend(object):
+    """Stand-in backend for tests and offline runs.  It returns each text tagged
+    with the destination language and records what would have been sent.
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def translate(self, texts, dest='en'):
+        with self.lock:
+            self.requests.append(list(texts))
+        return(['[%s] %s' % (dest, text) for text in texts])
+
+
+BACKENDS = {'google': GoogleBackend, 'local': LocalBackend}
+
+
+def get_backend(name=TranslationConfig.BACKEND):
+    """Return a new backend by name, one of BACKENDS."""
+
+    if name not in BACKENDS:
+        raise ValueError("Unknown translation backend %s, expected one of %s" % (name, ', '.join(sorted(BACKENDS))))
+    return(BACKENDS[name]())
+
+
+class TranslationCache(object):
+    """Translations already made, keyed by text_key of each text or segment.  Reads and writes happen in
+    the thread that calls the service, the backend workers never touch it.
+    """
+
+    def __init__(self, dbpath=None):
+        self.dbpath = dbpath if dbpath is not None else os.path.join(FileConfig.EXTDIR, 'translations.db')
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS translations (
+            hash VARCHAR(40),
+            dest VARCHAR(5),
+            backend VARCHAR(10),
+            source TEXT,
+            translated TEXT,
+            created VARCHAR(19),
+            PRIMARY KEY(hash));""")
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        # get_db keeps one connection per thread, so download jobs running in threads can share the cache
+        return(get_db(self.dbpath))
+
+    def get(self, keys):
+        """Return {key: translation} for the keys that are in the cache."""
+
+        found = {}
+        keys = list(keys)
+        # stay below the number of parameters sqlite allows in one statement
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            query = """SELECT hash, translated FROM translations WHERE hash IN (%s);""" % (','.join(['?'] * len(chunk)))
+            found.update(dict(self.conn.execute(query, chunk).fetchall()))
+        return(found)
+
+    def put(self, rows, backend, dest):
+        """Store rows of (key, normalized source, translation) and commit."""
+
+        created = datetime.datetime.now().strftime(TIMEFORMAT)
+        self.conn.executemany("""INSERT OR IGNORE INTO translations (hash, dest, backend, source, translated, created)
+            VALUES (?,?,?,?,?,?);""", [[key, dest, backend, source, translated, created] for key, source, translated in rows])
+        self.conn.commit()
+
+
+class TranslationService(object):
+    """Translate lists of texts through the cache and a backend.  Texts are split
+    into segments unless segment is False.  Segments missing from the cache are
+    deduplicated, grouped into batches of at most batchsize segments and maxchars
+    characters, and sent with at most concurrency requests in flight.  A batch
+    that fails is not cached, so its segments are tried again on the next call.
+    """
+
+    def __init__(self, backend=None, cache=None, batchsize=TranslationConfig.BATCHSIZE,
+                 maxchars=TranslationConfig.MAXCHARS, concurrency=TranslationConfig.CONCURRENCY,
+                 rate=TranslationConfig.RATE, burst=TranslationConfig.BURST, segment=TranslationConfig.SEGMENT):
+        self.backend = backend if backend is not None else get_backend()
+        self.cache = cache if cache is not None else TranslationCache()
+        self.batchsize = batchsize
+        self.maxchars = maxchars
+        self.concurrency = concurrency
+        self.segment = segment
+        self.bucket = TokenBucket(rate, burst)
+        self.start_run()
+
+    def start_run(self):
+        """Reset the counts printed by report, e.g. at the start of each translation run."""
+
+        self.counts = {'texts': 0, 'segments': 0, 'cached': 0, 'repeated': 0, 'sent': 0, 'requests': 0,
+                       'failed': 0, 'charssent': 0, 'charssaved': 0}
+
+    def _batches(self, items):
+        """Group (key, text) items into batches of at most batchsize texts and maxchars characters."""
+
+        batch, size = [], 0
+        for key, text in items:
+            if len(batch) > 0 and (len(batch) >= self.batchsize or size + len(text) > self.maxchars):
+                yield(batch)
+                batch, size = [], 0
+            batch.append((key, text))
+            size += len(text)
+        if len(batch) > 0:
+            yield(batch)
+
+    def _send(self, batch, dest):
+        time.sleep(self.bucket.reserve())
+        return(self.backend.translate([text for key, text in batch], dest=dest))
+
+    def _translate(self, texts, dest):
+        """Translate a list of texts or segments as they are, through the cache and the backend."""
+
+        keys = [None if text is None or normalize(text) == '' else text_key(text, dest, self.backend.name) for text in texts]
+        todo = dict([(key, text) for key, text in zip(keys, texts) if key is not None])
+        self.counts['segments'] += len([key for key in keys if key is not None])
+        self.counts['repeated'] += len([key for key in keys if key is not None]) - len(todo)
+        found = self.cache.get(todo.keys())
+        self.counts['cached'] += len(found)
+        self.counts['charssaved'] += sum([len(text) for key, text in zip(keys, texts) if key is not None]) - \
+            sum([len(text) for key, text in todo.items() if key not in found])
+        missing = [(key, text) for key, text in todo.items() if key not in found]
+        if len(missing) > 0:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = dict([(executor.submit(self._send, batch, dest), batch) for batch in self._batches(missing)])
+                for future in concurrent.futures.as_completed(futures):
+                    batch = futures[future]
+                    self.counts['requests'] += 1
+                    try:
+                        translated = future.result()
+                    except Exception as e:
+                        print("Error translating %d texts: %s" % (len(batch), e))
+                        self.counts['failed'] += len(batch)
+                        continue
+                    rows = [(key, normalize(text), translation) for (key, text), translation in zip(batch, translated)]
+                    self.cache.put(rows, self.backend.name, dest)
+                    found.update([(key, translation) for key, source, translation in rows])
+                    self.counts['sent'] += len(batch)
+                    self.counts['charssent'] += sum([len(text) for key, text in batch])
+        return([text if key is None else found.get(key) for key, text in zip(keys, texts)])
+
+    def translate(self, texts, dest=TranslationConfig.DEST):
+        """Return the translations of a list of texts in order.  Empty texts are returned
+        as they are and texts that could not be translated are returned as None.
+        """
+
+        self.counts['texts'] += len([text for text in texts if text is not None])
+        if not self.segment:
+            return(self._translate(texts, dest))
+        splits = [None if text is None else split_segments(text) for text in texts]
+        translated = iter(self._translate([segment for parts in splits if parts is not None
+                                           for prefix, segment, suffix in parts if segment != ''], dest))
+        results = []
+        for parts in splits:
+            if parts is None:
+                results.append(None)
+                continue
+            parts = [(prefix, segment if segment == '' else next(translated), suffix) for prefix, segment, suffix in parts]
+            if any([segment is None for prefix, segment, suffix in parts]):
+                results.append(None)
+            else:
+                results.append(''.join([prefix + segment + suffix for prefix, segment, suffix in parts]))
+        return(results)
+
+    def translate_one(self, text, dest=TranslationConfig.DEST):
+        """Translate a single text, see translate."""
+
+        return(self.translate([text], dest=dest)[0])
+
+    def report(self):
+        """Print texts translated, the share of segments found in the cache or repeated
+        within a call, and the characters sent to the backend and saved.
+        """
+
+        counts = self.counts
+        hits = counts['cached'] + counts['repeated']
+        print("Translated %d texts in %d segments with %s: %d segments from memory and %d repeated (%.1f%% hit rate), %d sent in %d requests (%d failed)" % (
+            counts['texts'], counts['segments'], self.backend.name, counts['cached'], counts['repeated'],
+            100.0 * hits / max(counts['segments'], 1), counts['sent'], counts['requests'], counts['failed']))
+        print("Translation characters sent: %d, saved: %d (%.1f%%)" % (counts['charssent'], counts['charssaved'],
+            100.0 * counts['charssaved'] / max(counts['charssent'] + counts['charssaved'], 1)))
+
+
+_service = None
+
+def get_translator():
+    """Return the translation service shared by all callers in this process."""
+
+    global _service
+    if _service is None:
+        _service = TranslationService()
+    return(_service)
+
+
+def set_translator(service):
+    """Replace the shared translation service, e.g. with one using LocalBackend in tests."""
+
+    global _service
+    _service = service
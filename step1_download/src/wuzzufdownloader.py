@@ -17,41 +17,71 @@ import re
 import os
 import pandas as pd
 import numpy as np
-from config import FileConfig
-from bs4 import BeautifulSoup
+from config import FileConfig, FrontierConfig
 from basedownloader import BaseDownloader
-from create_databases import get_wuzzuf_table_schema
+from htmlparse import make_soup, only
+from dbconnect import connect_db
+from create_databases import get_wuzzuf_table_schema, get_wuzzuf_table_indexes
+
+# subtrees of a job page read by WuzzufDownloader.get_job_page
+JOBPAGE = only(('div', 'alert alert-danger alert-job col-sm-12'), ('div', 'job-main-card content-card'),
+               ('div', 'row job-summary'), ('div', 'about-job content-card'),
+               ('div', 'job-requirements content-card'), ('div', 'industries labels-wrapper'))
 
 class WuzzufDownloader(BaseDownloader):
+
+    dbname = "wuzzuf_new.db"
+    archivetables = ('jobadpage',)
+    # applicant counts are tracked for the first seven weeks after posting
+    maxrevisitdays = 49
+    revisithistory = ('jobadpage', ['num_applicants', 'num_seen', 'num_shortlisted'])
+    hashregions = JOBPAGE
+    # reads run for every listing and every download, their plans are checked by create_databases.check_schemas
+    remainingquery = '''SELECT COUNT(DISTINCT uid) FROM jobadpageurls WHERE country = ? AND postdate >= ? AND postdate < ?;'''
+    seedquery = '''SELECT uid, href, MAX(postdate) FROM jobadpageurls WHERE country = ? AND postdate >= DATE(?,'-%d days') GROUP BY uid;'''
+    jobpagequery = '''INSERT OR IGNORE INTO jobadpage (country, uid, postdate, posttime, downloaddate, downloadtime, stat, jobtitle, company, location, num_applicants, num_vacancies, num_seen, num_shortlisted, num_rejected, experience_needed, career_level, job_type, salary, education_level, gender, travel_frequency, languages, vacancies, roles, keywords, requirements, industries)
+            VALUES (?, ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
     
-    def __init__(self):
+    def __init__(self, writer=None, params=None):
         #super(WuzzufDownloader, self).__init__()
         self.extdir = os.path.join(FileConfig.EXTDIR,'wuzzuf')
-        self.conn = sqlite3.connect(os.path.join(FileConfig.EXTDIR, 'wuzzuf', "wuzzuf_new.db"))
+        self.conn = connect_db(os.path.join(self.extdir, self.dbname))
+        self.writer = writer
         self.cursor = self.conn.cursor()
+        self._set_params(params)
+        self._create_table_schema(get_wuzzuf_table_schema(), get_wuzzuf_table_indexes())
+        print("Start Time: {}".format(self.datecur))
+
+    def _set_params(self, params):
+        self.params = params
         self.country = 'egypt'
+        # the site can be pointed elsewhere (e.g. the mock job board) with a url in params
+        self.url = params['url'] if params is not None and 'url' in params else 'https://wuzzuf.net/'
         self.tz = timezone('Africa/Cairo')
         self.datecur = datetime.datetime.now(self.tz)
-        self._create_table_schema(get_wuzzuf_table_schema())
-        print("Start Time: {}".format(self.datecur))
         
         
     def get_job_urls(self, lastdownloaddate, debug=False):
         """Get urls for each job in the database."""
     
-        url = 'https://wuzzuf.net/search/jobs?start=0&filters%5Bcountry%5D%5B0%5D=Egypt'
+        url = self.url + 'search/jobs?start=0&filters%5Bcountry%5D%5B0%5D=Egypt'
         nextpage = True
+        # load the known ids before this run adds any
+        seen = self.seen
 
         #check the dates of the pages that are listed
         while nextpage:
     
-            req = urllib.request.Request(url)
-            response = urllib.request.urlopen(req)
-            soup = BeautifulSoup(response, 'html.parser')
+            response = self._request_until_succeed(url)
+            if response is None:
+                break
+            soup = make_soup(response)
     
             # objective is to get the links from the page and put it in a list to call and run through
+            query = '''INSERT OR IGNORE INTO jobadpageurls (country, uid, postdate, postdatetime, href) VALUES (?,?,?,?,?);'''
             name_box = soup.find('div', attrs={'class': 'content-card card-has-jobs'})
             #print(name_box)
+            uids = []
 
             #obtain all of the urls and dates associated with different jobs listed on the website (this only needs to be called once)
             for d in name_box.find_all('div', attrs={'class':'new-time'}):
@@ -63,19 +93,23 @@ class WuzzufDownloader(BaseDownloader):
                 #print(url)
                 temp = re.search(r'[jobs/p/|internship/](\d+)-',url)
                 uniqueid = temp.group(1)
-                query = '''INSERT OR IGNORE INTO jobadpageurls (country, uid, postdate, postdatetime, href) VALUES (?,?,?,?,?);'''
                 row = [self.country, uniqueid,dateval.strftime('%Y-%m-%d'),temptime['title'],url]
-                self.cursor.execute(query, row)
-            self.conn.commit()
+                self._insert('jobadpageurls', query, row)
+                uids.append(uniqueid)
+            # write the whole listing page in one transaction
+            self._flush_rows()
+            known = seen.page(uids)
         
             # get the next set of job listings for this classification only if we have not already collected the data
-            if dateval.date() >= lastdownloaddate and not debug:
+            if dateval.date() >= lastdownloaddate and not debug and known:
+                # the pages after this one list ads that were collected before
+                remaining = self.conn.execute(self.remainingquery, [self.country, lastdownloaddate.strftime('%Y-%m-%d'), dateval.strftime('%Y-%m-%d')]).fetchone()[0]
+                print("Stopping at a listing page of known ads, about %d listing requests saved" % (seen.stop(remaining, len(uids))))
+                nextpage = False
+            elif dateval.date() >= lastdownloaddate and not debug:
                 nextpg = name_box.find('li', attrs={'class': 'pag-next'})
                 try:
                     url = nextpg.find_all('a', href=True)[0]['href']
-                    #Print out length to track number of urls retrieved
-                    # sleep to make sure not too many requests are being made
-                    time.sleep(random.randint(1,5))
                 except AttributeError:
                     nextpage = False
             else:
@@ -83,8 +117,11 @@ class WuzzufDownloader(BaseDownloader):
                 nextpage = False
         
 
-    def get_job_page(self, uid, urlname, postdate):
-        """Scrapes individual job advertisement pages and return the row of relevant data."""
+    def get_job_page(self, uid, urlname, postdate, response=None, fetchtime=None):
+        """Scrapes individual job advertisement pages and return the row of relevant data.
+        The page is requested unless an already fetched response is passed in, fetchtime
+        is the time it was fetched (default now).
+        """
         #print(urlname)
         punctuation = [";",",","'","&"]
         data = {}
@@ -94,7 +131,7 @@ class WuzzufDownloader(BaseDownloader):
                 'roles', 'keywords', 'requirements', 'industries']
                 
         # actual time downloaded to use the page views as proxy       
-        datetimecur = datetime.datetime.now(self.tz)
+        datetimecur = fetchtime if fetchtime is not None else datetime.datetime.now(self.tz)
         data['country'] = self.country
         data['uid'] = uid
         data['downloaddate'] = datetimecur.strftime('%Y-%m-%d')
@@ -103,8 +140,10 @@ class WuzzufDownloader(BaseDownloader):
         data['stat'] = 'OPEN'
         
         #STEP 1:  request the url page
-        response = self._request_until_succeed(urlname)
         if response is None:
+            response = self._request_until_succeed(urlname)
+        if response is None and not self.engine.is_deferred(urlname):
+            # the page is gone under its full url, try the short url of the ad
             urlname = urlname.split('-')[0]
             response = self._request_until_succeed(urlname)
         
@@ -113,7 +152,7 @@ class WuzzufDownloader(BaseDownloader):
             data['stat'] = 'NOT FOUND'
         else:
             #check job status and see if it is open or closed and it contains content
-            soup = BeautifulSoup(response, 'html.parser')
+            soup = make_soup(response, JOBPAGE)
             status = soup.find('div',attrs={'class':"alert alert-danger alert-job col-sm-12"})
             mainjobdata = soup.find('div', attrs={'class': 'job-main-card content-card'})
             if status is not None:
@@ -225,33 +264,56 @@ class WuzzufDownloader(BaseDownloader):
         
     def get_new_page_data(self, debug):
         """Obtain all job advertisement pages from urltable which we want to recollect data for insertion into
-        database.  This helps with tracking changes in applicants over time.  It focuses on job ads where status
-        is open (not closed).
+        database.  This helps with tracking changes in applicants over time.  New urls are added to the
+        crawl frontier and due ads are pulled from it in batches, ads that are closed are no longer revisited.
         """
-    
-        jobpageurlquerylist = []
 
-        for i in range(0,8):
-            d = i*7
-            temp = self.cursor.execute('''SELECT DISTINCT uid, href, postdate, country FROM jobadpageurls WHERE country = '{}' AND DATE(postdate) == DATE('{}','-{} days');'''.format(self.country, self.datecur.strftime('%Y-%m-%d'),d)).fetchall()
-            jobpageurlquerylist = jobpageurlquerylist + temp
-            if debug and i > 1:
-                print(jobpageurlquerylist)
-                break
+        now = datetime.datetime.now(self.tz)
+        query = self.seedquery % (self.maxrevisitdays)
+        numurls = self.frontier.seed(now, query, [self.country, now.strftime('%Y-%m-%d')])
+        print("Number of urls checked for the frontier: {}".format(numurls))
 
-        print("Number of pages to query: {}".format(len(jobpageurlquerylist)))
+        query = self.jobpagequery
+        numpages = 0
+        while True:
+            jobpageurlquerylist = self.frontier.due(now, limit=3 if debug else FrontierConfig.BATCHSIZE)
+            if len(jobpageurlquerylist) == 0:
+                break
+            numpages += len(jobpageurlquerylist)
+            print("Number of pages to query: {}".format(len(jobpageurlquerylist)))
 
-        #retrieve information for insertion into database
-        for i, urlinfo in enumerate(jobpageurlquerylist):
-            query = '''INSERT OR IGNORE INTO jobadpage (country, uid, postdate, posttime, downloaddate, downloadtime, stat, jobtitle, company, location, num_applicants, num_vacancies, num_seen, num_shortlisted, num_rejected, experience_needed, career_level, job_type, salary, education_level, gender, travel_frequency, languages, vacancies, roles, keywords, requirements, industries)
-            VALUES (?, ?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
-            rowvalues = self.get_job_page(urlinfo[0],urlinfo[1],urlinfo[2])
-            self.cursor.execute(query, rowvalues)
-            self.conn.commit()
-            if debug and i > 2:
-                print(rowvalues)
+            #retrieve information for insertion into database, pages are fetched, parsed and written in separate stages
+            items = [(urlinfo[1], urlinfo[0], urlinfo[2]) for urlinfo in jobpageurlquerylist]
+            closed = []
+            deferred = []
+            for (url, uid, postdate), response, rows in self._pipeline_pages(items):
+                if rows is None:
+                    # retried on the short url of the ad
+                    rowvalues = self.get_job_page(uid, url, postdate)
+                    if rowvalues[6] == 'NOT FOUND' and self.engine.is_deferred(url, url.split('-')[0]):
+                        deferred.append(uid)
+                        continue
+                    rows = [('jobadpage', query, rowvalues)]
+                for table, rowquery, rowvalues in rows:
+                    self._insert(table, rowquery, rowvalues)
+                    if table == 'jobadpage' and rowvalues[6] in ['CLOSED', 'NOT FOUND']:
+                        closed.append(uid)
+                    if debug:
+                        print(rowvalues)
+            self.frontier.retire(closed)
+            self._defer_pages(deferred, now)
+            if debug:
                 break
+        print("Number of pages queried: {}".format(numpages))
+        self.frontier.report(now)
+        self.frontier.report_savings()
         
+    def _parse_page(self, url, response, fetchtime, uid, postdate):
+        """Parse a stored job advertisement page."""
+
+        rowvalues = self.get_job_page(uid, url, postdate, response=response, fetchtime=fetchtime)
+        return([('jobadpage', self.jobpagequery, rowvalues)])
+
     def run_all(self, debug=False):
         """Run key operations to update database."""
         print("Running WuzzufDownloader for %s on date (%s)" % (self.country, self.datecur))
@@ -259,11 +321,16 @@ class WuzzufDownloader(BaseDownloader):
         starttime = time.time()
         lastdownloaddate = self._last_download_date('jobadpageurls','postdate')
         self.get_job_urls(lastdownloaddate, debug=debug)
+        self._sync()
+        self.seen.report()
         print("Time to get new urls: {}".format(time.time()-starttime))
         self.get_new_page_data(debug=debug)
+        self._sync()
         print("Time to get scrape pages: {}".format(time.time()-starttime))
         self._display_db_tables()
         self._archive_database('jobadpage', 'jobadpageurls',maxdays=90)
+        self.engine.report()
+        self.close()
         print("Total run time: {}".format(time.time()-starttime))
         
 if __name__ == "__main__":
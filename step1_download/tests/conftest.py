@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the downloader modules import each other by name from src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
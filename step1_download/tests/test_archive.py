@@ -0,0 +1,36 @@
+"""
+Check that export_archive only adds files to the manifest for rows it cleared.
+"""
+
+import datetime
+import os
+import sqlite3
+import pytest
+from archivestore import ArchiveStore, read_archive
+from basedownloader import export_archive
+
+
+def test_failed_export_leaves_no_files(tmp_path):
+    dbpath = str(tmp_path / 'site.db')
+    conn = sqlite3.connect(dbpath)
+    conn.execute("CREATE TABLE archivedjobadpage (country VARCHAR(20), uid VARCHAR(10), postdate DATE, title TEXT);")
+    conn.executemany("INSERT INTO archivedjobadpage VALUES (?,?,?,?);", [
+        ('egypt', str(uid), '2026-09-%02d' % (uid + 1), 'ad %d' % (uid)) for uid in range(10)])
+    conn.execute("""CREATE TRIGGER keep BEFORE DELETE ON archivedjobadpage BEGIN SELECT RAISE(ABORT, 'disk full'); END;""")
+    conn.commit()
+    archivedir = str(tmp_path / 'archive')
+    datecur = datetime.date(2026, 10, 1)
+
+    with pytest.raises(sqlite3.DatabaseError):
+        export_archive(str(tmp_path), 'site.db', ['jobadpage'], ['egypt'], datecur)
+    # the rows are still waiting to be archived and no file or manifest entry refers to them
+    assert conn.execute("SELECT COUNT(*) FROM archivedjobadpage;").fetchone()[0] == 10
+    assert ArchiveStore(archivedir).load_manifest() == []
+    assert [files for root, dirs, files in os.walk(archivedir) if len(files) > 0] == []
+
+    conn.execute("DROP TRIGGER keep;")
+    conn.commit()
+    export_archive(str(tmp_path), 'site.db', ['jobadpage'], ['egypt'], datecur)
+    assert conn.execute("SELECT COUNT(*) FROM archivedjobadpage;").fetchone()[0] == 0
+    assert sorted(read_archive(archivedir, 'jobadpage', columns=['uid'])['uid']) == sorted([str(uid) for uid in range(10)])
+    conn.close()
@@ -0,0 +1,35 @@
+"""
+Check that a connection shared through connect_db stays open until every
+object that opened it has closed it.
+"""
+
+import sqlite3
+import pytest
+from dbconnect import connect_db, close_db, get_db
+
+
+def test_close_keeps_shared_connection(tmp_path):
+    dbpath = str(tmp_path / 'shared.db')
+    first = connect_db(dbpath)
+    second = connect_db(dbpath)
+    assert first is second
+    close_db(first)
+    # still held by the second user
+    assert second.execute("SELECT 1;").fetchone() == (1,)
+    assert get_db(dbpath) is second
+    close_db(second)
+    with pytest.raises(sqlite3.ProgrammingError):
+        second.execute("SELECT 1;")
+    # the next user gets a new connection
+    third = connect_db(dbpath)
+    assert third is not second
+    assert get_db(dbpath) is third
+    close_db(third)
+
+
+def test_get_db_does_not_hold(tmp_path):
+    dbpath = str(tmp_path / 'cache.db')
+    conn = get_db(dbpath)
+    assert connect_db(dbpath) is conn
+    close_db(conn)
+    assert get_db(dbpath) is not conn
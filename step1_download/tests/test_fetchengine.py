@@ -0,0 +1,55 @@
+"""
+Check that the circuit breaker of a host is not left waiting for a trial
+request that the deadline stopped from being made, and that fetch_many runs
+every call on the same event loop.
+"""
+
+import threading
+import time
+import pytest
+from fetchengine import FetchEngine
+
+
+class Session(object):
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        return(200, b'page')
+
+
+@pytest.mark.parametrize('many', [False, True], ids=['fetch', 'fetch_many'])
+def test_deadline_does_not_hold_breaker_trial(many):
+    session = Session()
+    engine = FetchEngine(rate=1000, burst=10, deadline=5, session=session)
+    url = 'http://example.com/jobs'
+    breaker = engine._breaker(url)
+    # the host was paused and its cooldown is over, the next request is the trial
+    breaker.openuntil = time.monotonic() - 1
+    # waiting before the request would pass the deadline
+    engine._wait = lambda count: 10.0
+    assert (engine.fetch_many([url]) if many else [engine.fetch(url)]) == [None]
+    assert engine.deferred[url] == 'deadline'
+    assert session.urls == []
+
+    # the next job may still make the trial request
+    engine.start_run(None)
+    engine._wait = lambda count: 0.0
+    assert engine.fetch(url) == b'page'
+    assert breaker.openuntil is None
+
+
+def test_fetch_many_reuses_loop():
+    session = Session()
+    engine = FetchEngine(rate=1000, burst=10, deadline=None, session=session)
+    assert engine.fetch_many(['http://example.com/1', 'http://example.com/2']) == [b'page', b'page']
+    loop = engine.loop
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(engine.fetch_many(['http://example.com/3']))) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [[b'page'], [b'page']]
+    assert engine.loop is loop and not loop.is_closed()
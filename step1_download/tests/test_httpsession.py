@@ -0,0 +1,47 @@
+"""
+Check that the session pool closes the connections of failed requests.
+"""
+
+import http.client
+import ssl
+import pytest
+from httpsession import SessionPool
+
+
+class FailingConnection(object):
+    def __init__(self, error):
+        self.error = error
+        self.closed = False
+
+    def request(self, method, path, headers=None):
+        raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_reconnect_is_closed():
+    pool = SessionPool()
+    stale = FailingConnection(http.client.RemoteDisconnected('closed by server'))
+    fresh = FailingConnection(ConnectionRefusedError('refused'))
+    pool.idle[('http', 'example.com')] = [stale]
+    pool._connect = lambda key: fresh
+    with pytest.raises(ConnectionRefusedError):
+        pool._request('http://example.com/jobs')
+    # neither the keep-alive connection nor the one opened to retry it is left open
+    assert stale.closed
+    assert fresh.closed
+    assert pool.idle[('http', 'example.com')] == []
+
+
+@pytest.mark.parametrize('error', [ssl.SSLError('bad record mac'), OSError('network unreachable'), ValueError('bad header')],
+                         ids=['ssl', 'oserror', 'other'])
+def test_failed_connection_is_not_pooled(error):
+    pool = SessionPool()
+    conn = FailingConnection(error)
+    pool.idle[('http', 'example.com')] = [conn]
+    pool._connect = lambda key: pytest.fail('a fresh connection is only opened for a closed keep-alive connection')
+    with pytest.raises(type(error)):
+        pool._request('http://example.com/jobs')
+    assert conn.closed
+    assert pool.idle[('http', 'example.com')] == []
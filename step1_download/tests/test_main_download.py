@@ -0,0 +1,10 @@
+"""
+Check that a run with every site switched off finishes without starting a pool.
+"""
+
+import main_download
+
+
+def test_no_jobs():
+    rundata = dict([(site, False) for site in main_download.RUNDATA])
+    assert main_download.main(rundata=rundata) == 0
@@ -0,0 +1,114 @@
+"""
+Check that tables rebuilt by migrations.rebuild_table keep their indexes and
+the writes made while they are copied, and that jobs migrating the same
+database at once apply each migration once.
+"""
+
+import sqlite3
+import threading
+import pytest
+import migrations
+from dbconnect import connect_db, close_db
+
+
+def make_table(dbpath, rows):
+    conn = sqlite3.connect(dbpath)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("CREATE TABLE ads (uid INTEGER, title TEXT);")
+    conn.execute("CREATE INDEX idx_ads_title ON ads (title);")
+    conn.executemany("INSERT INTO ads (uid, title) VALUES (?,?);", [(uid, 'ad %d' % (uid)) for uid in range(rows)])
+    conn.commit()
+    return(conn)
+
+
+@pytest.mark.parametrize('newtablequery,key', [
+    ("""CREATE TABLE ads (uid INTEGER, title TEXT, seen INTEGER, UNIQUE(uid));""", None),
+    ("""CREATE TABLE ads (uid INTEGER PRIMARY KEY, title TEXT, seen INTEGER);""", ['uid']),
+], ids=['rowid', 'key'])
+def test_rebuild_table_keeps_indexes_and_concurrent_writes(tmp_path, newtablequery, key):
+    dbpath = str(tmp_path / 'rebuild.db')
+    other = make_table(dbpath, 100)
+    conn = sqlite3.connect(dbpath)
+    batches = []
+
+    def write_between_batches(copied):
+        # another connection writes once the first batch has been committed
+        batches.append(copied)
+        if len(batches) == 1:
+            other.execute("DELETE FROM ads WHERE uid IN (1, 2, 95);")
+            other.execute("UPDATE ads SET title = 'changed' WHERE uid = 3;")
+            other.execute("INSERT INTO ads (uid, title) VALUES (100, 'ad 100');")
+            other.commit()
+
+    migrations.rebuild_table(conn, 'ads', newtablequery, ['uid', 'title'], key=key, batchsize=10, onbatch=write_between_batches)
+
+    assert len(batches) >= 2
+    rows = dict(conn.execute("SELECT uid, title FROM ads;").fetchall())
+    expected = dict([(uid, 'ad %d' % (uid)) for uid in range(101) if uid not in (1, 2, 95)])
+    expected[3] = 'changed'
+    assert rows == expected
+    assert migrations.get_columns(conn, 'ads') == ['uid', 'title', 'seen']
+    names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL;").fetchall()]
+    assert names == ['idx_ads_title']
+    other.close()
+    conn.close()
+
+
+def test_concurrent_migrate_applies_each_migration_once(tmp_path, monkeypatch):
+    dbpath = str(tmp_path / 'jobs.db')
+    make_table(dbpath, 10).close()
+    applied = []
+
+    def add_seen(conn):
+        applied.append(threading.get_ident())
+        migrations.add_column(conn, 'ads', 'seen INTEGER')
+
+    def rekey(conn):
+        applied.append(threading.get_ident())
+        migrations.rebuild_table(conn, 'ads', """CREATE TABLE ads (uid INTEGER PRIMARY KEY, title TEXT, seen INTEGER);""",
+                                 ['uid', 'title', 'seen'], key=['uid'])
+
+    monkeypatch.setitem(migrations.MIGRATIONS, 'jobs.db', [
+        migrations.Migration(1, 'baseline schema', migrations._baseline),
+        migrations.Migration(2, 'add seen', add_seen),
+        migrations.Migration(3, 'key ads by uid', rekey),
+    ])
+    versions, errors = [], []
+
+    def job():
+        conn = connect_db(dbpath)
+        try:
+            versions.append(migrations.migrate(conn, 'jobs.db'))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            close_db(conn)
+
+    threads = [threading.Thread(target=job) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert versions == [3] * 6
+    assert len(applied) == 2
+    conn = sqlite3.connect(dbpath)
+    assert migrations.get_version(conn) == 3
+    assert conn.execute("SELECT COUNT(*) FROM ads;").fetchone()[0] == 10
+    conn.close()
+
+
+def test_pad_listing_postdates():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE jobadpageurls (uid VARCHAR(10), postdate DATE, title TEXT, PRIMARY KEY(uid, postdate));")
+    conn.executemany("INSERT INTO jobadpageurls (uid, postdate, title) VALUES (?,?,?);", [
+        ('1', '2018-3-5', 'old'), ('2', '2018-10-12', 'padded'), ('3', '2018-10-1', 'old'),
+        ('3', '2018-10-01', 'new'), ('4', None, 'no date')])
+    conn.execute("CREATE TABLE frontier (uid VARCHAR(10), postdate DATE, PRIMARY KEY(uid));")
+    conn.execute("INSERT INTO frontier (uid, postdate) VALUES ('1', '2018-3-5');")
+    migrations._pad_listing_postdates(conn, batchsize=2)
+    rows = conn.execute("SELECT uid, postdate, title FROM jobadpageurls ORDER BY uid;").fetchall()
+    # the unpadded duplicate of ad 3 is dropped
+    assert rows == [('1', '2018-03-05', 'old'), ('2', '2018-10-12', 'padded'), ('3', '2018-10-01', 'new'), ('4', None, 'no date')]
+    assert conn.execute("SELECT DATE(postdate) FROM frontier;").fetchone() == ('2018-03-05',)
@@ -0,0 +1,55 @@
+"""
+Check the parts of the OLX listing parser that only showed up against a live
+crawl: the region sector links and the post dates written for each ad.
+"""
+
+import re
+import sqlite3
+import create_databases
+import parsebench
+from olxdownloader import OLXDownloader
+
+
+SECTORPAGE = b'''<html><body><div class="wrapper">
+<a class="topLink tdnone " href="https://olx.jo/en/amman/jobs-sales/">
+<span class="link">Sales</span><span class="counter nowrap">1,234</span></a>
+<a class="topLink tdnone " href="https://olx.jo/en/amman/jobs-it/">
+<span class="link">IT</span><span class="counter nowrap">56</span></a>
+</div></body></html>'''
+
+
+def test_region_sector_links():
+    parser = OLXDownloader.parser(parsebench.PARAMS['olx'])
+    replay = parsebench.Replay(parser)
+    # the class attribute ends with a space on the site, which must not stop the links matching
+    sector, href = replay.run(lambda: parser.get_job_urls('https://olx.jo/en/amman/jobs/'), SECTORPAGE)
+    assert sector == {'Sales': '1234', 'IT': '56'}
+    assert href == {'Sales': 'https://olx.jo/en/amman/jobs-sales/', 'IT': 'https://olx.jo/en/amman/jobs-it/'}
+
+
+def test_listing_postdates_are_iso_dates():
+    fixtures = parsebench.load_fixtures()['olx_jobpage_urls']
+    create, call, volatile = parsebench.EXTRACTORS['olx_jobpage_urls']
+    parser = create(fixtures[0][2])
+    replay = parsebench.Replay(parser)
+    conn = sqlite3.connect(':memory:')
+    postdates = []
+    for file, body, args in fixtures:
+        postdates.extend([row[6] for row in replay.run(lambda: call(parser, body, args), body)])
+    assert len(postdates) > 0
+    for postdate in postdates:
+        # the seed and remaining queries compare postdates with DATE(), which returns NULL unless they are zero-padded
+        assert re.match(r'^\d{4}-\d\d-\d\d$', postdate), postdate
+        assert conn.execute("SELECT DATE(?)", [postdate]).fetchone()[0] == postdate
+
+
+def test_display_tables_without_country():
+    parser = OLXDownloader.parser(parsebench.PARAMS['olx'])
+    parser.conn = create_databases.build_schema('olx')
+    parser.cursor = parser.conn.cursor()
+    parser.conn.execute("CREATE TABLE archivelog (tablename VARCHAR(30), rundate VARCHAR(10));")
+    try:
+        # archivelog has no country column and is only counted
+        parser._display_db_tables()
+    finally:
+        parser.conn.close()
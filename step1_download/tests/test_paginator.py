@@ -0,0 +1,135 @@
+"""
+Check that an interrupted crawl resumes its listings and picks up listings it
+had no cursor for.
+"""
+
+import datetime
+import sqlite3
+import create_databases
+from paginator import Paginator
+
+
+NOW = datetime.datetime(2026, 10, 1, 12, 0)
+
+
+def get_conn():
+    conn = sqlite3.connect(':memory:')
+    for query in create_databases.get_listingcursor_table_schema().values():
+        conn.execute(query)
+    return(conn)
+
+
+def crawl(conn, listings, pages, now, stop=None):
+    """Crawl listings whose pages are <url>/<n> up to pages[listing], failing every page
+    from stop on.  Returns the urls fetched.
+    """
+
+    fetched = []
+
+    def fetch(urls):
+        fetched.extend(urls)
+        return([None if stop is not None and len(fetched) - len(urls) + i >= stop else url for i, url in enumerate(urls)])
+
+    def parse(listing, url, body):
+        n = int(url.rsplit('/', 1)[1])
+        return(None if n >= pages[listing] else '%s/%d' % (listings[listing].rsplit('/', 1)[0], n + 1))
+
+    paginator = Paginator(conn, lambda query, rows: conn.executemany(query, rows), conn.commit, 'jordan', width=2)
+    paginator.run(listings, fetch, parse, now=now)
+    return(fetched)
+
+
+def test_resume_merges_new_listings():
+    conn = get_conn()
+    listings = {'a': 'a/1', 'b': 'b/1'}
+    pages = {'a': 1, 'b': 3, 'c': 2}
+    # a finishes in the first round, b fails on its second page
+    assert crawl(conn, listings, pages, NOW, stop=2) == ['a/1', 'b/1', 'b/2']
+
+    # a category added since the crawl started joins it, a is not crawled again
+    listings['c'] = 'c/1'
+    fetched = crawl(conn, listings, pages, NOW + datetime.timedelta(hours=1))
+    assert sorted(fetched) == ['b/2', 'b/3', 'c/1', 'c/2']
+    rows = conn.execute("SELECT listing, started, finished FROM listingcursors ORDER BY listing;").fetchall()
+    assert rows == [('a', '2026-10-01 12:00:00', 1), ('b', '2026-10-01 12:00:00', 1), ('c', '2026-10-01 12:00:00', 1)]
+
+    # a finished crawl starts again from the first pages
+    fetched = crawl(conn, listings, pages, NOW + datetime.timedelta(hours=2))
+    assert sorted(fetched) == ['a/1', 'b/1', 'b/2', 'b/3', 'c/1', 'c/2']
+
+
+def test_expired_crawl_starts_again():
+    conn = get_conn()
+    listings = {'a': 'a/1', 'b': 'b/1'}
+    pages = {'a': 2, 'b': 2}
+    crawl(conn, listings, pages, NOW, stop=1)
+    fetched = crawl(conn, listings, pages, NOW + datetime.timedelta(hours=48))
+    assert sorted(fetched) == ['a/1', 'a/2', 'b/1', 'b/2']
+
+
+def summary_page(uid, date, nexturl):
+    """A Tanqeeb summary page listing one ad posted on date, linking to nexturl."""
+
+    link = '' if nexturl is None else '<link rel="next" href="%s">' % (nexturl)
+    return(('''<html><head>%s</head><body><div id="jobs_list">
+<div id="job_%d" data-id="%d" class="job"><a href="/en/jobs/view/%d">Accountant</a>
+<div class="meta-desc"><a>Company</a> %d %s %d</div><p>Description</p></div>
+</div></body></html>''' % (link, uid, uid, uid, date.day, date.strftime('%B'), date.year)).encode('utf-8'))
+
+
+class SummaryPages(object):
+    """Answers fetch_many with summary pages of one category, pages dated a day apart,
+    failing every request from the failat-th one on.
+    """
+
+    def __init__(self, url, today, pages, failat=None):
+        self.urls = ['%s?page=%d' % (url, n) for n in range(1, pages + 1)]
+        self.urls[0] = url
+        self.today = today
+        self.failat = failat
+        self.fetched = []
+
+    def fetch_many(self, urls):
+        bodies = []
+        for url in urls:
+            self.fetched.append(url)
+            n = self.urls.index(url)
+            failed = self.failat is not None and len(self.fetched) > self.failat
+            nexturl = self.urls[n + 1] if n + 1 < len(self.urls) else None
+            bodies.append(None if failed else summary_page(n + 1, self.today - datetime.timedelta(days=n), nexturl))
+        return(bodies)
+
+
+def test_resumed_crawl_keeps_stop_date(tmp_path, monkeypatch):
+    from config import FileConfig
+    from dbconnect import close_db
+    from tanqeebdownloader import TanQeebDownloader
+
+    monkeypatch.setattr(FileConfig, 'EXTDIR', str(tmp_path))
+    (tmp_path / 'tanqeeb').mkdir()
+    params = {"country": "jordan", "webname": "jordan", "timezone": "Asia/Amman", "url": "http://localhost/"}
+    categories = [('Finance', 'Accounting', 'en/jobs/accounting')]
+
+    def crawl(pages):
+        downloader = TanQeebDownloader(params)
+        monkeypatch.setattr(TanQeebDownloader, 'engine', property(lambda self: pages))
+        # ads are collected back to the newest postdate already downloaded
+        downloader.lastdownloaddate = downloader._last_download_date('jobadpageurls', 'postdate')
+        downloader.get_jobad_summary_pages(categories)
+        downloader._sync()
+        postdates = [row[0] for row in downloader.conn.execute("SELECT postdate FROM jobadpageurls ORDER BY postdate DESC;")]
+        close_db(downloader.conn)
+        return(postdates)
+
+    today = datetime.datetime.now(TanQeebDownloader.parser(params).tz).date()
+    url = params['url'] + categories[0][2]
+    # the crawl is interrupted after the first of four pages
+    first = SummaryPages(url, today, 4, failat=1)
+    assert len(crawl(first)) == 1
+    assert first.fetched == [url, url + '?page=2']
+
+    # the ad written by the interrupted crawl is from today, the resumed crawl still pages back past it
+    second = SummaryPages(url, today, 4)
+    postdates = crawl(second)
+    assert second.fetched == [url + '?page=2', url + '?page=3', url + '?page=4']
+    assert postdates == [(today - datetime.timedelta(days=n)).strftime('%Y-%m-%d') for n in range(4)]
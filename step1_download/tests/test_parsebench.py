@@ -0,0 +1,31 @@
+"""
+Check that every extractor still extracts the recorded rows from its fixture
+pages, with and without subtree selection.  After an intended change to what
+an extractor returns, record the new digests with python src/parsebench.py --digests.
+"""
+
+import pytest
+import htmlparse
+import parsebench
+
+
+DIGESTS = parsebench.load_digests()
+
+
+@pytest.fixture
+def strain(request):
+    previous = (htmlparse.get_backend(), htmlparse._strain)
+    htmlparse.set_backend('html.parser', strain=request.param)
+    yield request.param
+    htmlparse.set_backend(previous[0], strain=previous[1])
+
+
+def test_every_extractor_has_a_digest():
+    assert sorted(parsebench.load_fixtures().keys()) == sorted(DIGESTS.keys())
+
+
+@pytest.mark.parametrize('strain', [False, True], ids=['full', 'subtree'], indirect=True)
+@pytest.mark.parametrize('name', sorted(DIGESTS.keys()))
+def test_fixture_rows(name, strain):
+    results = parsebench.run([name], repeat=1)
+    assert results['extractors'][name]['rows'] == DIGESTS[name]
@@ -0,0 +1,34 @@
+"""
+Check that a job in a worker of a process pool parses without starting a pool of its own.
+"""
+
+import concurrent.futures
+import multiprocessing
+
+import pipeline
+
+
+def _pool_type():
+    return(type(pipeline.get_parse_pool(1)).__name__)
+
+
+def _fail():
+    raise ValueError('parse failed')
+
+
+def test_parse_pool_in_worker():
+    pool = pipeline.get_parse_pool(1)
+    try:
+        assert isinstance(pool, concurrent.futures.ProcessPoolExecutor)
+    finally:
+        pool.shutdown(wait=True)
+    # workers of a multiprocessing pool are daemons, as are those of a process pool before python 3.9
+    with multiprocessing.Pool(1) as workers:
+        assert workers.apply(_pool_type) == 'InlineExecutor'
+
+
+def test_inline_executor():
+    executor = pipeline.InlineExecutor()
+    assert executor.submit(max, 1, 2).result() == 2
+    future = executor.submit(_fail)
+    assert isinstance(future.exception(), ValueError)
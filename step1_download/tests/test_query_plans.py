@@ -0,0 +1,58 @@
+"""
+Build each downloader schema in memory and check that the reads run on every
+download use the index declared for them.  The queries are the ones the
+downloaders run, taken from create_databases.get_hot_queries.
+"""
+
+import pytest
+import create_databases
+
+
+# index each hot query is expected to search, by (schema, query name), followed by
+# the columns it searches where the query must use a range of the index
+EXPECTED = {
+    ('olx', 'region_sector_urls'): 'idx_jobadpageurls_region_sector',
+    ('olx', 'remaining_urls'): 'idx_jobadpageurls_region_sector',
+    ('olx', 'frontier_seed'): 'idx_jobadpagedata_country_stat',
+    ('olx', 'revisit_history'): 'idx_jobadpagedata_uid',
+    ('wuzzuf', 'remaining_urls'): 'idx_jobadpageurls_country_postdate (country=? AND postdate>? AND postdate<?)',
+    ('wuzzuf', 'frontier_seed'): 'idx_jobadpageurls_country_postdate (country=? AND postdate>?)',
+    ('wuzzuf', 'revisit_history'): 'sqlite_autoindex_jobadpage_1',
+    ('tanqeeb', 'new_jobad_pages'): 'idx_pendingads_country_fetched',
+    ('frontier', 'due'): 'idx_frontier_due',
+    ('pagevisits', 'hashes'): 'sqlite_autoindex_pagehashes_1',
+    ('pagevisits', 'unchanged'): 'sqlite_autoindex_unchangedvisits_1',
+}
+
+HOTQUERIES = sorted([(schema, name, query) for schema, queries in create_databases.get_hot_queries().items()
+                     for name, query in queries.items()])
+
+
+def query_plan(conn, query):
+    return([row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, [None] * query.count('?')).fetchall()])
+
+
+def test_every_hot_query_has_an_expected_index():
+    assert sorted(EXPECTED) == sorted([(schema, name) for schema, name, query in HOTQUERIES])
+
+
+@pytest.mark.parametrize('schema,name,query', HOTQUERIES, ids=['%s-%s' % (schema, name) for schema, name, query in HOTQUERIES])
+def test_hot_query_uses_index(schema, name, query):
+    conn = create_databases.build_schema(schema)
+    try:
+        plan = query_plan(conn, query)
+        assert create_databases.check_query_plans(conn, {name: query}) == {}, plan
+        index = EXPECTED[(schema, name)]
+        assert any([step.startswith('SEARCH') and (' %s ' % (index)) in step + ' ' for step in plan]), plan
+    finally:
+        conn.close()
+
+
+def test_declared_indexes_are_created():
+    for schema, (tables, indexes) in create_databases.get_schemas().items():
+        conn = create_databases.build_schema(schema)
+        try:
+            created = set([row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index';")])
+            assert set(indexes) <= created, schema
+        finally:
+            conn.close()
@@ -0,0 +1,20 @@
+"""
+Check that closing the sqlite resume store releases its connection.
+"""
+
+import sqlite3
+import pytest
+import dbconnect
+from resumestore import SqliteResumeStore
+
+
+def test_close_releases_connection(tmp_path):
+    store = SqliteResumeStore(str(tmp_path / 'resumes.db'))
+    store.upsert([{'_id': 1, 'name': 'resume'}])
+    conn = store.conn
+    # looking the connection up again does not take another reference
+    assert store.get(1)['name'] == 'resume'
+    store.close()
+    assert conn not in dbconnect._connections.values()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1;")
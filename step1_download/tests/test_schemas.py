@@ -0,0 +1,40 @@
+"""
+Check that the statements the downloaders write with, and the reads that join
+several tables, are valid against the schemas create_databases builds, so a
+table or column renamed on one side only fails here instead of on a fresh
+database.
+"""
+
+import pytest
+import create_databases
+
+
+def get_write_statements():
+    from basedownloader import BaseDownloader
+    from olxdownloader import OLXDownloader
+    from tanqeebdownloader import TanQeebDownloader
+    from wuzzufdownloader import WuzzufDownloader
+
+    return({
+        ('olx', 'jobpagequery'): OLXDownloader.jobpagequery,
+        ('olx', 'changedregionsquery'): OLXDownloader.changedregionsquery,
+        ('wuzzuf', 'jobpagequery'): WuzzufDownloader.jobpagequery,
+        ('tanqeeb', 'jobadpagequery'): TanQeebDownloader.jobadpagequery,
+        ('tanqeeb', 'pendingquery'): TanQeebDownloader.pendingquery,
+        ('tanqeeb', 'fetchedquery'): TanQeebDownloader.fetchedquery,
+        ('pagevisits', 'pagehashquery'): BaseDownloader.pagehashquery,
+        ('pagevisits', 'unchangedquery'): BaseDownloader.unchangedquery,
+    })
+
+
+STATEMENTS = sorted(get_write_statements().items())
+
+
+@pytest.mark.parametrize('key,query', STATEMENTS, ids=['%s-%s' % key for key, query in STATEMENTS])
+def test_write_statement_compiles(key, query):
+    conn = create_databases.build_schema(key[0])
+    try:
+        # EXPLAIN prepares the statement without running it, so missing tables or columns raise
+        conn.execute('EXPLAIN ' + query, [None] * query.count('?')).fetchall()
+    finally:
+        conn.close()
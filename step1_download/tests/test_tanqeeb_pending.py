@@ -0,0 +1,32 @@
+"""
+Check that Tanqeeb ads whose page is gone are not requested again.
+"""
+
+from config import FileConfig
+from dbconnect import close_db
+from tanqeebdownloader import TanQeebDownloader
+
+
+class Engine(object):
+    def __init__(self, gone):
+        self.gone = gone
+
+    def is_gone(self, *urls):
+        return(any([url in self.gone for url in urls]))
+
+
+def test_gone_ads_are_not_pending(tmp_path, monkeypatch):
+    monkeypatch.setattr(FileConfig, 'EXTDIR', str(tmp_path))
+    (tmp_path / 'tanqeeb').mkdir()
+    params = {"country": "jordan", "webname": "jordan", "timezone": "Asia/Amman", "url": "http://localhost/"}
+    downloader = TanQeebDownloader(params)
+    downloader._execute(downloader.pendingquery, [['jordan', '1', 'en/jobs/view/1', '2026-10-01'],
+                                                  ['jordan', '2', 'en/jobs/view/2', '2026-10-01']])
+    # the page of ad 1 returned 404, the request for ad 2 failed
+    engine = Engine(set(['http://localhost/en/jobs/view/1']))
+    monkeypatch.setattr(TanQeebDownloader, 'engine', property(lambda self: engine))
+    monkeypatch.setattr(downloader, '_pipeline_pages', lambda items: [(item, None, None) for item in items])
+    downloader.get_new_jobad_pages()
+    downloader._sync()
+    assert downloader.conn.execute(downloader.newpagesquery, ['jordan']).fetchall() == [('2', 'en/jobs/view/2')]
+    close_db(downloader.conn)
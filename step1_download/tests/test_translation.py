@@ -0,0 +1,34 @@
+"""
+Check that the translation cache keeps the translations of each backend apart.
+"""
+
+import translation
+
+
+class RecordingBackend(translation.LocalBackend):
+    name = 'google'
+
+    def translate(self, texts, dest='en'):
+        with self.lock:
+            self.requests.append(list(texts))
+        return(['translated %s' % (text) for text in texts])
+
+
+def test_cache_is_kept_per_backend(tmp_path):
+    cache = translation.TranslationCache(str(tmp_path / 'translations.db'))
+    texts = ['مرحبا بكم.', 'وظيفة محاسب']
+    local = translation.TranslationService(backend=translation.LocalBackend(), cache=cache, rate=1000, burst=10)
+    assert local.translate(texts) == ['[en] مرحبا بكم.', '[en] وظيفة محاسب']
+
+    # a cache filled by LocalBackend is not served to another backend
+    backend = RecordingBackend()
+    service = translation.TranslationService(backend=backend, cache=cache, rate=1000, burst=10)
+    assert service.translate(texts) == ['translated مرحبا بكم.', 'translated وظيفة محاسب']
+    assert sorted(sum(backend.requests, [])) == sorted(texts)
+
+    # and each backend still finds its own translations
+    backend.requests = []
+    assert service.translate(texts) == ['translated مرحبا بكم.', 'translated وظيفة محاسب']
+    assert backend.requests == []
+    assert local.translate(texts) == ['[en] مرحبا بكم.', '[en] وظيفة محاسب']
+    assert local.backend.requests == [texts]
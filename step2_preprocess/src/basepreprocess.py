@@ -194,11 +194,18 @@ class BasePreprocessor(object):
             params = {'xtitle':'Category', 'ytitle':'Change in Job Ads', 'title':'Bottom Category Changes Between (%s) and (%s)\nCountry: %s\nData: %s' % (mindate, maxdate, cty.title(), self.datasrc), 'filename':'jobad_changes_bottom_%s.png' % (cty)}
             self._graph_bar(temp.index, temp['change'], params)
             
+    def _translate_texts(self, texts):
+        """Translate a list of foreign texts to English in one call to the shared
+        translation service, whose cache is shared with the downloaders.
+        """
+        # imported here so preprocessing that does not translate runs without step1_download/src on the path
+        from translation import get_translator
+        return([text if text is None else text.replace('\r',' ').replace('\n','>').encode('utf-8')
+                for text in get_translator().translate(texts)])
+        
     def _translate_text(self, text):
         """Translate foreign text to English"""
-        translator = googletrans.Translator()
-        text = translator.translate(text).text.replace('\r',' ').replace('\n','>').encode('utf-8')
-        return(text)
+        return(self._translate_texts([text])[0])
         
     def _clean_text(self, text):
         """Light cleaning of text that can be used for analysis."""
@@ -142,7 +142,7 @@ class TanQeebPreprocessor(BasePreprocessor):
         #for chunk in chunk_iter:
         df= pd.read_sql(query, self.conn)
         # STEP 1: Clean the text of extraneous words
-        df['description'] = [self._translate_text(self._clean_text(row['description'])) for i, row in df.iterrows()]
+        df['description'] = self._translate_texts([self._clean_text(row['description']) for i, row in df.iterrows()])
         # STEP 2:  Extract key words from database
         df['vocab_words'] = [kw['master'].extract_keywords(row['description']) for i, row in df.iterrows()]
         # STEP 3:  Figure out total counts of keywords